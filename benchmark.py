@@ -0,0 +1,609 @@
+import sys
+import time
+import tracemalloc
+from glob import glob
+from html import unescape
+from math import atan2, degrees
+from xml.parsers import expat
+from xml.sax.saxutils import escape
+
+import numpy as np
+import pandas as pd
+
+import helper
+import loadData
+import mapHelper
+import osmHelper
+
+# The line based parser osmHelper had before the streaming one, kept unchanged
+# (apart from process_way_tags living here now) as the reference for
+# bench_parse.
+#
+# Parameters:
+# lines: a list of lines from the osm file
+#   type-list(str)
+# blacklist: name of blacklist files
+#   type-str
+# whitelist_mode: toggle between using a whitelist or a blacklist
+#   type-bool
+#
+# Returns: tuple of nodes and trail and lift info
+#   type-tuple(df, df, df, list, int, list)
+
+
+def process_osm_original(lines, blacklist, whitelist_mode=False):
+    DEBUG_TRAILS = False
+
+    way_df = pd.DataFrame()
+    lift_df = pd.DataFrame()
+    id = []  # for node_df
+    lat = []  # for node_df
+    lon = []  # for node_df
+    coordinates = []  # for node_df
+    in_way_ids = []  # all OSM ids for a way, used for way_df
+    useful_info_list = []  # list((way_name, difficulty_modifier, is_area))
+    trail_and_id_list = []  # list((trail_name, OSM id))
+    blank_name_count = 0
+    total_trail_count = 0
+
+    in_way = False
+    way_name = ''
+
+    for row in lines:
+        row = str(row)
+        # handling nodes
+        if '<node' in row:
+            split_row = row.split('"')
+            for i, word in enumerate(split_row):
+                if ' id=' in word:
+                    id.append(split_row[i+1])
+                if 'lat=' in word:
+                    lat.append(float(split_row[i+1]))
+                if 'lon=' in word:
+                    lon.append(float(split_row[i+1]))
+            coordinates.append((lat[-1], lon[-1]))
+        # start of a way
+        if '<way' in row:
+            in_way = True
+            is_trail = False
+            is_glade = False
+            is_backcountry = False
+            is_area = False
+            is_lift = False
+            glade_override = False
+            difficulty_modifier = 0
+            way_id = row.split('"')[1]
+            if (str(way_id) not in blacklist) and whitelist_mode:
+                in_way = False
+            if (str(way_id) in blacklist) and not whitelist_mode:
+                in_way = False
+        # handling when inside a way
+        if in_way:
+            if '</way>' in row:
+                if glade_override and is_glade:
+                    difficulty_modifier -= 1
+                if is_trail and not is_backcountry:
+                    total_trail_count += 1
+                    trail_and_id_list.append((way_name, way_id))
+                    if DEBUG_TRAILS:
+                        way_name = way_id
+                    if way_name == '':
+                        way_name = ' _' + str(blank_name_count)
+                        blank_name_count += 1
+                    if way_name in way_df.columns:
+                        way_name = way_name + '_' + str(blank_name_count)
+                        blank_name_count += 1
+                    temp_df = pd.DataFrame()
+                    temp_df[way_name] = in_way_ids
+                    way_df = pd.concat([way_df, temp_df], axis=1)
+                    useful_info_list.append(
+                        (way_name, difficulty_modifier, is_area, way_id))
+                if is_lift:
+                    trail_and_id_list.append((way_name, way_id))
+                    if DEBUG_TRAILS:
+                        way_name = way_id
+                    if way_name == '':
+                        way_name = ' _' + str(blank_name_count)
+                        blank_name_count += 1
+                    if way_name in lift_df.columns:
+                        way_name = way_name + '_' + str(blank_name_count)
+                        blank_name_count += 1
+                    temp_df = pd.DataFrame()
+                    temp_df[way_name] = in_way_ids
+                    lift_df = pd.concat([lift_df, temp_df], axis=1)
+                in_way_ids = []
+                in_way = False
+                way_name = ''
+            else:
+                tags = process_way_tags_loop(row, difficulty_modifier, is_trail, is_lift, is_glade, is_area,is_backcountry, glade_override)
+                if tags[0] != '':
+                    in_way_ids.append(tags[0])
+                if tags[1] != '':
+                    way_name = tags[1]
+                _, _, difficulty_modifier, is_trail, is_lift, is_glade, is_area, is_backcountry, glade_override = tags
+    node_df = pd.DataFrame()
+    node_df['id'] = id
+    node_df['lat'] = lat
+    node_df['lon'] = lon
+    node_df['coordinates'] = coordinates
+
+    return (node_df, way_df, lift_df, useful_info_list, total_trail_count, trail_and_id_list)
+
+# Parameters:
+# old: output of process_osm_original
+#   type-tuple(df, df, df, list, int, list)
+# new: output of osmHelper.process_osm_file
+#   type-tuple(tuple(array, array, array), tuple(array, array, df))
+#
+# Returns: whether both parsers found the same nodes, trails and lifts. Names
+# are compared unescaped, the original parser kept entities like &amp;.
+#   type-bool
+
+
+def same_osm_output(old, new):
+    node_df, way_df, lift_df, useful_info_list, _, trail_and_id_list = old
+    (node_id, node_lat, node_lon), ways = new
+    way_info = ways[2]
+    old_id = node_df['id'].astype('int64').to_numpy()
+    order = np.argsort(old_id, kind='stable')
+    if not (np.array_equal(old_id[order], node_id) and np.array_equal(node_df['lat'].to_numpy()[order], node_lat)
+            and np.array_equal(node_df['lon'].to_numpy()[order], node_lon)):
+        return False
+    if len(trail_and_id_list) != len(way_info):
+        return False
+    trail = 0
+    lift = 0
+    for i, (name, way_id, difficulty_modifier, is_area, is_lift) in enumerate(way_info.itertuples(index=False)):
+        if (unescape(trail_and_id_list[i][0]), trail_and_id_list[i][1]) != (name, way_id):
+            return False
+        if is_lift:
+            old_nodes = lift_df.iloc[:, lift].dropna()
+            lift += 1
+        else:
+            old_nodes = way_df.iloc[:, trail].dropna()
+            if useful_info_list[trail][1:] != (difficulty_modifier, is_area, way_id):
+                return False
+            trail += 1
+        if not np.array_equal(old_nodes.astype('int64').to_numpy(), osmHelper.get_way_nodes(ways, i)):
+            return False
+    return True
+
+# Parameters:
+# function: function to measure
+#   type-function
+# args: arguments for function
+#   type-tuple
+#
+# Returns: output of function, seconds taken and peak memory (MB)
+#   type-tuple(any, float, float)
+
+
+def measure(function, *args):
+    start = time.perf_counter()
+    output = function(*args)
+    seconds = time.perf_counter() - start
+    tracemalloc.start()
+    function(*args)
+    peak = tracemalloc.get_traced_memory()[1] / 1e6
+    tracemalloc.stop()
+    return (output, seconds, peak)
+
+# Parameters:
+# filename: path to the osm file
+#   type-str
+#
+# Returns: output of the line based parser
+#   type-tuple(df, df, df, list, int, list)
+
+
+def read_osm_lines(filename):
+    with open(filename, 'r') as file:
+        return process_osm_original(file.readlines(), [])
+
+# Times the line based parser against the streaming parser on every osm file.
+#
+# Parameters:
+# folder: directory with the osm files
+#   type-str
+#
+# Return: none
+
+
+def bench_parse(folder='osm'):
+    totals = [0, 0, 0, 0]
+    mismatches = []
+    row = '{:<36}{:>9}{:>9}{:>9}{:>9}'
+    print(row.format('file', 'lines', 'stream', 'lines', 'stream'))
+    for filename in sorted(glob('{}/*.osm'.format(folder))):
+        old, old_time, old_peak = measure(read_osm_lines, filename)
+        new, new_time, new_peak = measure(
+            osmHelper.process_osm_file, filename, [])
+        if not same_osm_output(old, new):
+            mismatches.append(filename)
+        result = [old_time, new_time, old_peak, new_peak]
+        totals = [x + y for x, y in zip(totals, result)]
+        print(row.format(filename.split('/')[-1], '{:.3f}s'.format(old_time), '{:.3f}s'.format(
+            new_time), '{:.1f}MB'.format(old_peak), '{:.1f}MB'.format(new_peak)))
+    print(row.format('total', '{:.3f}s'.format(totals[0]), '{:.3f}s'.format(
+        totals[1]), '{:.1f}MB'.format(totals[2]), '{:.1f}MB'.format(totals[3])))
+    if mismatches:
+        print('Output differs for: {}'.format(', '.join(mismatches)))
+
+
+# The bisection loop fill_in_point_gaps used before it was vectorized, kept as
+# the reference for bench_densify.
+#
+# Parameters:
+# df: trail with lat, lon and coordinates columns
+#   type-df(float, float, tuple)
+# max_gap: longest allowed distance between points (meters)
+#   type-float
+#
+# Returns: lat and lon lists with the gaps filled in
+#   type-tuple(list, list)
+
+
+def fill_in_point_gaps_bisect(df, max_gap):
+    lat = df['lat'].tolist()
+    lon = df['lon'].tolist()
+    coordinates = df['coordinates'].tolist()
+    done = False
+    while not done:
+        distances = helper.calculate_dist(coordinates)
+        not_changed = 0
+        for index, point in enumerate(distances):
+            if point > max_gap and index > 0:
+                new_lat = (lat[index]+lat[index-1])/2
+                new_lon = (lon[index]+lon[index-1])/2
+                lat.insert(index, new_lat)
+                lon.insert(index, new_lon)
+                coordinates.insert(index, (new_lat, new_lon))
+                break
+            not_changed += 1
+        if not_changed == len(coordinates):
+            done = True
+    return (lat, lon)
+
+# Times the bisection loop against the vectorized densifier on the longest
+# lifts in the osm files (lifts are filled in to 50 meter gaps).
+#
+# Parameters:
+# folder: directory with the osm files
+#   type-str
+# count: number of lifts to time
+#   type-int
+#
+# Return: none
+
+
+def bench_densify(folder='osm', count=10):
+    lifts = []
+    for filename in sorted(glob('{}/*.osm'.format(folder))):
+        node_index, ways = osmHelper.process_osm_file(filename, [])
+        way_info = ways[2]
+        for index in way_info.index[way_info.is_lift]:
+            df = osmHelper.resolve_way(
+                node_index, osmHelper.get_way_nodes(ways, index))
+            length = helper.get_trail_length(df.coordinates)
+            lifts.append((length, filename.split('/')[-1], way_info.name[index], df))
+    lifts.sort(key=lambda x: x[0], reverse=True)
+
+    row = '{:<24}{:<22}{:>8}{:>10}{:>10}{:>8}{:>12}'
+    print(row.format('file', 'lift', 'length', 'bisect', 'vector', 'points', 'max diff'))
+    for length, filename, name, df in lifts[:count]:
+        start = time.perf_counter()
+        old_lat, old_lon = fill_in_point_gaps_bisect(df, 50)
+        old_time = time.perf_counter() - start
+        start = time.perf_counter()
+        new_df = helper.fill_in_point_gaps(df, 50)
+        new_time = time.perf_counter() - start
+        if len(old_lat) == len(new_df):
+            difference = max(np.abs(np.array(old_lat) - new_df.lat).max(),
+                             np.abs(np.array(old_lon) - new_df.lon).max())
+            difference = '{:.1e}'.format(difference)
+        else:
+            difference = '{} vs {}'.format(len(old_lat), len(new_df))
+        print(row.format(filename[:23], name[:21], '{:.0f}m'.format(length), '{:.4f}s'.format(
+            old_time), '{:.4f}s'.format(new_time), len(new_df), difference))
+
+
+# The per point loop mapHelper.get_label_placement used before it worked from
+# a running total, kept as the reference for bench_labels.
+#
+# Parameters:
+# df: dataframe with columns for lat, lon, and coordinates
+#   type-df(float, float, tuple)
+# length: number of characters in label
+#   type-int
+#
+# Returns: tuple with point number and angle
+#   type-tuple(float, float)
+
+
+def get_label_placement_loop(df, length, flip_lat_lon):
+    point_count = len(df.coordinates)
+    point_gap = sum(helper.calculate_dist(df.coordinates)[1:])/point_count
+    letter_size = 10 / point_gap
+    label_length = point_gap * length * letter_size
+    label_length_in_points = int(label_length / point_gap)
+    point = int(len(df.coordinates)/2)
+    angle_list = []
+    valid_list = []
+    for i, _ in enumerate(df.coordinates):
+        valid = False
+        if helper.get_trail_length(df.coordinates[0:i]) > label_length / 2:
+            if helper.get_trail_length(df.coordinates[i:-1]) > label_length / 2:
+                valid = True
+        if i == 0:
+            ang = 0
+        else:
+            dx = (df.lat[i])-(df.lat[i-1])
+            dy = (df.lon[i])-(df.lon[i-1])
+            ang = degrees(atan2(dx, dy))
+        angle_list.append(ang)
+        valid_list.append(valid)
+    frac_correct = (1, 0, 0)
+    for i, _ in enumerate(angle_list):
+        if valid_list[i]:
+            slice = angle_list[i-int(label_length_in_points / 2):i +
+                               int(label_length_in_points / 2)]
+            if len(slice) == 0:
+                continue
+            expected = sum(slice) / len(slice)
+            frac_correct_current = 0
+            correct = 0
+            for value in slice:
+                if abs(value-expected) < 5:
+                    correct += 1
+            frac_correct_current = correct / len(slice)
+            if frac_correct_current > frac_correct[1]:
+                frac_correct = (i, frac_correct_current, 0)
+    if frac_correct[1] != 0:
+        point = frac_correct[0]
+    if point == 0:
+        dx = 0
+        dy = 0
+    else:
+        dx = (df.lat[point])-(df.lat[point-1])
+        dy = (df.lon[point])-(df.lon[point-1])
+        if point > 1 and dx == 0 and dy == 0:
+            dx = (df.lat[point])-(df.lat[point-2])
+            dy = (df.lon[point])-(df.lon[point-2])
+    ang = degrees(atan2(dx, dy))
+    if flip_lat_lon:
+        if ang < -90:
+            ang -= 180
+        if ang > 90:
+            ang -= 180
+        return(point, ang)
+    ang -= 90
+    if ang < -90:
+        ang += 180
+    return(point, ang)
+
+# Times the per point label placement loop against the running total version
+# on every trail and lift longer than 200 meters (the ones that get labels),
+# and checks both pick the same point and angle.
+#
+# Parameters:
+# folder: directory with the osm files
+#   type-str
+# count: number of osm files to use
+#   type-int
+#
+# Return: none
+
+
+def bench_labels(folder='osm', count=10):
+    row = '{:<28}{:>8}{:>10}{:>10}{:>10}'
+    print(row.format('file', 'labels', 'loop', 'prefix', 'differ'))
+    for filename in sorted(glob('{}/*.osm'.format(folder)))[:count]:
+        node_index, ways = osmHelper.process_osm_file(filename, [])
+        way_info = ways[2]
+        objects = []
+        for index, name, is_lift in zip(way_info.index, way_info.name, way_info.is_lift):
+            df = osmHelper.resolve_way(
+                node_index, osmHelper.get_way_nodes(ways, index))
+            df = helper.fill_in_point_gaps(df, 50 if is_lift else 15)
+            if not is_lift:
+                df['coordinates'] = loadData.rounded_coordinates(df)
+            if len(df) > 1 and helper.get_trail_length(df.coordinates) > 200:
+                objects.append((df, len(name) + 6))
+        old_time = 0
+        new_time = 0
+        differ = 0
+        for df, length in objects:
+            for flip_lat_lon in (False, True):
+                start = time.perf_counter()
+                old = get_label_placement_loop(df, length, flip_lat_lon)
+                old_time += time.perf_counter() - start
+                start = time.perf_counter()
+                new = mapHelper.get_label_placement(df, length, flip_lat_lon)
+                new_time += time.perf_counter() - start
+                differ += old != new
+        print(row.format(filename.split('/')[-1][:27], len(objects), '{:.3f}s'.format(
+            old_time), '{:.3f}s'.format(new_time), differ))
+
+
+# The per line tag checks osmHelper used before the rule table, kept as the
+# reference for bench_tags. Matching on substrings of the whole line makes any
+# tag mentioning "glade" mark the way as a glade.
+#
+# Parameters:
+# line: one line of the osm file
+#   type-str
+# difficulty_modifier: int value for additional difficulty parameters
+#   type-int
+# is_trail: trail flag
+#   type-bool
+# is_lift: lift flag
+#   type-bool
+# is_glade: woods trail flag
+#   type-bool
+# is_area: area flag
+#   type-bool
+# is_backcountry: non-frontside trail flag
+#   type-bool
+# glade_override: overrides is_glade if set
+#   type-bool
+#
+# Return: the modified states of the parameters plus node_id and way_name
+#   type-tuple(str, str, int, bool, bool, bool, bool, bool, bool)
+
+
+def process_way_tags_loop(line, difficulty_modifier, is_trail, is_lift, is_glade, is_area, is_backcountry, glade_override):
+    node_id = ''
+    way_name = ''
+    if '<nd' in line:
+        split_row = line.split('"')
+        node_id = split_row[1]
+    if '<tag k="name"' in line:
+        split_row = line.split('"')
+        way_name = split_row[3]
+    if '<tag k="piste:difficulty"' in line:
+        is_trail = True
+    if '<tag k="piste:type"' in line and 'downhill' in line:
+        is_trail = True
+    if '<tag k="piste:type"' in line and 'backcountry' in line:
+        is_backcountry = True
+    if '<tag k="piste:type"' in line and 'nordic' in line:
+        is_backcountry = True
+    if '<tag k="piste:type"' in line and 'skitour' in line:
+        is_backcountry = True
+    if '<tag k="landuse" v="grass"/>' in line:
+        is_backcountry = True
+    if '<tag k="natural" v="grassland"/>' in line:
+        is_backcountry = True
+    if '<tag k="gladed" v="yes"/>' in line and not is_glade:
+        difficulty_modifier += 1
+        is_glade = True
+    if '<tag k="gladed" v="no"/>' in line:
+        glade_override = True
+    if '<tag k="leaf_type"' in line and not is_glade:
+        difficulty_modifier += 1
+        is_glade = True
+    if '<tag k="leaf_type"' in line or '<tag k="area" v="yes"/>' in line:
+        is_area = True
+    if '<tag k="natural" v="wood"/>' in line:
+        is_area = True
+    if 'glade' in line and not is_glade:
+        difficulty_modifier += 1
+        is_glade = True
+    if 'Glade' in line and not is_glade:
+        difficulty_modifier += 1
+        is_glade = True
+    if '<tag k="aerialway"' in line and not 'v="zip_line"' in line and not 'v="station"' in line:
+        is_lift = True
+    if 'Tree Skiing' in line and not is_glade:
+        difficulty_modifier += 1
+        is_glade = True
+    return((node_id, way_name, difficulty_modifier, is_trail, is_lift, is_glade, is_area, is_backcountry, glade_override))
+
+# osmHelper.read_way on top of process_way_tags_loop
+#
+# Parameters:
+# way_id: OSM id of the way
+#   type-str
+# in_way_ids: node ids of the way
+#   type-list(int)
+# tags: (key, value) tag pairs of the way
+#   type-list(tuple(str, str))
+#
+# Returns: way record for assemble_ways, or None if the way is not a trail or lift
+#   type-tuple(str, str, list(int), int, bool, bool, bool, bool)
+
+
+def read_way_loop(way_id, in_way_ids, tags):
+    state = (0, False, False, False, False, False, False)
+    way_name = ''
+    for key, value in tags:
+        if key == 'name':
+            way_name = value
+        # the tag checks match against the raw osm line, so rebuild it
+        line = '<tag k="{}" v="{}"/>'.format(
+            escape(key, {'"': '&quot;'}), escape(value, {'"': '&quot;'}))
+        state = process_way_tags_loop(line, *state)[2:]
+    difficulty_modifier, is_trail, is_lift, is_glade, is_area, is_backcountry, glade_override = state
+    if glade_override and is_glade:
+        difficulty_modifier -= 1
+    if not ((is_trail and not is_backcountry) or is_lift):
+        return None
+    return (way_id, way_name, in_way_ids, difficulty_modifier,
+            is_trail, is_lift, is_area, is_backcountry)
+
+# Parameters:
+# filename: path to the osm file
+#   type-str
+#
+# Returns: id and (key, value) tags of every way in the file
+#   type-list(tuple(str, list(tuple(str, str))))
+
+
+def read_way_tags(filename):
+    ways = []
+
+    def start_element(name, attrs):
+        if name == 'way':
+            ways.append((attrs['id'], []))
+        elif name == 'tag' and ways and ways[-1] is not None:
+            ways[-1][1].append((attrs.get('k', ''), attrs.get('v', '')))
+        elif name == 'node' or name == 'relation':
+            ways.append(None)
+
+    parser = expat.ParserCreate()
+    parser.StartElementHandler = start_element
+    with open(filename, 'rb') as file:
+        start = file.read(64)
+        file.seek(len(start) - len(start.lstrip()))
+        parser.ParseFile(file)
+    return [x for x in ways if x is not None]
+
+# Times the per line tag checks against the rule table on every way of every
+# osm file, next to the whole streaming parse, and lists the ways they
+# classify differently.
+#
+# Parameters:
+# folder: directory with the osm files
+#   type-str
+#
+# Return: none
+
+
+def bench_tags(folder='osm'):
+    totals = [0, 0, 0, 0]
+    changed = []
+    row = '{:<36}{:>8}{:>9}{:>9}{:>9}'
+    print(row.format('file', 'ways', 'loop', 'rules', 'parse'))
+    for filename in sorted(glob('{}/*.osm'.format(folder))):
+        ways = read_way_tags(filename)
+        start = time.perf_counter()
+        old = [read_way_loop(way_id, [], tags) for way_id, tags in ways]
+        old_time = time.perf_counter() - start
+        start = time.perf_counter()
+        new = [osmHelper.read_way(way_id, [], tags) for way_id, tags in ways]
+        new_time = time.perf_counter() - start
+        start = time.perf_counter()
+        osmHelper.process_osm_file(filename, [])
+        parse_time = time.perf_counter() - start
+        for (way_id, tags), old_record, new_record in zip(ways, old, new):
+            if old_record != new_record:
+                changed.append((filename.split('/')[-1], way_id, old_record, new_record))
+        result = [len(ways), old_time, new_time, parse_time]
+        totals = [x + y for x, y in zip(totals, result)]
+        print(row.format(filename.split('/')[-1][:35], len(ways), '{:.3f}s'.format(
+            old_time), '{:.3f}s'.format(new_time), '{:.3f}s'.format(parse_time)))
+    print(row.format('total', totals[0], '{:.3f}s'.format(totals[1]), '{:.3f}s'.format(
+        totals[2]), '{:.3f}s'.format(totals[3])))
+    for filename, way_id, old_record, new_record in changed:
+        print('{} way {}: {} -> {}'.format(filename, way_id, old_record and old_record[1:2] + old_record[3:],
+                                           new_record and new_record[1:2] + new_record[3:]))
+
+
+benchmarks = {'parse': bench_parse, 'densify': bench_densify,
+              'labels': bench_labels, 'tags': bench_tags}
+
+if __name__ == "__main__":
+    names = sys.argv[1:] if len(sys.argv) > 1 else list(benchmarks)
+    for name in names:
+        print('\n{} benchmark'.format(name))
+        benchmarks[name]()
@@ -0,0 +1,185 @@
+import sqlite3
+from decimal import Decimal
+from os.path import exists
+
+import numpy as np
+import pandas as pd
+from tqdm import tqdm
+
+import helper
+import stageTimer
+import trailManifest
+import trailPoints
+
+CACHE_FILE = 'cached/elevations.sqlite'
+connection = None
+
+# Parameters:
+# values: latitudes or longitudes
+#   type-array(float)
+#
+# Returns: values rounded to 8 decimals, as integer counts of 1e-8 degrees.
+# Rounds exactly like round(Decimal(x), 8), which is how trail coordinates
+# have always been rounded before their elevations are looked up. Densified
+# points often sit right on a rounding tie, so those are rounded with Decimal
+# instead of trusting x * 1e8.
+#   type-array(int64)
+
+
+def round_coordinates(values):
+    values = np.asarray(values, dtype=np.float64)
+    scaled = values * 1e8
+    units = np.rint(scaled)
+    near_tie = np.abs(scaled - np.floor(scaled) - 0.5) < 1e-4
+    for i in np.flatnonzero(near_tie):
+        units[i] = float(round(Decimal(values[i]), 8).scaleb(8))
+    return units.astype(np.int64)
+
+# Parameters:
+# lat: latitudes
+#   type-array(float)
+# lon: longitudes
+#   type-array(float)
+#
+# Returns: cache key of each point. Coordinates are rounded to 8 decimals, then
+# packed into one int64 as 1e-7 degree (about 1 cm) cells.
+#   type-array(int64)
+
+
+def coordinate_keys(lat, lon):
+    lat_cell = round_coordinates(lat) // 10 + 900000000
+    lon_cell = round_coordinates(lon) // 10 + 1800000000
+    return (lat_cell << 32) | lon_cell
+
+# Opens the cache, creating it on first use from the per-resort points in
+# cached/trail_points.
+#
+# Return: connection to the cache
+#   type-sqlite3.Connection
+
+
+def get_connection():
+    global connection
+    if connection is None:
+        new_cache = not exists(CACHE_FILE)
+        connection = sqlite3.connect(CACHE_FILE, timeout=60)
+        connection.execute(
+            'CREATE TABLE IF NOT EXISTS elevations (key INTEGER PRIMARY KEY, elevation REAL)')
+        if new_cache:
+            import_trail_points()
+    return connection
+
+# Loads every resort's cached/trail_points into the cache, except the ones
+# rated from DEM tiles, which would mix DEM elevations into the API's.
+#
+# Return: none
+
+
+def import_trail_points():
+    for mountain in tqdm(trailPoints.cached_mountains(), desc="Importing Elevations…", ascii=False, ncols=75):
+        source = trailManifest.source(mountain)
+        if source is not None and not source.startswith('api '):
+            continue
+        points = trailPoints.load(mountain)
+        store(points['key'], points['elevation'])
+
+# Parameters:
+# keys: cache keys from coordinate_keys
+#   type-array(int64)
+#
+# Returns: elevation of each key (NaN if missing) and whether it was cached.
+# Rows without an elevation, left by older versions that stored NaN, count as
+# missing so the point is looked up again.
+#   type-tuple(array(float), array(bool))
+
+
+def lookup(keys):
+    keys = np.asarray(keys, dtype=np.int64)
+    unique_keys = np.unique(keys)
+    found_keys = []
+    found_elevations = []
+    db = get_connection()
+    for start in range(0, len(unique_keys), 500):
+        chunk = unique_keys[start:start + 500].tolist()
+        rows = db.execute('SELECT key, elevation FROM elevations WHERE elevation IS NOT NULL AND key IN ({})'.format(
+            ','.join('?' * len(chunk))), chunk).fetchall()
+        for key, elevation in rows:
+            found_keys.append(key)
+            found_elevations.append(elevation)
+    elevation = np.full(len(keys), np.nan)
+    found = np.zeros(len(keys), dtype=bool)
+    if found_keys:
+        found_keys = np.array(found_keys, dtype=np.int64)
+        found_elevations = np.array(found_elevations)
+        order = np.argsort(found_keys)
+        found_keys = found_keys[order]
+        position = np.minimum(np.searchsorted(
+            found_keys, keys), len(found_keys) - 1)
+        found = found_keys[position] == keys
+        elevation[found] = found_elevations[order][position[found]]
+    return (elevation, found)
+
+# Parameters:
+# keys: cache keys from coordinate_keys
+#   type-array(int64)
+# elevations: elevation of each key (meters). NaN (no data, or a gap in a
+# response) isn't stored, so the point is looked up again next time.
+#   type-array(float)
+#
+# Return: none
+
+
+def store(keys, elevations):
+    keys = np.asarray(keys, dtype=np.int64)
+    elevations = np.asarray(elevations, dtype=np.float64)
+    known = ~np.isnan(elevations)
+    rows = zip(keys[known].tolist(), elevations[known].tolist())
+    db = get_connection()
+    with db:
+        db.executemany(
+            'INSERT OR REPLACE INTO elevations (key, elevation) VALUES (?, ?)', rows)
+
+# Drop in for helper.get_elevation that only sends the points missing from the
+# cache to the elevation API and caches what comes back. Providers that don't
+# want caching (use_cache = False, like local DEM tiles) are called directly.
+#
+# Parameters:
+# coordinates: list/series of latitude and longitude tuples
+#   type-list/series of tuples
+# last_called: time of the last API call
+#   type-float
+# trail_name: name of ski trail
+#   type-string
+# api_requests: number of api requests made
+#   type-int
+#
+# Returns: elevations, api_requests and last_called, or -1 if the API failed
+#   type-tuple(series, int, float)
+
+
+def get_elevation(coordinates, last_called, trail_name='', api_requests=0):
+    provider = helper.elevation_provider
+    if provider is not None and not getattr(provider, 'use_cache', True):
+        stageTimer.count('provider_points', len(coordinates))
+        with stageTimer.stage('provider'):
+            return helper.get_elevation(coordinates, last_called, trail_name, api_requests)
+    coordinates = list(coordinates)
+    lat, lon = np.array(coordinates, dtype=np.float64).reshape(-1, 2).T
+    keys = coordinate_keys(lat, lon)
+    with stageTimer.stage('cache_lookup'):
+        elevation, found = lookup(keys)
+    stageTimer.count('cache_hits', int(found.sum()))
+    if not found.all():
+        missing = np.flatnonzero(~found)
+        stageTimer.count('provider_points', len(missing))
+        with stageTimer.stage('provider'):
+            result = helper.get_elevation(
+                [coordinates[i] for i in missing], last_called, trail_name, api_requests)
+        if result == -1:
+            return -1
+        elevation[missing] = result[0].astype(float)
+        api_requests = result[1]
+        last_called = result[2]
+        with stageTimer.stage('cache_store'):
+            store(keys[missing], elevation[missing])
+    return (pd.Series(elevation), api_requests, last_called)
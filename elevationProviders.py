@@ -0,0 +1,415 @@
+import hashlib
+import json
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from multiprocessing.managers import BaseManager
+from glob import glob
+from os.path import splitext
+
+import numpy as np
+import requests
+from tqdm import tqdm
+
+import stageTimer
+
+# Elevation providers look up elevations for arrays of points. Any object with
+# a get_elevation(lat, lon) method returning an array of elevations (meters,
+# NaN where there is no data) can be passed to helper.set_elevation_provider.
+# A lookup that fails outright raises ElevationError, as RasterProvider does
+# when its tiles don't cover every point. use_cache tells elevationCache
+# whether results should go through the shared cache.
+
+API_URL = 'https://api.opentopodata.org/v1/ned10m'
+# API_URL = 'https://api.open-elevation.com/api/v1/lookup'
+# API_URL = 'https://api.opentopodata.org/v1/mapzen'
+
+# http status codes worth retrying
+RETRY_STATUS = (429, 500, 502, 503, 504)
+
+
+class ElevationError(Exception):
+    pass
+
+
+class TokenBucket:
+
+    # Parameters:
+    # rate: tokens added per second
+    #   type-float
+    # capacity: most tokens that can be saved up
+    #   type-int
+
+    def __init__(self, rate, capacity=1):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    # Blocks until a token is free and takes it.
+    #
+    # Return: none
+
+    def acquire(self):
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens +
+                                  (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+
+# Serves one TokenBucket to several processes, see shared_rate_limit
+class BucketManager(BaseManager):
+    pass
+
+
+BucketManager.register('TokenBucket', TokenBucket)
+
+
+class ApiProvider:
+    use_cache = True
+    # identity: names where elevations came from, stored with cached results so
+    # switching providers rates every way again
+
+    # Parameters:
+    # url: elevation API endpoint, takes locations=lat,lon|lat,lon|...
+    #   type-str
+    # batch_size: most points sent in one request
+    #   type-int
+    # rate: most requests per second, shared by every worker
+    #   type-float
+    # workers: requests allowed in flight at once
+    #   type-int
+    # retries: times to retry a request that failed for a transient reason
+    #   type-int
+    # backoff: seconds to wait before the first retry, doubled for each one after
+    #   type-float
+    # rate_limit: TokenBucket shared with other providers (a proxy from
+    # BucketManager to share it between processes), None for one of its own
+    #   type-TokenBucket
+
+    def __init__(self, url=API_URL, batch_size=100, rate=1.0, workers=4, retries=5, backoff=1.0, rate_limit=None):
+        self.url = url
+        self.batch_size = batch_size
+        self.rate = rate
+        self.workers = workers
+        self.retries = retries
+        self.backoff = backoff
+        self.shared_rate_limit = rate_limit
+        self.rate_limit = TokenBucket(rate) if rate_limit is None else rate_limit
+        self.session = requests.Session()
+        adapter = requests.adapters.HTTPAdapter(pool_maxsize=workers)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+        self.requests = 0  # requests sent, retries included
+        self.lock = threading.Lock()
+        self.identity = 'api {}'.format(url)
+
+    # sessions and locks can't be pickled, so worker processes get a fresh client
+    # (still sharing a BucketManager rate limit)
+    def __reduce__(self):
+        return (ApiProvider, (self.url, self.batch_size, self.rate, self.workers, self.retries, self.backoff, self.shared_rate_limit))
+
+    # Parameters:
+    # lat: latitudes
+    #   type-array(float)
+    # lon: longitudes
+    #   type-array(float)
+    #
+    # Returns: elevations (meters), NaN where the API has no data
+    #   type-array(float)
+
+    def get_elevation(self, lat, lon):
+        lat = np.asarray(lat, dtype=np.float64)
+        lon = np.asarray(lon, dtype=np.float64)
+        starts = range(0, len(lat), self.batch_size)
+        batches = ['|'.join('{},{}'.format(x, y) for x, y in zip(
+            lat[i:i + self.batch_size].tolist(), lon[i:i + self.batch_size].tolist())) for i in starts]
+        if len(batches) == 0:
+            return np.zeros(0)
+        with ThreadPoolExecutor(self.workers) as pool:
+            results = list(tqdm(pool.map(self.fetch, batches), total=len(batches),
+                                desc="Fetching Elevations…", ascii=False, ncols=75, disable=len(batches) < 2))
+        return np.concatenate(results)
+
+    # Parameters:
+    # piped_coords: coordinates as lat,lon pairs separated by |
+    #   type-str
+    #
+    # Returns: elevation of each coordinate, NaN where the API has no data.
+    # Raises ElevationError once the retries are used up, or right away for an
+    # error that won't go away by retrying.
+    #   type-array(float)
+
+    def fetch(self, piped_coords):
+        for attempt in range(self.retries + 1):
+            wait = self.backoff * 2 ** attempt
+            started = time.perf_counter()
+            self.rate_limit.acquire()
+            stageTimer.count('api_rate_limit_wait',
+                             time.perf_counter() - started)
+            with self.lock:
+                self.requests += 1
+            try:
+                response = self.session.get(
+                    '{}?locations={}'.format(self.url, piped_coords), timeout=60)
+            except requests.exceptions.RequestException as error:
+                problem = str(error)
+            else:
+                if response.status_code == 200:
+                    # a gateway's html page or an error body can come back
+                    # with a 200 too, those are retried like a 5xx
+                    try:
+                        results = response.json()['results']
+                        elevation = np.array([np.nan if x['elevation'] is None else x['elevation']
+                                              for x in results], dtype=np.float64)
+                    except (ValueError, KeyError, TypeError) as error:
+                        problem = 'unreadable response ({!r}): {}'.format(
+                            error, response.content[:200])
+                    else:
+                        if len(elevation) == piped_coords.count('|') + 1:
+                            return elevation
+                        problem = '{} results for {} points'.format(
+                            len(elevation), piped_coords.count('|') + 1)
+                else:
+                    problem = 'code {}: {}'.format(
+                        response.status_code, response.content[:200])
+                    if response.status_code not in RETRY_STATUS:
+                        break
+                retry_after = response.headers.get('Retry-After', '')
+                if retry_after.isdigit():
+                    wait = max(wait, int(retry_after))
+            if attempt < self.retries:
+                stageTimer.count('api_retries')
+                stageTimer.count('api_backoff_wait', wait)
+                time.sleep(wait)
+        raise ElevationError('Elevation API call failed with {}'.format(problem))
+
+# Shares an ApiProvider's rate limit between processes: the bucket lives in a
+# BucketManager process for as long as the context is open and every copy of
+# the provider handed to a worker takes its tokens from it. A worker that is
+# idle or done leaves its share of the rate to the others. Other providers are
+# passed through.
+#
+# Parameters:
+# provider: elevation provider
+#   type-object
+#
+# Returns: provider to hand to the worker processes
+#   type-object
+
+
+@contextmanager
+def shared_rate_limit(provider):
+    if not isinstance(provider, ApiProvider):
+        yield provider
+        return
+    with BucketManager() as manager:
+        yield ApiProvider(provider.url, provider.batch_size, provider.rate, provider.workers,
+                          provider.retries, provider.backoff, manager.TokenBucket(provider.rate))
+
+# Parameters:
+# grid: elevation samples, row 0 on the north edge and column 0 on the west edge
+#   type-array(float)
+# bounds: (west, south, east, north) of the first and last samples
+#   type-tuple(float, float, float, float)
+# lat: latitudes
+#   type-array(float)
+# lon: longitudes
+#   type-array(float)
+# nodata: value used for missing samples
+#   type-float
+#
+# Returns: bilinear interpolated elevations, NaN outside the grid or where a
+# missing sample is one of the corners interpolated from
+#   type-array(float)
+
+
+def sample_grid(grid, bounds, lat, lon, nodata=None):
+    west, south, east, north = bounds
+    rows, cols = grid.shape
+    row = (north - lat) / (north - south) * (rows - 1)
+    col = (lon - west) / (east - west) * (cols - 1)
+    inside = (row >= 0) & (row <= rows - 1) & (col >= 0) & (col <= cols - 1)
+    elevation = np.full(len(lat), np.nan)
+    if not inside.any():
+        return elevation
+    row = row[inside]
+    col = col[inside]
+    row_0 = np.minimum(np.floor(row).astype(np.int64), rows - 2)
+    col_0 = np.minimum(np.floor(col).astype(np.int64), cols - 2)
+    row_frac = row - row_0
+    col_frac = col - col_0
+    # fancy indexing only touches the pages of a memory mapped grid it needs
+    corners = [np.asarray(grid[row_0 + i, col_0 + j], dtype=np.float64)
+               for i, j in ((0, 0), (0, 1), (1, 0), (1, 1))]
+    weights = [(1 - row_frac) * (1 - col_frac), (1 - row_frac) * col_frac,
+               row_frac * (1 - col_frac), row_frac * col_frac]
+    missing = np.zeros(len(row), dtype=bool)
+    if nodata is not None:
+        # a nodata sample only matters if the point is weighted towards it
+        for i in range(4):
+            missing |= (corners[i] == nodata) & (weights[i] > 0)
+            corners[i] = np.where(corners[i] == nodata, 0, corners[i])
+    values = sum(x * w for x, w in zip(corners, weights))
+    values[missing] = np.nan
+    elevation[inside] = values
+    return elevation
+
+# Parameters:
+# directory: folder to save the tile in
+#   type-str
+# name: tile name, without extension
+#   type-str
+# grid: elevation samples, row 0 on the north edge and column 0 on the west edge
+#   type-array(float)
+# bounds: (west, south, east, north) of the first and last samples
+#   type-tuple(float, float, float, float)
+# nodata: value used for missing samples
+#   type-float
+#
+# Return: none
+
+
+def save_tile(directory, name, grid, bounds, nodata=None):
+    np.save('{}/{}.npy'.format(directory, name), np.asarray(grid))
+    west, south, east, north = bounds
+    with open('{}/{}.json'.format(directory, name), 'w') as file:
+        json.dump({'west': west, 'south': south, 'east': east,
+                  'north': north, 'nodata': nodata}, file)
+
+
+class RasterProvider:
+    use_cache = False
+
+    # Parameters:
+    # directory: folder of DEM tiles. A tile is either a .npy grid with a .json
+    # file of the same name holding west, south, east, north (and optionally
+    # nodata), see save_tile, or a GeoTIFF, which needs rasterio installed.
+    # Tiles need at least 2 rows and columns and bounds with some extent.
+    #   type-str
+
+    def __init__(self, directory):
+        self.directory = directory
+        self.tiles = []  # list((grid, bounds, nodata))
+        self.identity = tiles_identity(directory)
+        for filename in sorted(glob('{}/*.npy'.format(directory))):
+            with open(splitext(filename)[0] + '.json', 'r') as file:
+                info = json.load(file)
+            grid = np.load(filename, mmap_mode='r')
+            bounds = (info['west'], info['south'], info['east'], info['north'])
+            self.tiles.append(check_tile(
+                filename, (grid, bounds, info.get('nodata'))))
+        geotiffs = sorted(glob('{}/*.tif'.format(directory)) +
+                          glob('{}/*.tiff'.format(directory)))
+        for filename in geotiffs:
+            self.tiles.append(check_tile(filename, load_geotiff(filename)))
+        if len(self.tiles) == 0:
+            print('No DEM tiles found in {}'.format(directory))
+
+    # worker processes map the tiles again instead of copying them
+    def __reduce__(self):
+        return (RasterProvider, (self.directory,))
+
+    # Parameters:
+    # lat: latitudes
+    #   type-array(float)
+    # lon: longitudes
+    #   type-array(float)
+    #
+    # Returns: elevations (meters). Raises ElevationError if a point is outside
+    # every tile or next to a nodata sample, rating a trail from part of its
+    # points would give it the wrong pitch.
+    #   type-array(float)
+
+    def get_elevation(self, lat, lon):
+        lat = np.asarray(lat, dtype=np.float64)
+        lon = np.asarray(lon, dtype=np.float64)
+        elevation = np.full(len(lat), np.nan)
+        for grid, bounds, nodata in self.tiles:
+            todo = np.flatnonzero(np.isnan(elevation))
+            if len(todo) == 0:
+                break
+            west, south, east, north = bounds
+            near = todo[(lat[todo] >= south) & (lat[todo] <= north) &
+                        (lon[todo] >= west) & (lon[todo] <= east)]
+            if len(near) == 0:
+                continue
+            elevation[near] = sample_grid(
+                grid, bounds, lat[near], lon[near], nodata)
+        missing = np.flatnonzero(np.isnan(elevation))
+        if len(missing) > 0:
+            raise ElevationError('No DEM data in {} for {} of {} points, first at {}, {}'.format(
+                self.directory, len(missing), len(lat), lat[missing[0]], lon[missing[0]]))
+        return elevation
+
+# Parameters:
+# directory: folder of DEM tiles
+#   type-str
+#
+# Returns: identity of the tiles, which changes when a tile is added, removed
+# or rewritten
+#   type-str
+
+
+def tiles_identity(directory):
+    content = hashlib.sha1()
+    for filename in sorted(glob('{}/*'.format(directory))):
+        if splitext(filename)[1] in ('.npy', '.json', '.tif', '.tiff'):
+            stat = os.stat(filename)
+            content.update(repr((os.path.basename(filename), stat.st_size,
+                                 stat.st_mtime_ns)).encode())
+    return 'dem {} {}'.format(os.path.abspath(directory), content.hexdigest())
+
+# Parameters:
+# filename: file the tile was read from, for the error message
+#   type-str
+# tile: grid, bounds and nodata of the tile
+#   type-tuple(array, tuple(float, float, float, float), float)
+#
+# Returns: the tile, if sample_grid can interpolate in it
+#   type-tuple(array, tuple(float, float, float, float), float)
+
+
+def check_tile(filename, tile):
+    grid, bounds, _ = tile
+    west, south, east, north = bounds
+    if grid.ndim != 2 or grid.shape[0] < 2 or grid.shape[1] < 2:
+        raise ValueError('DEM tile {} needs at least 2 rows and 2 columns, it has shape {}'.format(
+            filename, grid.shape))
+    if not (west < east and south < north):
+        raise ValueError('DEM tile {} has empty bounds {}'.format(filename, bounds))
+    return tile
+
+# Parameters:
+# filename: path to a GeoTIFF in geographic (lat/lon) coordinates
+#   type-str
+#
+# Returns: tile for RasterProvider
+#   type-tuple(array, tuple(float, float, float, float), float)
+
+
+def load_geotiff(filename):
+    try:
+        import rasterio
+    except ImportError:
+        raise ImportError(
+            'Reading {} needs rasterio (pip install rasterio)'.format(filename))
+    with rasterio.open(filename) as dataset:
+        grid = dataset.read(1)
+        left, bottom, right, top = dataset.bounds
+        nodata = dataset.nodata
+    # GeoTIFF bounds are cell edges, sample_grid wants cell centers
+    half_x = (right - left) / grid.shape[1] / 2
+    half_y = (top - bottom) / grid.shape[0] / 2
+    bounds = (left + half_x, bottom + half_y, right - half_x, top - half_y)
+    return (grid, bounds, nodata)
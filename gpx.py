@@ -1,71 +1,284 @@
+import os
+import xml.etree.ElementTree as ElementTree
+from concurrent.futures import ProcessPoolExecutor
+from glob import glob
+
+import numpy as np
 import pandas as pd
-import matplotlib.pyplot as plt
+from tqdm import tqdm
 
 import helper
+import trailMatching
+import trailMetrics
+
+# GPX elements whose children are dropped once read, so only the segment being
+# read is held in memory however long the recording is
+STREAMED_ELEMENTS = ('gpx', 'trk', 'trkseg')
 
-# accepts a gpx filename and returns a dataframe
-# with 4 columns: latitude, longitude, lat/lon pairs and elevation (meters)
+# Parameters:
+# filename: name of gpx file
+#   type-string
+#
+# Returns: latitudes, longitudes, elevations (meters, NaN where a point has no
+# <ele>) and times (NaT where a point has no <time>) of each <trkseg> of every
+# <trk>, one segment at a time
+#   type-generator of tuple(array(float), array(float), array(float), array(datetime64))
 
 
-def load_gpx(filename):
-    raw_table = pd.read_csv(filename).to_numpy()
-    df = pd.DataFrame()
+def read_segments(filename):
     lat = []
     lon = []
-    coordinates = []
     elevation = []
-    for row in raw_table:
-        row = str(row)
-        if 'trkpt lat' in row:
-            split_row = row.split('"')
-            lat.append(float(split_row[1]))
-            lon.append(float(split_row[3]))
-            coordinates.append((float(split_row[1]), float(split_row[3])))
-        if 'ele' in row:
-            elevation.append(float(row.split('>')[1].split('<')[0]))
+    time = []
+    parents = []
+    for event, element in ElementTree.iterparse(filename, events=('start', 'end')):
+        if event == 'start':
+            parents.append(element)
+            continue
+        parents.pop()
+        # tags carry the GPX 1.0 or 1.1 namespace
+        name = element.tag.rsplit('}', 1)[-1]
+        if name == 'trkpt':
+            lat.append(float(element.get('lat')))
+            lon.append(float(element.get('lon')))
+            elevation.append(np.nan)
+            time.append(None)
+            for child in element:
+                child_name = child.tag.rsplit('}', 1)[-1]
+                if child_name == 'ele' and child.text:
+                    elevation[-1] = float(child.text)
+                elif child_name == 'time' and child.text:
+                    time[-1] = child.text.strip()
+        elif name == 'trkseg':
+            if len(lat) > 0:
+                times = pd.to_datetime(time, utc=True, errors='coerce')
+                yield (np.array(lat), np.array(lon), np.array(elevation), times.tz_convert(None).to_numpy())
+            lat = []
+            lon = []
+            elevation = []
+            time = []
+        if len(parents) > 0 and parents[-1].tag.rsplit('}', 1)[-1] in STREAMED_ELEMENTS:
+            parents[-1].clear()
+
+# accepts a gpx filename and returns a dataframe with 5 columns: latitude,
+# longitude, lat/lon pairs, elevation (meters) and time of every segment's
+# points one after another
+
+
+def load_gpx(filename):
+    segments = list(read_segments(filename))
+    df = pd.DataFrame()
+    if len(segments) == 0:
+        segments = [(np.zeros(0), np.zeros(0), np.zeros(0),
+                     np.zeros(0, dtype='datetime64[ns]'))]
+    lat, lon, elevation, time = [np.concatenate(x) for x in zip(*segments)]
     df['lat'] = lat
     df['lon'] = lon
-    df['coordinates'] = coordinates
+    df['coordinates'] = list(zip(lat.tolist(), lon.tolist()))
     df['elevation'] = elevation
+    df['time'] = time
+    return df
+
+# Parameters:
+# lat: latitudes of the segment
+#   type-array(float)
+# lon: longitudes of the segment
+#   type-array(float)
+# elevation: elevations of the segment (meters), NaN where missing
+#   type-array(float)
+#
+# Returns: the segment filled in to 15m point gaps with smoothed elevations and
+# its distance, elevation_change, slope and difficulty of every point. None if
+# the segment has fewer than 2 points or no elevations.
+#   type-df
+
+
+def segment_metrics(lat, lon, elevation):
+    # points without an elevation get one from their neighbours
+    elevation = pd.Series(elevation, dtype=float).interpolate(
+        limit_direction='both')
+    if len(lat) < 2 or elevation.isna().all():
+        return None
+    df = pd.DataFrame()
+    df['lat'] = lat
+    df['lon'] = lon
+    df['elevation'] = elevation.to_numpy()
+    df = helper.fill_in_point_gaps(df, 15, 'gpx')
+    df['elevation'] = helper.smooth_elevations(df['elevation'].to_list())
+    metrics = trailMetrics.calculate_trail_metrics(
+        df['lat'], df['lon'], df['elevation'])
+    df['distance'] = metrics[0]
+    df['elevation_change'] = metrics[1]
+    df['slope'] = metrics[2]
+    df['difficulty'] = metrics[3]
     return df
 
 # Parameters:
-# filename: name of gpx file. GPX file should contain 1 trail.
+# filename: name of gpx file. Every segment of every track is rated.
+#   type-string
+#
+# Returns: a row for each segment with elevations (file, segment number,
+# rating, color, length, vertical and max slope) and the segment with its color
+#   type-tuple(list of lists, list of tuple(df, str))
+
+
+def rate_segments(filename):
+    rows = []
+    dfs = []
+    for i, (lat, lon, elevation, _) in enumerate(read_segments(filename)):
+        df = segment_metrics(lat, lon, elevation)
+        if df is None:
+            continue
+        rating = helper.rate_trail(df['difficulty'])
+        color = helper.set_color(rating)
+        rows.append([filename, i + 1, rating, color, helper.get_trail_length(df['coordinates']),
+                    helper.calculate_trail_vert(df['elevation']), df['slope'].abs().max()])
+        dfs.append((df, color))
+    return (rows, dfs)
+
+# Parameters:
+# filename: name of gpx file. Every segment of every track is rated.
 #   type-string
 #
 # Return Type: none
 
 
 def gpx(filename):
-    df = load_gpx(filename)
-    df = helper.fill_in_point_gaps(df, 15, 'gpx')
-    df['elevation'] = helper.smooth_elevations(df['elevation'].to_list())
-    df['distance'] = helper.calculate_dist(df['coordinates'])
-    df['elevation_change'] = helper.calulate_elevation_change(df['elevation'])
-    df['slope'] = helper.calculate_slope(
-        df['elevation_change'], df['distance'])
-    df['difficulty'] = helper.calculate_point_difficulty(df['slope'].to_list())
-    create_gpx_map(df)
+    rows, dfs = rate_segments(filename)
+    if len(dfs) == 0:
+        print('No track segments with elevations found in {}'.format(filename))
+        return
+    for row in rows:
+        print('Segment {}: {} {}'.format(row[1], row[2], row[3]))
+    create_gpx_map(dfs)
 
+# Sets up a bulk_gpx worker process, maps are only ever saved there
+#
 # Parameters:
-# df: trail dataframe
-#   type-dataframe
+# render: whether the worker draws maps
+#   type-bool
 #
 # Return: none
 
 
-def create_gpx_map(df):
-    rating = helper.rate_trail(df['difficulty'])
-    color = helper.set_color(rating)
-    print(rating)
-    print(color)
+def init_worker(render):
+    if render:
+        import matplotlib
+        matplotlib.use('Agg')
+
+# Rates a gpx file in a bulk_gpx worker process
+#
+# Parameters:
+# filename: name of gpx file
+#   type-string
+# render: whether to save a map of the file to maps/gpx
+#   type-bool
+#
+# Returns: rows from rate_segments, none if the file could not be read
+#   type-list of lists
+
+
+def bulk_gpx_rows(filename, render):
+    try:
+        rows, dfs = rate_segments(filename)
+        if render and len(dfs) > 0:
+            name = os.path.splitext(os.path.basename(filename))[0]
+            create_gpx_map(dfs, 'maps/gpx/{}.svg'.format(name))
+        return rows
+    except Exception as error:
+        print('{} failed: {}'.format(filename, error))
+        return []
+
+# Rates every track of many gpx files in parallel and writes one table of the
+# results, without opening any windows.
+#
+# Parameters:
+# pattern: directory of gpx files or a glob of them
+#   type-string
+# output: file to write the results to, json if it ends in .json, else csv
+#   type-string
+# workers: number of processes to rate with, defaults to the number of cpus
+#   type-int
+# render: whether to save a map of every file to maps/gpx
+#   type-bool
+#
+# Returns: file, segment, rating, color, length (meters), vertical (meters)
+# and max slope (degrees) of every segment
+#   type-df
+
+
+def bulk_gpx(pattern, output='gpx_ratings.csv', workers=None, render=False):
+    if os.path.isdir(pattern):
+        pattern = os.path.join(pattern, '*.gpx')
+    filenames = sorted(glob(pattern))
+    if workers is None:
+        workers = os.cpu_count() or 1
+    workers = max(1, min(workers, len(filenames)))
+    if render:
+        os.makedirs('maps/gpx', exist_ok=True)
+    rows = []
+    with ProcessPoolExecutor(workers, initializer=init_worker, initargs=(render,)) as pool:
+        chunksize = max(1, len(filenames) // (workers * 4))
+        for file_rows in tqdm(pool.map(bulk_gpx_rows, filenames, [render] * len(filenames), chunksize=chunksize), total=len(filenames), desc="Rating Tracks…", ascii=False, ncols=75):
+            rows.extend(file_rows)
+    df = pd.DataFrame(rows, columns=[
+                      'file', 'segment', 'rating', 'color', 'length', 'vertical', 'max_slope'])
+    # written to a temporary file first so a reader never sees half a table
+    if output.endswith('.json'):
+        df.to_json(output + '.tmp', orient='records', indent=1)
+    else:
+        df.to_csv(output + '.tmp', index=False)
+    os.replace(output + '.tmp', output)
+    print('{} segments from {} files saved to {}'.format(
+        len(df), len(filenames), output))
+    return df
+
+# Parameters:
+# filename: name of gpx file
+#   type-string
+# mountain: name of a ski area with cached trail points to match the track to
+#   type-string
+#
+# Returns: the runs skied, see trailMatching.match_track. None if the mountain
+# has not been processed.
+#   type-df
+
+
+def match_gpx(filename, mountain):
+    resort = trailMatching.load_resort(mountain)
+    if resort is None:
+        print('{} has no cached trails, process its osm file first'.format(mountain))
+        return None
+    df = load_gpx(filename)
+    runs = trailMatching.match_track(resort, df['lat'], df['lon'])
+    for run in runs.itertuples():
+        print('{} ({}): {} {}m'.format(run.name, run.id, round(
+            run.rating * 100, 1), round(run.vertical)))
+    return runs
+
+# Parameters:
+# dfs: each segment from segment_metrics and its color
+#   type-list of tuple(df, str)
+# save: file to save the map to instead of showing it
+#   type-string
+#
+# Return: none
+
 
-    plt.plot(df.lon, df.lat, c=color, alpha=.25)
-    plt.scatter(df.lon, df.lat, s=8, c=abs(
-        df.slope), cmap='gist_rainbow', alpha=1)
-    plt.colorbar(label='Degrees', orientation='horizontal')
+def create_gpx_map(dfs, save=''):
+    import matplotlib.pyplot as plt
+    max_slope = max(df.slope.abs().max() for df, _ in dfs)
+    for df, color in dfs:
+        plt.plot(df.lon, df.lat, c=color, alpha=.25)
+        points = plt.scatter(df.lon, df.lat, s=8, c=abs(
+            df.slope), cmap='gist_rainbow', vmin=0, vmax=max_slope, alpha=1)
+    plt.colorbar(points, label='Degrees', orientation='horizontal')
     plt.xlabel('Longitude')
     plt.ylabel('Latitude')
     plt.xticks([])
     plt.yticks([])
-    plt.show()
+    if save:
+        plt.savefig(save, format='svg')
+        plt.close()
+    else:
+        plt.show()
@@ -1,121 +1,102 @@
 from ast import Param
 from posixpath import split
 import time
-import json
+import numpy as np
 import pandas as pd
-from numpy import NAN
-import haversine as hs
-from math import degrees, atan
-from requests.api import get
-
-# accepts a string with coords separated by a | and returns a list of elevations
-
-
-def elevation_api(piped_coords, last_called, trailname=''):
-    # url = 'https://api.open-elevation.com/api/v1/lookup?locations={}'
-    url = 'https://api.opentopodata.org/v1/ned10m?locations={}'
-    # url = 'https://api.opentopodata.org/v1/mapzen?locations={}'
-    if time.time() - last_called < 1:
-        time.sleep(1 - (time.time() - last_called))
-    last_called = time.time()
-    response = get(url.format(piped_coords))
-    if response.status_code == 200:
-        elevation = []
-        for result in json.loads(response.content)['results']:
-            elevation.append(result['elevation'])
-    else:
-        print('Elevation API call failed on {} with code:'.format(trailname))
-        print(response.status_code)
-        print(response.content)
-        return -1
-    return (elevation, last_called)
+
+import elevationProviders
+import trailMetrics
+
+# where get_elevation looks elevations up, see get_elevation_provider
+elevation_provider = None
+
+# Parameters:
+# provider: object with a get_elevation(lat, lon) method returning an array of
+# elevations (NaN where unknown), e.g. elevationProviders.RasterProvider. None
+# switches back to the elevation API.
+#   type-object
+#
+# Return: none
+
+
+def set_elevation_provider(provider):
+    global elevation_provider
+    elevation_provider = provider
+
+# Returns: the provider get_elevation looks elevations up with, the elevation
+# API unless set_elevation_provider picked another one
+#   type-object
+
+
+def get_elevation_provider():
+    global elevation_provider
+    if elevation_provider is None:
+        elevation_provider = elevationProviders.ApiProvider()
+    return elevation_provider
+
+# Returns: identity of the provider get_elevation uses, see
+# elevationProviders.ApiProvider
+#   type-str
+
+
+def elevation_source():
+    provider = get_elevation_provider()
+    return getattr(provider, 'identity', type(provider).__name__)
 
 # Parameters:
 # coordinates: list/series of latitude and longitude tuples
 #   type-list/series of tuples
+# last_called: kept for callers, the provider does its own rate limiting
+#   type-float
 # trail_name: name of ski trail
 #   type-string
 # api-requests: number of api requests made
 #   type-int
 #
-# Returns: tuple containing series of coordinates and api_requests
-#   type-tuple(series of tuples, int)
+# Returns: tuple containing series of elevations, api_requests and last_called,
+# or -1 if the lookup failed
+#   type-tuple(series of floats, int, float)
 
 
 def get_elevation(coordinates, last_called, trail_name='', api_requests=0):
-    piped_coords = ''
-    point_count = 0
-    elevations = []
-    for coordinate in coordinates:
-        if piped_coords == '':
-            piped_coords = '{},{}'.format(coordinate[0], coordinate[1])
-            continue
-        piped_coords = piped_coords + \
-            '|{},{}'.format(coordinate[0], coordinate[1])
-        point_count += 1
-        if point_count >= 99:
-            temp_elevations, last_called = elevation_api(
-                piped_coords, last_called, trail_name)
-            api_requests += 1
-            if temp_elevations == -1:
-                return -1
-            piped_coords = ''
-            point_count = 0
-            for point in temp_elevations:
-                elevations.append(point)
-    if piped_coords != '':
-        temp_elevations, last_called = elevation_api(
-            piped_coords, last_called, trail_name)
-        api_requests += 1
-        if temp_elevations == -1:
-            return -1
-        for point in temp_elevations:
-            elevations.append(point)
-    return (pd.Series(elevations), api_requests, last_called)
+    provider = get_elevation_provider()
+    lat, lon = trailMetrics.split_coordinates(coordinates)
+    requests_before = getattr(provider, 'requests', 0)
+    try:
+        elevation = provider.get_elevation(lat, lon)
+    except elevationProviders.ElevationError as error:
+        print('Elevation lookup failed on {}:'.format(trail_name))
+        print(error)
+        return -1
+    api_requests += getattr(provider, 'requests', 0) - requests_before
+    if requests_before != getattr(provider, 'requests', 0):
+        last_called = time.time()
+    missing = np.isnan(elevation).sum()
+    if missing > 0:
+        print('No elevation data for {} points of {}'.format(missing, trail_name))
+    return (pd.Series(elevation), api_requests, last_called)
 
 # accepts a list of lat/lon pairs and returns a list of distances (in meters)
 
 
 def calculate_dist(coordinates):
-    previous_row = (NAN, NAN)
-    distance = []
-    for row in coordinates:
-        distance.append(hs.haversine(row, previous_row, unit=hs.Unit.METERS))
-        previous_row = row
-    return distance
+    lat, lon = trailMetrics.split_coordinates(coordinates)
+    return trailMetrics.point_distances(lat, lon).tolist()
 
 # accepts a df with lat, lon, lat/lon pairs, and elevation and returns
 # a df with the same columns, but points spaced out by no more than 20
 
 
 def fill_in_point_gaps(df, max_gap=20, filetype='osm'):
-    lat = df['lat'].tolist()
-    lon = df['lon'].tolist()
-    coordinates = df['coordinates'].tolist()
+    elevation = None
     if filetype == 'gpx':
-        elevation = df['elevation'].tolist()
-    done = False
-    while not done:
-        distances = calculate_dist(coordinates)
-        not_changed = 0
-        for index, point in enumerate(distances):
-            if point > max_gap and index > 0:
-                new_lat = (lat[index]+lat[index-1])/2
-                new_lon = (lon[index]+lon[index-1])/2
-                lat.insert(index, new_lat)
-                lon.insert(index, new_lon)
-                coordinates.insert(index, (new_lat, new_lon))
-                if filetype == 'gpx':
-                    elevation.insert(
-                        index, (elevation[index]+elevation[index-1])/2)
-                break
-            not_changed += 1
-        if not_changed == len(coordinates):
-            done = True
+        elevation = df['elevation'].to_numpy(dtype=float)
+    lat, lon, elevation = trailMetrics.densify(
+        df['lat'].to_numpy(dtype=float), df['lon'].to_numpy(dtype=float), max_gap, elevation)
     new_df = pd.DataFrame()
     new_df['lat'] = lat
     new_df['lon'] = lon
-    new_df['coordinates'] = coordinates
+    new_df['coordinates'] = list(zip(lat.tolist(), lon.tolist()))
     if filetype == 'gpx':
         new_df['elevation'] = elevation
     return new_df
@@ -159,16 +140,7 @@ def area_to_line(df):
 
 
 def rate_trail(difficulty):
-    max_difficulty = 0
-    previous = 0
-    previous_2 = 0
-    for point in difficulty:
-        nearby_avg = (point + previous + previous_2) / 3
-        if nearby_avg > max_difficulty:
-            max_difficulty = nearby_avg
-        previous_2 = previous
-        previous = point
-    return max_difficulty
+    return trailMetrics.rate_trail(difficulty)
 
 # accepts a float and converts it into a trail color (return a string)
 # possible colors: green, royalblue, black, red, gold
@@ -200,55 +172,27 @@ def smooth_elevations(elevations, passes=20):
     if len(elevations) == 0:
         print('No Elevations provided')
         return
-    for _ in range(passes):
-        previous_previous_point = elevations[0]
-        previous_point = elevations[0]
-        for i, point in enumerate(elevations):
-            new_point = (point + previous_point + previous_previous_point) / 3
-            if i > 1:
-                elevations[i-1] = new_point
-            previous_previous_point = previous_point
-            previous_point = point
-    return elevations
+    return trailMetrics.smooth_elevations(elevations, passes).tolist()
 
 # accepts a list of elevations and returns the difference between
 # neighboring elevations
 
 
 def calulate_elevation_change(elevation):
-    previous_row = NAN
-    elevation_change = []
-    for row in elevation:
-        elevation_change.append(row-previous_row)
-        previous_row = row
-    return elevation_change
+    return trailMetrics.elevation_changes(elevation).tolist()
 
 # accepts 2 lists: distance and elevation change, both using the same unit
 # returns a list of slopes (in degrees)
 
 
 def calculate_slope(elevation_change, distance):
-    slope = []
-    for x, y in zip(elevation_change, distance):
-        if y != 0:
-            slope.append(degrees(atan(x/y)))
-        else:
-            slope.append(0)
-    slope[0] = 0
-    # for i, point in enumerate(slope):
-    #    if point > 0:
-    #        slope[i] = 0
-    return slope
+    return trailMetrics.slopes(elevation_change, distance).tolist()
 
 # accepts a list of slopes and returns a list of difficulties (0-.9 scale)
 
 
 def calculate_point_difficulty(slope):
-    difficulty = []
-    for point in slope:
-        difficulty.append((abs(point)/90)*.9)
-    difficulty[0] = 0
-    return difficulty
+    return trailMetrics.point_difficulties(slope).tolist()
 
 # Parameters:
 # coordinates: list/series of coordinates
@@ -285,21 +229,21 @@ def format_name(name):
     return name.strip()
 
 # Parameters:
-# object: list of trails
-#   type-list of tuples
+# records: manifest record of each trail, with its top and bottom elevation
+#   type-list of dicts
 #
 # Returns: mountain vertical drop
 #   type-float
 
 
-def calculate_mtn_vert(object):
+def calculate_mtn_vert(records):
     min_ele = 10000
     max_ele = 0
-    for trail in object:
-        if trail[0].elevation.max() > max_ele:
-            max_ele = trail[0].elevation.max()
-        if trail[0].elevation.min() < min_ele:
-            min_ele = trail[0].elevation.min()
+    for record in records:
+        if record['top'] > max_ele:
+            max_ele = record['top']
+        if record['bottom'] < min_ele:
+            min_ele = record['bottom']
     return(max_ele-min_ele)
 
 # Parameters:
@@ -1,110 +1,262 @@
+import numpy as np
 import pandas as pd
+import os
 from os.path import exists
 import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
 from tqdm import tqdm
 import csv
-from decimal import Decimal
 
 import helper
+import elevationCache
+import elevationProviders
 import saveData
 import osmHelper
+import osmIds
+import ratingEngine
+import resortPackage
+import stageTimer
+import trailManifest
+import trailMetrics
+import trailPoints
+
+# Parameters:
+# df: trail with lat and lon columns
+#   type-df
+#
+# Returns: the trail's coordinates rounded to 8 decimals
+#   type-list(tuple(float, float))
+
+
+def rounded_coordinates(df):
+    lat = elevationCache.round_coordinates(df['lat']) / 1e8
+    lon = elevationCache.round_coordinates(df['lon']) / 1e8
+    return list(zip(lat.tolist(), lon.tolist()))
+
+# Looks up the elevations of many trails at once and adds them to each trail's
+# df as an elevation column. Trails share junction nodes and densified points,
+# so points are merged on their cache key and every distinct point is looked up
+# once, in one call, skipping points an earlier round already resolved.
+#
+# Parameters:
+# trail_dfs: trails with a coordinates column
+#   type-list(df)
+# resolved: keys (sorted) and elevations of points already looked up
+#   type-tuple(array(int64), array(float))
+# last_called: time of the last API call
+#   type-float
+# mountain: name of ski area, for error messages
+#   type-str
+# api_requests: number of api requests made
+#   type-int
+#
+# Returns: resolved with the new points added, api_requests and last_called,
+# or -1 if the lookup failed
+#   type-tuple(tuple(array(int64), array(float)), int, float)
+
+
+def get_all_elevations(trail_dfs, resolved, last_called, mountain, api_requests=0):
+    coordinates = [x for temp_df in trail_dfs for x in temp_df.coordinates]
+    if len(coordinates) == 0:
+        return (resolved, api_requests, last_called)
+    lat, lon = trailMetrics.split_coordinates(coordinates)
+    keys, first, inverse = np.unique(elevationCache.coordinate_keys(
+        lat, lon), return_index=True, return_inverse=True)
+    elevation = np.full(len(keys), np.nan)
+
+    known_keys, known_elevation = resolved
+    position = np.minimum(np.searchsorted(
+        known_keys, keys), max(len(known_keys) - 1, 0))
+    known = known_keys[position] == keys if len(
+        known_keys) else np.zeros(len(keys), dtype=bool)
+    elevation[known] = known_elevation[position[known]]
+    missing = np.flatnonzero(~known)
+    if len(missing) > 0:
+        result = elevationCache.get_elevation(
+            [coordinates[i] for i in first[missing]], last_called, mountain, api_requests)
+        if result == -1:
+            return -1
+        elevation[missing] = result[0].to_numpy()
+        api_requests = result[1]
+        last_called = result[2]
+
+    start = 0
+    for temp_df in trail_dfs:
+        temp_df['elevation'] = elevation[inverse[start:start + len(temp_df)]]
+        start += len(temp_df)
+    all_keys = np.concatenate([known_keys, keys[missing]])
+    order = np.argsort(all_keys)
+    all_elevation = np.concatenate([known_elevation, elevation[missing]])
+    return ((all_keys[order], all_elevation[order]), api_requests, last_called)
+
+# Parameters:
+# mountain: name of ski area
+#   type-str
+#
+# Returns: cached display points and area center line of each trail by OSM id
+#   type-dict(int, tuple(df, df))
+
+
+def load_cached_trails(mountain):
+    points = trailPoints.load(mountain)
+    if points is None:
+        return {}
+    trail_ids = np.asarray(points['trail_id'])
+    order = np.argsort(trail_ids, kind='stable')
+    ids, starts = np.unique(trail_ids[order], return_index=True)
+    trails = {}
+    for trail_id, group in zip(ids.tolist(), np.split(order, starts[1:])):
+        trail_points = points[group]
+        display = trail_points['for_display']
+        trails[trail_id] = (cached_trail_df(trail_points[display]),
+                            cached_trail_df(trail_points[~display]))
+    return trails
+
+# Parameters:
+# points: cached points of one trail, see trailPoints
+#   type-array(POINT_DTYPE)
+#
+# Returns: the points in the format generate_trails_and_lifts makes, or an
+# empty df if there are none
+#   type-df(float, float, tuple, float, float)
+
+
+def cached_trail_df(points):
+    df = pd.DataFrame()
+    if len(points) == 0:
+        return df
+    df['lat'] = np.array(points['lat'])
+    df['lon'] = np.array(points['lon'])
+    df['coordinates'] = rounded_coordinates(df)
+    df['elevation'] = np.array(points['elevation'])
+    df['slope'] = np.array(points['slope'], dtype=np.float64)
+    return df
+
+# Parameters:
+# mountain: name of ski area
+#   type-string
+# blacklist: name of the mountain whose trails to exclude, or the mountain
+# itself to only include its trails from the last run
+#   type-string
+#
+# Returns: OSM ids from the blacklist file and whether they are a whitelist
+#   type-tuple(frozenset(int), bool)
+
+
+def read_blacklist(mountain, blacklist):
+    if blacklist == '':
+        return (frozenset(), False)
+    blacklist_ids = osmIds.get(blacklist)
+    if blacklist_ids is None:
+        print('Blacklist file missing')
+        raise FileNotFoundError('cached/osm_ids/{}.csv'.format(blacklist))
+    return (blacklist_ids, blacklist == mountain)
 
 # accepts a osm filename and a blacklist name and returns a list of tuples.
 # Each tuple contains a dataframe with
 # 4 columns: latitude, longitude, lat/lon pairs, and elevation (meters)
 # a string with the trailname,
-# and an int (0-1) to denote if the trail is gladed
+# an int (0-1) to denote if the trail is gladed,
+# the area flag, the area's center line, the OSM id
+# and the way's manifest record (only the hash if it has to be rated again)
 
 
 def generate_trails_and_lifts(mountain, blacklist=''):
     filename = mountain + '.osm'
-    cached_filename = mountain + '.csv'
     if not exists('osm/{}'.format(filename)):
         print('OSM file missing')
         return (-1, -1)
-    if not exists('cached/osm_ids/{}.csv'.format(blacklist)) and blacklist != '':
-        print('Blacklist file missing')
+    with stageTimer.stage('package'):
+        blacklist_ids, whitelist_mode = read_blacklist(mountain, blacklist)
+        node_index, ways = resortPackage.load(
+            mountain, blacklist_ids, whitelist_mode)
+    way_info = ways[2]
+    trail_info = way_info[~way_info.is_lift]
+    lift_info = way_info[way_info.is_lift]
+    total_trail_count = len(trail_info)
 
-    file = open('osm/{}'.format(filename), 'r')
-    raw_table = file.readlines()
-
-    if blacklist != '':
-        blacklist_ids = (pd.read_csv(
-            'cached/osm_ids/{}.csv'.format(blacklist)))['id'].to_list()
-        blacklist_ids = [str(x) for x in blacklist_ids]
-    else:
-        blacklist_ids = []
+    with stageTimer.stage('trail_ids'):
+        saveData.save_trail_ids(way_info, mountain + '.csv')
+        osmIds.update(mountain, way_info['way_id'])
 
-    whitelist_mode = False
-    if blacklist == mountain:
-        whitelist_mode = True
-    node_df, way_df, lift_df, useful_info_list, total_trail_count, trail_and_id_list = osmHelper.process_osm(
-        raw_table, blacklist_ids, whitelist_mode)
+    # ways that haven't changed since the last run reuse their stored record
+    # and cached points, the rest are densified and looked up below
+    with stageTimer.stage('cached_trails'):
+        manifest = trailManifest.load(mountain, helper.elevation_source())
+        cached_trails = load_cached_trails(mountain) if manifest else {}
+    trail_dfs = []
+    area_line_dfs = []
+    records = []
+    with stageTimer.stage('densify'):
+        for index, column, difficulty_modifier, area_flag, way_id in tqdm(zip(trail_info.index, trail_info.name, trail_info.difficulty_modifier, trail_info.is_area, trail_info.way_id), total=total_trail_count, desc="Loading Trails…", ascii=False, ncols=75):
+            temp_df = osmHelper.resolve_way(
+                node_index, osmHelper.get_way_nodes(ways, index))
+            record = {'hash': trailManifest.way_hash(
+                temp_df, column, difficulty_modifier, area_flag)}
+            stored = manifest.get(str(way_id))
+            cached = cached_trails.get(int(way_id))
+            if stored is not None and stored['hash'] == record['hash'] and cached is not None and (len(cached[1]) > 0 or not area_flag):
+                record = stored
+                temp_df, temp_area_line_df = cached
+            else:
+                temp_df = helper.fill_in_point_gaps(temp_df, 15)
+                temp_df['coordinates'] = rounded_coordinates(temp_df)
+                temp_area_line_df = pd.DataFrame()
+            trail_dfs.append(temp_df)
+            area_line_dfs.append(temp_area_line_df)
+            records.append(record)
+    changed = [i for i, x in enumerate(records) if 'rating' not in x]
+    stageTimer.count('trails', total_trail_count)
+    stageTimer.count('changed_trails', len(changed))
+    stageTimer.count('points', sum(len(x) for x in trail_dfs))
+    if manifest:
+        print('{} of {} trails unchanged'.format(
+            total_trail_count - len(changed), total_trail_count))
 
-    saveData.save_trail_ids(trail_and_id_list, mountain + '.csv')
+    # gather every changed trail first so the elevation lookup can fill whole
+    # API batches with points from many trails
+    api_requests = 0
+    last_called = time.time()
+    resolved = (np.zeros(0, dtype=np.int64), np.zeros(0))
+    with stageTimer.stage('elevation'):
+        result = get_all_elevations(
+            [trail_dfs[i] for i in changed], resolved, last_called, mountain, api_requests)
+    if result == -1:
+        return (-1, -1)
+    resolved, api_requests, last_called = result
 
-    cached = True
-    if not exists('cached/trail_points/{}'.format(cached_filename)) and cached:
-        cached = False
-        print('Disabling cache loading: no cache file found.')
+    # area center lines start and end at the highest and lowest point of the
+    # area, so they need the first round of elevations
+    changed_areas = [i for i in changed if trail_info.is_area.iloc[i]]
+    with stageTimer.stage('area_lines'):
+        for i in changed_areas:
+            area_line_dfs[i] = helper.area_to_line(trail_dfs[i])
+            area_line_dfs[i]['coordinates'] = rounded_coordinates(
+                area_line_dfs[i])
+    with stageTimer.stage('elevation'):
+        result = get_all_elevations(
+            [area_line_dfs[i] for i in changed_areas], resolved, last_called, mountain, api_requests)
+    if result == -1:
+        return (-1, -1)
+    resolved, api_requests, last_called = result
 
     trail_list = []
-    api_requests = 0
-    if cached:
-        elevation_df = pd.read_csv(
-            'cached/trail_points/{}'.format(cached_filename))
-        elevation_df['coordinates'] = [
-            (round(Decimal(x), 8), round(Decimal(y),8)) for x, y in zip(elevation_df.lat, elevation_df.lon)]
-        ele_dict = dict(zip(elevation_df.coordinates, elevation_df.elevation))
-    last_called = time.time()
-    for column, _ in zip(way_df, tqdm(range(total_trail_count), desc="Loading Trails…", ascii=False, ncols=75)):
-        temp_df = pd.merge(way_df[column], node_df,
-                           left_on=column, right_on='id')
-        del temp_df['id']
-        del temp_df[column]
-        temp_df = helper.fill_in_point_gaps(temp_df, 15)
-        temp_df['coordinates'] = [(round(Decimal(x[0]), 8), round(Decimal(x[1]), 8))
-                                  for x in temp_df.coordinates]
-
-        for row in useful_info_list:
-            if column == row[0]:
-                difficulty_modifier = row[1]
-                area_flag = row[2]
-                way_id = row[3]
-        try:
-            temp_df['elevation'] = [ele_dict[x] for x in temp_df.coordinates]
-        except:
-            result = helper.get_elevation(
-                temp_df['coordinates'], last_called, column, api_requests)
-            temp_df['elevation'] = result[0]
-            api_requests = result[1]
-            last_called = result[2]
-        temp_area_line_df = pd.DataFrame()
-        if area_flag:
-            temp_area_line_df = helper.area_to_line(temp_df)
-            temp_area_line_df['coordinates'] = [
-                (round(Decimal(x[0]), 8), round(Decimal(x[1]), 8)) for x in temp_area_line_df.coordinates]
-            try:
-                temp_area_line_df['elevation'] = [ele_dict[x]
-                                                  for x in temp_area_line_df.coordinates]
-            except:
-                result = helper.get_elevation(
-                    temp_area_line_df['coordinates'], last_called, column, api_requests)
-                temp_area_line_df['elevation'] = result[0]
-                api_requests = result[1]
-                last_called = result[2]
+    for temp_df, column, difficulty_modifier, area_flag, temp_area_line_df, way_id, record in zip(trail_dfs, trail_info.name, trail_info.difficulty_modifier, trail_info.is_area, area_line_dfs, trail_info.way_id, records):
         trail_list.append((temp_df, column, difficulty_modifier,
-                          area_flag, temp_area_line_df, way_id))
+                          area_flag, temp_area_line_df, way_id, record))
     lift_list = []
-    for column in lift_df:
-        temp_df = pd.merge(lift_df[column], node_df,
-                           left_on=column, right_on='id')
-        temp_df = helper.fill_in_point_gaps(temp_df, 50)
-        lift_list.append((temp_df, column))
+    with stageTimer.stage('lifts'):
+        for index, column in zip(lift_info.index, lift_info.name):
+            temp_df = osmHelper.resolve_way(
+                node_index, osmHelper.get_way_nodes(ways, index))
+            temp_df = helper.fill_in_point_gaps(temp_df, 50)
+            lift_list.append((temp_df, column))
+    stageTimer.count('lifts', len(lift_list))
     if total_trail_count == 0:
         print('No trails found.')
         return (-1, -1)
     print('{} API requests made'.format(api_requests))
+    stageTimer.count('api_requests', api_requests)
 
     return (trail_list, lift_list)
 
@@ -118,123 +270,234 @@ def generate_trails_and_lifts(mountain, blacklist=''):
 #   type-bool
 # blacklist: name of nearby ski area to ignore trails and lifts from
 #   type-string
+# render: whether to draw the map, False only computes the ratings
+#   type-bool
 #
 # Return: the relative difficultly and ease of the difficult and beginner terrain
 #   type-tuple(float,float)
 
 
-def process_mountain(mountain, cardinal_direction, save_map=False, blacklist=''):
-    trail_list, lift_list = generate_trails_and_lifts(mountain, blacklist)
+def process_mountain(mountain, cardinal_direction, save_map=False, blacklist='', render=True):
+    with stageTimer.stage('generate'):
+        trail_list, lift_list = generate_trails_and_lifts(mountain, blacklist)
     if trail_list == -1:
         return -1
 
-    finished_trail_list = []
-    for entry in trail_list:
-        if not entry[3]:
-            trail = entry[0]
-        else:
-            trail = entry[4]
-            perimeter = entry[0]
-            perimeter['distance'] = helper.calculate_dist(
-                perimeter['coordinates'])
-            perimeter['elevation_change'] = helper.calulate_elevation_change(
-                perimeter['elevation'])
-            perimeter['slope'] = helper.calculate_slope(
-                perimeter['elevation_change'], perimeter['distance'])
-
-        trail['elevation'] = helper.smooth_elevations(
-            trail['elevation'].to_list(), 0)
-        trail['distance'] = helper.calculate_dist(trail['coordinates'])
-        trail['elevation_change'] = helper.calulate_elevation_change(
-            trail['elevation'])
-        trail['slope'] = helper.calculate_slope(
-            trail['elevation_change'], trail['distance'])
-        trail['difficulty'] = helper.calculate_point_difficulty(trail['slope'])
-        if not entry[3]:
-            finished_trail_list.append(
-                (trail, entry[1], entry[2], entry[3], entry[4], entry[5]))
-        else:
-            finished_trail_list.append(
-                (perimeter, entry[1], entry[2], entry[3], trail, entry[5]))
-
-    mtn_difficulty = saveData.create_map(
-        finished_trail_list, lift_list, mountain, cardinal_direction, save_map)
-    if mtn_difficulty == -1:
-        return -1
-    vert = helper.calculate_mtn_vert(finished_trail_list)
-    saveData.cache_trail_points(mountain + '.csv', trail_list)
+    with stageTimer.stage('rate'):
+        finished_trail_list, records = ratingEngine.rate_trails(trail_list)
+        mtn_difficulty = ratingEngine.rate_mountain(records)
+    if render:
+        with stageTimer.stage('render'):
+            # only load matplotlib for runs that draw
+            import mapRenderer
+            mapRenderer.create_map(finished_trail_list, lift_list,
+                                   records, mountain, cardinal_direction, save_map)
+    print('Difficultly Rating: {}'.format(mtn_difficulty[0]))
+    print('Beginner Friendliness Rating: {}'.format(mtn_difficulty[1]))
+    vert = helper.calculate_mtn_vert(records)
+    with stageTimer.stage('cache_trail_points'):
+        saveData.cache_trail_points(mountain, trail_list)
+    with stageTimer.stage('manifest'):
+        trailManifest.save(mountain, {str(entry[5]): entry[6]
+                           for entry in trail_list}, helper.elevation_source())
     output = (mtn_difficulty[0], mtn_difficulty[1],
               round(vert), len(trail_list), len(lift_list))
     return output
 
 # Parameters:
+# mountain_df: mountain_list.csv
+#   type-df
 # mountain: name of ski area
 #   type-str
 # direction: orientation of map
 #   type-char
-# save_map: whether to save the map
-#   type-bool
 # blacklist: any mountains to exclude trails from
 #   type-str
 # location: state ski area is in
 #   type-str
 #
-# Return: -1 for failure, 0 otherwise
-#   type-int
+# Returns: direction, blacklist and location, with blank ones filled in from
+# the mountain's previous run
+#   type-tuple(str, str, str)
 
 
-def osm(mountain='', direction='', save_map=False, blacklist='', location=''):
-    print('\nProcessing {}'.format(helper.format_name(mountain)))
-    mountain_df = pd.read_csv('mountain_list.csv')
-    previously_run = False
-    if mountain in mountain_df.mountain.to_list():
-        previously_run = True
-        mountain_row = mountain_df.loc[mountain_df.mountain == mountain]
-    if direction == '' and previously_run:
+def mountain_settings(mountain_df, mountain, direction='', blacklist='', location=''):
+    if mountain not in mountain_df.mountain.to_list():
+        return (direction, blacklist, location)
+    mountain_row = mountain_df.loc[mountain_df.mountain == mountain]
+    if direction == '':
         value = mountain_row.direction.to_list()[0]
         if str(value) != 'nan':
             direction = value
-    if blacklist == '' and previously_run:
+    if blacklist == '':
         value = mountain_row.blacklist.to_list()[0]
         if str(value) != 'nan':
             blacklist = value
-    if location == '' and previously_run:
+    if location == '':
         value = mountain_row.state.to_list()[0]
         if str(value) != 'nan':
             location = value
-    diff_tuple = process_mountain(mountain, direction, save_map, blacklist)
+    return (direction, blacklist, location)
+
+# Parameters:
+# mountain: name of ski area
+#   type-str
+# direction: orientation of map
+#   type-char
+# save_map: whether to save the map
+#   type-bool
+# blacklist: any mountains to exclude trails from
+#   type-str
+# location: state ski area is in
+#   type-str
+# render: whether to draw the map
+#   type-bool
+#
+# Return: the mountain's row for mountain_list.csv, -1 for failure
+#   type-list
+
+
+def mountain_row(mountain, direction='', save_map=False, blacklist='', location='', render=True):
+    print('\nProcessing {}'.format(helper.format_name(mountain)))
+    stageTimer.start(mountain)
+    diff_tuple = -1
+    try:
+        diff_tuple = process_mountain(
+            mountain, direction, save_map, blacklist, render)
+    finally:
+        stageTimer.finish(diff_tuple != -1)
     if diff_tuple == -1:
         return -1
-    if save_map and exists('mountain_list.csv'):
-        # row = (mountain, direction, state, region, difficulty, ease, vert, trail_count, lift_count, blacklist)
-        row = [[mountain, direction, location, helper.assign_region(location), diff_tuple[0], diff_tuple[1],
-                diff_tuple[2], diff_tuple[3], diff_tuple[4], blacklist]]
-        if previously_run:
-            mountain_df.loc[mountain_df.mountain == mountain] = row
-            output = mountain_df
+    # row = (mountain, direction, state, region, difficulty, ease, vert, trail_count, lift_count, blacklist)
+    return [mountain, direction, location, helper.assign_region(location), diff_tuple[0], diff_tuple[1],
+            diff_tuple[2], diff_tuple[3], diff_tuple[4], blacklist]
+
+# Updates or adds the rows of mountain_list.csv and saves it. The file is
+# written to a temporary file first and moved into place, so an interrupted
+# run never leaves it half written.
+#
+# Parameters:
+# mountain_df: mountain_list.csv
+#   type-df
+# rows: rows from mountain_row
+#   type-list(list)
+#
+# Return: none
+
+
+def update_mountain_list(mountain_df, rows):
+    output = mountain_df
+    new_rows = []
+    for row in rows:
+        if row[0] in output.mountain.to_list():
+            output.loc[output.mountain == row[0]] = [row]
         else:
-            row = pd.Series(row[0], index=mountain_df.columns)
-            output = mountain_df.append(row, ignore_index=True)
-            output.sort_values(by=['mountain'], inplace=True)
-        output['trail_count'] = output['trail_count'].astype(int)
-        output['lift_count'] = output['lift_count'].astype(int)
-        output.to_csv('mountain_list.csv', index=False)
+            new_rows.append(pd.Series(row, index=output.columns))
+    if new_rows:
+        output = output.append(new_rows, ignore_index=True)
+        output.sort_values(by=['mountain'], inplace=True)
+    output['trail_count'] = output['trail_count'].astype(int)
+    output['lift_count'] = output['lift_count'].astype(int)
+    output.to_csv('mountain_list.csv.tmp', index=False)
+    os.replace('mountain_list.csv.tmp', 'mountain_list.csv')
+
+# Parameters:
+# mountain: name of ski area
+#   type-str
+# direction: orientation of map
+#   type-char
+# save_map: whether to save the map
+#   type-bool
+# blacklist: any mountains to exclude trails from
+#   type-str
+# location: state ski area is in
+#   type-str
+# render: whether to draw the map
+#   type-bool
+#
+# Return: -1 for failure, 0 otherwise
+#   type-int
+
+
+def osm(mountain='', direction='', save_map=False, blacklist='', location='', render=True):
+    mountain_df = pd.read_csv('mountain_list.csv')
+    direction, blacklist, location = mountain_settings(
+        mountain_df, mountain, direction, blacklist, location)
+    row = mountain_row(mountain, direction, save_map,
+                       blacklist, location, render)
+    if row == -1:
+        return -1
+    if save_map and exists('mountain_list.csv'):
+        update_mountain_list(mountain_df, [row])
     else:
         print('Mountain data not saved. If this is unexpected, please make sure you have a file called mountain_list.csv')
     return 0
 
+# Sets up a bulk_osm worker process.
+#
+# Parameters:
+# provider: elevation provider for the worker, see helper.set_elevation_provider
+#   type-object
+# render: whether the worker draws maps
+#   type-bool
+# ids: OSM ids of every mountain, see osmIds.load_all
+#   type-dict(str, frozenset(int))
+# profiler: profiler every mountain is run with, see stageTimer.set_profiler
+#   type-str
+#
+# Return: none
+
+
+def init_worker(provider, render, ids, profiler=None):
+    if render:
+        import matplotlib
+        matplotlib.use('Agg')
+    # a forked worker must not share the parent's sqlite connection
+    elevationCache.connection = None
+    helper.set_elevation_provider(provider)
+    osmIds.set_registry(ids)
+    stageTimer.set_profiler(profiler)
+
+# mountain_row for bulk_osm workers, which also closes the map so figures
+# don't pile up in a long lived worker.
+#
+# Parameters:
+# ids: OSM ids of mountains that finished after the worker started, which
+# this mountain ignores
+#   type-dict(str, frozenset(int))
+#
+# Return: the mountain's row for mountain_list.csv (-1 for failure), the
+# OSM ids of its trails and lifts and the timings of the run, see stageTimer
+#   type-tuple(list, frozenset(int), dict)
+
+
+def bulk_mountain_row(mountain, direction, save_map, blacklist, location, render, ids):
+    osmIds.registry.update(ids)
+    row = mountain_row(mountain, direction, save_map,
+                       blacklist, location, render)
+    if render:
+        import matplotlib.pyplot as plt
+        plt.close('all')
+    return (row, osmIds.registry.get(mountain), stageTimer.last)
+
 # Parameters:
 # input_csv: name of csv
 #   type-str
 # save_map: whether to save the map
 #   type-bool
+# workers: number of worker processes, defaults to the number of cpus
+#   type-int
+# render: whether to draw the maps
+#   type-bool
 #
 # Return: none
 
 
-def bulk_osm(input_csv, save_map=False):
+def bulk_osm(input_csv, save_map=False, workers=None, render=True):
     if input_csv[:-4] != '.csv':
         input_csv = input_csv + '.csv'
+    mountain_df = pd.read_csv('mountain_list.csv')
+    tasks = []
     with open(input_csv, mode='r') as file:
         csv_file = csv.reader(file)
         next(csv_file)
@@ -243,7 +506,67 @@ def bulk_osm(input_csv, save_map=False):
                 break
             if line[0][0] == '#':
                 continue
-            osm(line[0], line[1], save_map, line[9], line[2])
+            direction, blacklist, location = mountain_settings(
+                mountain_df, line[0], line[1], line[9], line[2])
+            tasks.append((line[0], direction, save_map,
+                         blacklist, location, render))
+    if workers is None:
+        workers = os.cpu_count() or 1
+    workers = max(1, min(workers, len(tasks)))
+
+    provider = helper.get_elevation_provider()
+    # create and seed the elevation cache before the workers share it
+    elevationCache.get_connection()
+    # every ids file is read once here, mountains that finish during the run
+    # send their new ids back with their row
+    ids = osmIds.load_all()
+
+    # a mountain that ignores the trails of one earlier in the list reads that
+    # mountain's trail ids, so it has to wait for it to finish like it would
+    # when run one after another
+    earlier = set()
+    waiting = {}  # mountain -> tasks waiting for its trail ids
+    rows = []
+    records = []  # stageTimer record of every mountain
+    # the workers take turns on one API rate limit
+    with elevationProviders.shared_rate_limit(provider) as provider, ProcessPoolExecutor(workers, initializer=init_worker, initargs=(provider, render, dict(ids), stageTimer.profiler_name)) as pool:
+        futures = {}
+        ready = []
+        for task in tasks:
+            if task[3] in earlier and task[3] != task[0]:
+                waiting.setdefault(task[3], []).append(task)
+            else:
+                ready.append(task)
+            earlier.add(task[0])
+        while ready or futures:
+            for task in ready:
+                finished = {task[3]: ids[task[3]]} if task[3] in ids else {}
+                futures[pool.submit(bulk_mountain_row, *
+                                    task, finished)] = task[0]
+            ready = []
+            done, _ = wait(futures, return_when=FIRST_COMPLETED)
+            for future in done:
+                mountain = futures.pop(future)
+                try:
+                    row, mountain_ids, record = future.result()
+                except Exception as error:
+                    print('{} failed: {}'.format(mountain, error))
+                    row, mountain_ids, record = (-1, None, None)
+                if mountain_ids is not None:
+                    ids[mountain] = mountain_ids
+                if record is not None and record['mountain'] == mountain:
+                    records.append(record)
+                if row != -1:
+                    rows.append(row)
+                ready.extend(waiting.pop(mountain, []))
+
+    # keep the input order so reruns give the same file as running serially
+    order = {x[0]: i for i, x in enumerate(tasks)}
+    if save_map and exists('mountain_list.csv'):
+        rows.sort(key=lambda x: order[x[0]])
+        update_mountain_list(pd.read_csv('mountain_list.csv'), rows)
+    records.sort(key=lambda x: order[x['mountain']])
+    stageTimer.write_report(records)
 
 # Parameters:
 # save_output: whether to save the map
@@ -253,12 +576,13 @@ def bulk_osm(input_csv, save_map=False):
 
 
 def barplot(save_output=False):
+    import mapRenderer
     if not exists('mountain_list.csv'):
         print('Missing cache files, please run bulk_osm or osm and set save_map=True.')
         return
     df = pd.read_csv('mountain_list.csv')
     df['mountain'] = [helper.format_name(x) for x in df['mountain']]
-    saveData.create_difficulty_barplot(df, 'USA' ,save_output)
+    mapRenderer.create_difficulty_barplot(df, 'USA' ,save_output)
 
     state_list = df.state.unique()
     for state in state_list:
@@ -266,8 +590,8 @@ def barplot(save_output=False):
             continue
         temp_df = df[df['state'].str.contains(state)]
         region = helper.assign_region(state)
-        saveData.create_difficulty_barplot(temp_df, f'{region}/{state}', save_output)
+        mapRenderer.create_difficulty_barplot(temp_df, f'{region}/{state}', save_output)
     for region in ['northeast', 'southeast', 'midwest', 'west']:
         temp_df = df.loc[df['region'] == region]
-        saveData.create_difficulty_barplot(temp_df, helper.format_name(region), save_output)      
+        mapRenderer.create_difficulty_barplot(temp_df, helper.format_name(region), save_output)      
 
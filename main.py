@@ -1,9 +1,11 @@
-import matplotlib.pyplot as plt
+import os
 import sys
 import getopt
 
 import loadData
-import gpx
+import helper
+import elevationProviders
+import stageTimer
 
 def main(argv):
     file = ''
@@ -11,26 +13,32 @@ def main(argv):
     osm_flag = False
     csv_flag = False
     gpx_flag = False
+    match = ''
+    results = 'gpx_ratings.csv'
     bar_flag = False
     direction = ''
     blacklist = ''
     location = ''
+    workers = None
+    render = True
     try:
-        opts, args = getopt.getopt(argv, "hbso:g:c:d:i:l:", [
-                                   "osm=", "gpx=", "csv=", "direction=", "ignore=", "location="])
+        opts, args = getopt.getopt(argv, "hbsno:g:c:d:i:l:e:w:m:r:p:", [
+                                   "osm=", "gpx=", "csv=", "direction=", "ignore=", "location=", "dem=", "workers=", "no-map", "match=", "results=", "profile="])
     except getopt.GetoptError:
         print(
-            'main.py -o <inputfile> -d <direction> -i <blacklisted_mountain> -l <state> -s')
-        print('main.py -g <inputfile>')
-        print('main.py -c <inputfile> -s')
+            'main.py -o <inputfile> -d <direction> -i <blacklisted_mountain> -l <state> -e <dem_folder> -p <profiler> -n -s')
+        print('main.py -g <inputfile> -m <mountain>')
+        print('main.py -g <directory or glob> -r <results_file> -w <workers> -s')
+        print('main.py -c <inputfile> -w <workers> -p <profiler> -n -s')
         print('main.py -b -s')
         sys.exit(2)
     for opt, arg in opts:
         if opt == '-h':
             print(
-                'main.py -o <inputfile> -d <direction> -i <blacklisted_mountain> -l <state> -s')
-            print('main.py -g <inputfile>')
-            print('main.py -c <inputfile> -s')
+                'main.py -o <inputfile> -d <direction> -i <blacklisted_mountain> -l <state> -e <dem_folder> -p <profiler> -n -s')
+            print('main.py -g <inputfile> -m <mountain>')
+            print('main.py -g <directory or glob> -r <results_file> -w <workers> -s')
+            print('main.py -c <inputfile> -w <workers> -p <profiler> -n -s')
             print('main.py -b -s')
             sys.exit()
         elif opt in ("-o", "--osm"):
@@ -48,19 +56,40 @@ def main(argv):
             blacklist = arg
         elif opt in ("-l", "--location"):
             location = arg
+        elif opt in ("-e", "--dem"):
+            helper.set_elevation_provider(
+                elevationProviders.RasterProvider(arg))
+        elif opt in ("-m", "--match"):
+            match = arg
+        elif opt in ("-r", "--results"):
+            results = arg
+        elif opt in ("-w", "--workers"):
+            workers = int(arg)
+        elif opt in ("-p", "--profile"):
+            stageTimer.set_profiler(arg)
+        elif opt in ("-n", "--no-map"):
+            render = False
         elif opt in ("-b"):
             bar_flag = True
         elif opt in ("-s"):
             save_flag = True
 
-    show_map = True
+    show_map = render
     if csv_flag:
-        loadData.bulk_osm(file, save_flag)
+        loadData.bulk_osm(file, save_flag, workers, render)
         show_map = False
     elif osm_flag:
-        loadData.osm(file, direction, save_flag, blacklist, location)
+        loadData.osm(file, direction, save_flag, blacklist, location, render)
     elif gpx_flag:
-        gpx.gpx(file)
+        import gpx
+        if os.path.isdir(file) or any(x in file for x in '*?['):
+            gpx.bulk_gpx(file, results, workers, save_flag)
+            show_map = False
+        elif match:
+            gpx.match_gpx(file, match)
+            show_map = False
+        else:
+            gpx.gpx(file)
     if bar_flag:
         loadData.barplot(save_flag)
         show_map = False
@@ -70,4 +99,5 @@ def main(argv):
 if __name__ == "__main__":
     show_map = main(sys.argv[1:])
     if show_map:
+        import matplotlib.pyplot as plt
         plt.show()
@@ -1,9 +1,22 @@
 from cProfile import label
 from math import degrees, atan2
 import matplotlib.pyplot as plt
+import numpy as np
+from matplotlib import rcParams
+from matplotlib.collections import LineCollection, PolyCollection
+from matplotlib.colors import to_rgba
+from tqdm import tqdm
 
 import helper
+import trailMetrics
 
+# Picks the point to put a trail's label on: the point whose surrounding label
+# sized stretch of trail is straightest, as long as the label fits on the
+# trail on both sides of it. Trail lengths before and after every point come
+# from one running total of the distances, and the straightness of every
+# candidate is scored at once, so a trail costs a few array passes instead of
+# a length calculation per point.
+#
 # Parameters:
 # df: dataframe with columns for lat, lon, and coordinates
 #   type-df(float, float, tuple)
@@ -16,44 +29,59 @@ import helper
 
 def get_label_placement(df, length, flip_lat_lon):
     point_count = len(df.coordinates)
-    point_gap = sum(helper.calculate_dist(df.coordinates)[1:])/point_count
+    lat, lon = trailMetrics.split_coordinates(df.coordinates)
+    distance = trailMetrics.point_distances(lat, lon)[1:]
+    # total[i] is the trail length up to point i
+    total = np.zeros(point_count)
+    total[1:] = np.cumsum(distance)
+    point_gap = float(total[-1]) / point_count
     letter_size = 10 / point_gap
     label_length = point_gap * length * letter_size
     label_length_in_points = int(label_length / point_gap)
     point = int(len(df.coordinates)/2)
-    angle_list = []
-    valid_list = []
-    for i, _ in enumerate(df.coordinates):
-        valid = False
-        if helper.get_trail_length(df.coordinates[0:i]) > label_length / 2:
-            if helper.get_trail_length(df.coordinates[i:-1]) > label_length / 2:
-                valid = True
-        if i == 0:
-            ang = 0
-        else:
-            dx = (df.lat[i])-(df.lat[i-1])
-            dy = (df.lon[i])-(df.lon[i-1])
-            ang = degrees(atan2(dx, dy))
-        angle_list.append(ang)
-        valid_list.append(valid)
-    frac_correct = (1, 0, 0)
-    for i, _ in enumerate(angle_list):
-        if valid_list[i]:
-            slice = angle_list[i-int(label_length_in_points / 2):i +
-                               int(label_length_in_points / 2)]
-            if len(slice) == 0:
-                continue
-            expected = sum(slice) / len(slice)
-            frac_correct_current = 0
-            correct = 0
-            for value in slice:
-                if abs(value-expected) < 5:
-                    correct += 1
-            frac_correct_current = correct / len(slice)
-            if frac_correct_current > frac_correct[1]:
-                frac_correct = (i, frac_correct_current, 0)
-    if frac_correct[1] != 0:
-        point = frac_correct[0]
+
+    # the label has to fit on points [0, i) and on points [i, point_count - 1)
+    index = np.arange(point_count)
+    before = total[np.maximum(index - 1, 0)]
+    after = np.zeros(point_count)
+    after[:-1] = total[-2] - total[:-1] if point_count > 1 else 0
+    # differences of the running total can round differently from adding the
+    # distances up directly, so points right at the limit are added up again
+    for i in np.flatnonzero(np.abs(after - label_length / 2) < 1e-6):
+        after[i] = sum(distance[i:point_count - 2].tolist())
+    valid = (before > label_length / 2) & (after > label_length / 2)
+
+    angle = np.zeros(point_count)
+    angle[1:] = np.degrees(np.arctan2(
+        np.diff(df.lat.to_numpy(dtype=float)), np.diff(df.lon.to_numpy(dtype=float))))
+
+    # fraction of the angles around each point within 5 degrees of their mean
+    half = int(label_length_in_points / 2)
+    frac_correct = np.zeros(point_count)
+    regular = valid & (index - half >= 0) & (index + half <= point_count)
+    if half > 0 and regular.any():
+        windows = angle[index[regular][:, None] +
+                        np.arange(-half, half)[None, :]]
+        expected = np.zeros(len(windows))
+        for column in range(2 * half):
+            expected = expected + windows[:, column]
+        expected = expected / (2 * half)
+        correct = (np.abs(windows - expected[:, None]) < 5).sum(axis=1)
+        frac_correct[regular] = correct / (2 * half)
+    # windows cut off by either end of the trail, sliced like python lists
+    angle_list = angle.tolist()
+    for i in np.flatnonzero(valid & ~regular):
+        slice = angle_list[i-half:i+half]
+        if len(slice) == 0:
+            continue
+        expected = sum(slice) / len(slice)
+        correct = 0
+        for value in slice:
+            if abs(value-expected) < 5:
+                correct += 1
+        frac_correct[i] = correct / len(slice)
+    if frac_correct.max(initial=0) > 0:
+        point = int(np.argmax(frac_correct))
     if point == 0:
         dx = 0
         dy = 0
@@ -163,18 +191,15 @@ def format_map_template(trails, lifts, mountain, direction):
 
 
 # Parameters:
-# object_tuple: trail/lift tuple
-#   type-tuple(df(float, float, tuple), string, int)
 # direction: map direction
 #   type-char
-# color: color of object
-#   type-string
 #
-# Returns: none
+# Returns: sign to multiply latitudes and longitudes by, and whether latitude
+# goes on the y axis (maps facing north or south) instead of the x axis
+#   type-tuple(int, int, bool)
 
 
-def place_object(blob):
-    object_tuple, direction, color = blob
+def get_orientation(direction):
     lat_mirror = 1
     lon_mirror = -1
     flip_lat_lon = False
@@ -187,37 +212,78 @@ def place_object(blob):
     if 'n' in direction or 'N' in direction:
         lat_mirror = -1
         flip_lat_lon = True
+    return (lat_mirror, lon_mirror, flip_lat_lon)
+
+# Draws every trail, area and lift of the map. All points are mirrored (and
+# turned for north and south facing maps) in one array operation, then the
+# lines go into one LineCollection per line style and the areas into one
+# PolyCollection, in object order, instead of an artist per object. Labels
+# are still one text each since every label has its own angle.
+#
+# Parameters:
+# objects: (trail/lift tuple, direction, color) of each object, the trail/lift
+# tuple being (df(float, float, tuple), name, difficulty_modifier, area flag)
+#   type-list of tuples
+# direction: map direction
+#   type-char
+#
+# Returns: none
+
 
-    point, ang = get_label_placement(
-        object_tuple[0][['lat', 'lon', 'coordinates']], len(object_tuple[1]), flip_lat_lon)
-    area = object_tuple[3]
-    if not flip_lat_lon:
-        X = object_tuple[0].lat
-        Y = object_tuple[0].lon
+def place_objects(objects, direction):
+    lat_mirror, lon_mirror, flip_lat_lon = get_orientation(direction)
+    lat, offsets = trailMetrics.to_ragged(
+        [object_tuple[0].lat for object_tuple, _, _ in objects])
+    lon, _ = trailMetrics.to_ragged(
+        [object_tuple[0].lon for object_tuple, _, _ in objects])
     if flip_lat_lon:
-        X = object_tuple[0].lon
-        Y = object_tuple[0].lat
-        temp = lat_mirror
-        lat_mirror = lon_mirror
-        lon_mirror = temp
-    if not area:
-        if object_tuple[2] == 0:
-            plt.plot(X * lat_mirror, Y * lon_mirror, c=color)
-        if object_tuple[2] > 0:
-            plt.plot(X * lat_mirror, Y * lon_mirror,
-                     c=color, linestyle='dashed')
-    if area:
-        if object_tuple[2] == 0:
-            plt.fill(X * lat_mirror, Y * lon_mirror, alpha=.1, fc=color)
-            plt.fill(X * lat_mirror, Y * lon_mirror, ec=color, fc='none')
-        if object_tuple[2] > 0:
-            plt.fill(X * lat_mirror, Y * lon_mirror, alpha=.1, fc=color)
-            plt.fill(X * lat_mirror, Y * lon_mirror,
-                     ec=color, fc='none', linestyle='dashed')
-    if color == 'gold':
-        color = 'black'
-    if helper.get_trail_length(object_tuple[0].coordinates) > 200:
-        plt.text(X[point] * lat_mirror, Y[point] * lon_mirror, object_tuple[1], {
+        points = np.column_stack([lon * lon_mirror, lat * lat_mirror])
+    else:
+        points = np.column_stack([lat * lat_mirror, lon * lon_mirror])
+
+    # runs of consecutive lines with the same linestyle, list((linestyle,
+    # points, colors)). Each run becomes one collection, added in order so
+    # lines overlap in object order like they did when drawn one by one.
+    lines = []
+    areas = ([], [], [], [])  # (points, face colors, edge colors, linestyles)
+    labels = []
+    for i in tqdm(range(len(objects)), desc="Placing Objects…", ascii=False, ncols=75):
+        object_tuple, _, color = objects[i]
+        object_points = points[offsets[i]:offsets[i + 1]]
+        if object_tuple[2] < 0:
+            linestyle = None
+        elif object_tuple[2] == 0:
+            linestyle = 'solid'
+        else:
+            linestyle = 'dashed'
+        if linestyle is not None and not object_tuple[3]:
+            if not lines or lines[-1][0] != linestyle:
+                lines.append((linestyle, [], []))
+            lines[-1][1].append(object_points)
+            lines[-1][2].append(color)
+        if linestyle is not None and object_tuple[3]:
+            # a see through fill, then the outline on top of it
+            areas[0].extend([object_points, object_points])
+            areas[1].extend([to_rgba(color, .1), 'none'])
+            areas[2].extend(['none', color])
+            areas[3].extend(['solid', linestyle])
+        if helper.get_trail_length(object_tuple[0].coordinates) > 200:
+            point, ang = get_label_placement(
+                object_tuple[0][['lat', 'lon', 'coordinates']], len(object_tuple[1]), flip_lat_lon)
+            labels.append((object_points[point], object_tuple[1], 'black' if color == 'gold' else color, ang))
+
+    axes = plt.gca()
+    if areas[0]:
+        axes.add_collection(PolyCollection(
+            areas[0], facecolors=areas[1], edgecolors=areas[2], linestyles=areas[3], linewidths=rcParams['patch.linewidth']))
+    # Line2D draws solid lines with projecting caps and dashes with butt caps
+    capstyles = {'solid': 'projecting', 'dashed': 'butt'}
+    for linestyle, line_points, colors in lines:
+        axes.add_collection(LineCollection(line_points, colors=colors, linestyles=linestyle,
+                                           linewidths=rcParams['lines.linewidth'], capstyle=capstyles[linestyle], joinstyle='round'))
+    axes.autoscale_view()
+    for (x, y), name, color, ang in labels:
+        plt.text(x, y, name, {
             'color': color, 'size': 2, 'rotation': ang}, ha='center',
             backgroundcolor='white', va='center', bbox=dict(boxstyle='square,pad=0.01',
                                                             fc='white', ec='none'))
@@ -227,18 +293,7 @@ def add_legend(trail, direction, size, legend_offset):
         size = 8
     if size <= 2.5:
         return
-    lat_mirror = 1
-    lon_mirror = -1
-    flip_lat_lon = False
-    if 'e' in direction or 'E' in direction:
-        lat_mirror = -1
-        lon_mirror = 1
-    if 's' in direction or 'S' in direction:
-        lon_mirror = 1
-        flip_lat_lon = True
-    if 'n' in direction or 'N' in direction:
-        lat_mirror = -1
-        flip_lat_lon = True
+    lat_mirror, lon_mirror, flip_lat_lon = get_orientation(direction)
 
     if flip_lat_lon:
         y = trail[0].lat.to_list()[0]
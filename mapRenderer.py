@@ -0,0 +1,114 @@
+import os
+
+import matplotlib.pyplot as plt
+
+import helper
+import mapHelper
+import stageTimer
+
+# Everything that draws with matplotlib. The numbers shown come from
+# ratingEngine, so nothing in here changes a rating.
+
+# accepts a list of trail tuples, a list of lift tuples, the manifest record
+# (rating and color) of each trail from ratingEngine.rate_trails, the name of
+# the ski area, and the direction the map should face. The last param is a
+# bool for whether to save the map.
+#
+# Return: none
+
+
+def create_map(trails, lifts, records, mountain, cardinal_direction, save=False):
+    print('Creating Map')
+    with stageTimer.stage('template'):
+        mapHelper.format_map_template(
+            trails, lifts, mountain, cardinal_direction)
+    objects = []
+    for entry in lifts:
+        lift_name = entry[1]
+        objects.append(((entry[0], lift_name, 0, 0), cardinal_direction, 'grey'))
+
+    for entry, record in zip(trails, records):
+        color = record['color']
+        rating = round(record['rating'] * 100, 1)
+        trail_name = entry[1]
+        trail_name = '{} {}{}'.format(
+            trail_name.strip(), rating, u'\N{DEGREE SIGN}')
+        objects.append(((entry[0], trail_name, entry[2], entry[3], entry[4]), cardinal_direction, color))
+
+    with stageTimer.stage('labels'):
+        mapHelper.place_objects(objects, cardinal_direction)
+
+    if save:
+        with stageTimer.stage('svg'):
+            save_svg('maps/{}.svg'.format(helper.format_name(mountain)))
+        print('SVG saved')
+    plt.draw()
+
+# Parameters:
+# df_difficulty: dataframe with column for mountain name, difficulty rating, and color
+#   type-df(string, float, string)
+# df_ease: dataframe with column for mountain name, beginner friendliness rating, and color
+#   type-df(string, float, string)
+# save: bool for whether to save the output to an svg
+#   type-bool
+#
+# Return: none
+
+
+def create_difficulty_barplot(df, file_name ,save=False):
+    if len(file_name.split('/')) > 1:
+        name = file_name.split('/')[1]
+    else:
+        name = file_name 
+    df = df.sort_values(by='difficulty', ascending=False)
+    df['diff_color'] = [helper.set_color(x/100) for x in df['difficulty']]
+    plt.figure(figsize=(8, (len(df['difficulty'])*.13) + 1.5))
+    plt.barh(df['mountain'], df['difficulty'], color=df['diff_color'])
+    plt.title('{} Difficulty Comparison'.format(name), fontsize=20)
+    plt.xlabel('Longer bar = more expert friendly')
+    plt.xlim(0,55)
+    plt.tight_layout()
+    plt.grid(axis='x')
+    for i, value in enumerate(df.difficulty):
+        plt.text(value+1, i, round(value, 1), ha='center', va='center', size=6)
+        text_color = 'white'
+        if df.diff_color.to_list()[i] == 'gold':
+            text_color = 'black'
+        plt.text(0.5, i, i + 1, ha='left', va='center', size = 7, color=text_color)
+
+    if save:
+        save_svg('maps/difficulty_barplots/{}.svg'.format(file_name))
+    plt.draw()
+    df['ease_color'] = [helper.set_color(x/100) for x in df['ease']]
+    df['ease'] = 30 - df['ease']
+    df = df.sort_values(by='ease', ascending=True)
+    plt.figure(figsize=(8, (len(df['ease'])*.13) + 1.5))
+    plt.barh(df['mountain'], df['ease'], color=df['ease_color'])
+    plt.title(f'{name} Beginner Friendliness', fontsize=20)
+    plt.xlabel('Longer bar = more beginner friendly')
+    plt.xlim(0,30)
+    plt.tight_layout()
+    plt.grid(axis='x')
+    row_count = len(df.ease)
+    for i, value in enumerate(df.ease):
+        plt.text(value+.5, i, round(value, 1), ha='center', va='center', size=6)
+        plt.text(0.25, i, row_count - i, ha='left', va='center', size = 7, color='white')
+
+    if save:
+        save_svg('maps/beginner_friendliness_barplots/{}.svg'.format(file_name))
+        print(f'{file_name} SVG saved')
+    plt.draw()
+
+# Saves the current figure, creating its folder under maps/ (which isn't part
+# of the repository) if needed.
+#
+# Parameters:
+# filename: path of the svg
+#   type-str
+#
+# Return: none
+
+
+def save_svg(filename):
+    os.makedirs(os.path.dirname(filename), exist_ok=True)
+    plt.savefig(filename, format='svg')
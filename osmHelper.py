@@ -1,179 +1,263 @@
+import re
+from xml.parsers import expat
+
+import numpy as np
 import pandas as pd
 
+# What a tag can say about a way, combined over all of its tags
+TRAIL = 1
+LIFT = 2
+GLADE = 4
+AREA = 8
+BACKCOUNTRY = 16
+NOT_GLADED = 32
+
+# (key, value, properties) of every tag that matters for trails and lifts. A
+# value of None matches any value the key has no rule of its own for, so the
+# zip line and station rules turn off the lift rule for those aerialways. Tags
+# with several values ("downhill;nordic") match each of them.
+TAG_RULES = [
+    ('piste:difficulty', None, TRAIL),
+    ('piste:type', 'downhill', TRAIL),
+    ('piste:type', 'backcountry', BACKCOUNTRY),
+    ('piste:type', 'nordic', BACKCOUNTRY),
+    ('piste:type', 'skitour', BACKCOUNTRY),
+    ('landuse', 'grass', BACKCOUNTRY),
+    ('natural', 'grassland', BACKCOUNTRY),
+    ('gladed', 'yes', GLADE),
+    ('piste:grooming', 'glade', GLADE),
+    ('gladed', 'no', NOT_GLADED),
+    ('leaf_type', None, GLADE | AREA),
+    ('area', 'yes', AREA),
+    ('natural', 'wood', AREA),
+    ('aerialway', None, LIFT),
+    ('aerialway', 'zip_line', 0),
+    ('aerialway', 'station', 0),
+]
+
+# a way named like one of these is a glade, matched on whole words
+NAME_KEYS = ('name', 'piste:name')
+GLADE_NAME = re.compile(r'\b(glades?|gladed|tree skiing)\b', re.IGNORECASE)
+
 # Parameters:
-# line: one line of the osm file
-#   type-str
-# difficulty_modifier: int value for additional difficulty parameters
+# rules: (key, value, properties) of each rule, see TAG_RULES
+#   type-list(tuple(str, str, int))
+#
+# Returns: properties of every (key, value) pair with a rule
+#   type-dict(tuple(str, str), int)
+
+def compile_rules(rules):
+    compiled = {}
+    for key, value, properties in rules:
+        compiled[(key, value)] = compiled.get((key, value), 0) | properties
+    return compiled
+
+
+RULES = compile_rules(TAG_RULES)
+
+# Parameters:
+# tags: (key, value) tag pairs of a way
+#   type-list(tuple(str, str))
+#
+# Returns: properties of the way (TRAIL, LIFT, ... combined) and its name
+#   type-tuple(int, str)
+
+def classify_way(tags):
+    properties = 0
+    way_name = ''
+    for key, value in tags:
+        if key == 'name':
+            way_name = value
+        if ';' in value:
+            for part in value.split(';'):
+                part = part.strip()
+                properties |= RULES.get((key, part), RULES.get((key, None), 0))
+        else:
+            properties |= RULES.get((key, value), RULES.get((key, None), 0))
+        if key in NAME_KEYS and GLADE_NAME.search(value):
+            properties |= GLADE
+    return (properties, way_name)
+
+# Parameters:
+# ways: way records in file order
+#   type-list(tuple(str, str, list(int), int, bool, bool, bool, bool))
+#
+# Returns: the trails and lifts as one flat array of node ids, the offsets of
+# each way into it (way i is way_nodes[way_offsets[i]:way_offsets[i+1]]), and
+# a row of way info per way. A way tagged as both a trail and a lift gets a
+# row for each.
+#   type-tuple(array(int64), array(int64), df(str, str, int, bool, bool))
+
+def assemble_ways(ways):
+    way_nodes = []
+    way_offsets = [0]
+    way_info = []  # list((way_name, way_id, difficulty_modifier, is_area, is_lift))
+
+    for way_id, way_name, in_way_ids, difficulty_modifier, is_trail, is_lift, is_area, is_backcountry in ways:
+        if is_trail and not is_backcountry:
+            way_nodes.extend(in_way_ids)
+            way_offsets.append(len(way_nodes))
+            way_info.append((way_name, way_id, difficulty_modifier, is_area, False))
+        if is_lift:
+            way_nodes.extend(in_way_ids)
+            way_offsets.append(len(way_nodes))
+            way_info.append((way_name, way_id, difficulty_modifier, is_area, True))
+    way_info = pd.DataFrame(way_info, columns=[
+                            'name', 'way_id', 'difficulty_modifier', 'is_area', 'is_lift'])
+    return (np.array(way_nodes, dtype=np.int64), np.array(way_offsets, dtype=np.int64), way_info)
+
+# Parameters:
+# ways: output of assemble_ways
+#   type-tuple(array(int64), array(int64), df)
+# index: row of the way in way_info
 #   type-int
-# is_trail: trail flag
-#   type-bool
-# is_lift: lift flag
-#   type-bool
-# is_glade: woods trail flag
-#   type-bool
-# is_area: area flag
-#   type-bool
-# is_backcountry: non-frontside trail flag
+#
+# Returns: node ids of the way, in order
+#   type-array(int64)
+
+def get_way_nodes(ways, index):
+    way_nodes, way_offsets, _ = ways
+    return way_nodes[way_offsets[index]:way_offsets[index + 1]]
+
+# Parameters:
+# id: OSM node ids
+#   type-list(int)
+# lat: node latitudes
+#   type-list(float)
+# lon: node longitudes
+#   type-list(float)
+#
+# Returns: node ids sorted for lookup with matching latitudes and longitudes
+#   type-tuple(array(int64), array(float64), array(float64))
+
+def build_node_index(id, lat, lon):
+    id = np.array(id, dtype=np.int64)
+    order = np.argsort(id, kind='stable')
+    lat = np.array(lat, dtype=np.float64)[order]
+    lon = np.array(lon, dtype=np.float64)[order]
+    return (id[order], lat, lon)
+
+# Parameters:
+# node_index: output of build_node_index
+#   type-tuple(array(int64), array(float64), array(float64))
+# way_ids: node ids of a way, in order
+#   type-array(int64)
+#
+# Returns: df with the way's points. Nodes missing from the file are dropped
+# and repeated nodes (closed ways) are grouped after their first occurrence,
+# the same order the old pd.merge produced, so cached points still line up.
+#   type-df(float, float, tuple)
+
+def resolve_way(node_index, way_ids):
+    id, lat, lon = node_index
+    way_ids = np.asarray(way_ids, dtype=np.int64)
+    _, first, inverse = np.unique(way_ids, return_index=True, return_inverse=True)
+    way_ids = way_ids[np.argsort(first[inverse], kind='stable')]
+    position = np.searchsorted(id, way_ids)
+    position[position == len(id)] = 0
+    position = position[id[position] == way_ids] if len(id) else position[:0]
+    df = pd.DataFrame()
+    df['lat'] = lat[position]
+    df['lon'] = lon[position]
+    df['coordinates'] = list(zip(df['lat'], df['lon']))
+    return df
+
+# Parameters:
+# way_id: OSM id of the way
+#   type-str
+# blacklist: OSM ids from the blacklist file
+#   type-frozenset(int)
+# whitelist_mode: toggle between using a whitelist or a blacklist
 #   type-bool
-# glade_override: overrides is_glade if set
+#
+# Returns: whether the way should be skipped
 #   type-bool
+
+def is_excluded(way_id, blacklist, whitelist_mode):
+    if whitelist_mode:
+        return int(way_id) not in blacklist
+    return int(way_id) in blacklist
+
+# Parameters:
+# way_id: OSM id of the way
+#   type-str
+# in_way_ids: node ids of the way
+#   type-list(int)
+# tags: (key, value) tag pairs of the way
+#   type-list(tuple(str, str))
 #
-# Return: the modified states of the parameters plus node_id and way_name
-#   type-tuple(str, str, int, bool, bool, bool, bool, bool, bool)
+# Returns: way record for assemble_ways, or None if the way is not a trail or lift
+#   type-tuple(str, str, list(int), int, bool, bool, bool, bool)
 
-def process_way_tags(line, difficulty_modifier, is_trail, is_lift, is_glade, is_area, is_backcountry, glade_override):
-    node_id = ''
-    way_name = ''
-    if '<nd' in line:
-        split_row = line.split('"')
-        node_id = split_row[1]
-    if '<tag k="name"' in line:
-        split_row = line.split('"')
-        way_name = split_row[3]
-    if '<tag k="piste:difficulty"' in line:
-        is_trail = True
-    if '<tag k="piste:type"' in line and 'downhill' in line:
-        is_trail = True
-    if '<tag k="piste:type"' in line and 'backcountry' in line:
-        is_backcountry = True
-    if '<tag k="piste:type"' in line and 'nordic' in line:
-        is_backcountry = True
-    if '<tag k="piste:type"' in line and 'skitour' in line:
-        is_backcountry = True
-    if '<tag k="landuse" v="grass"/>' in line:
-        is_backcountry = True
-    if '<tag k="natural" v="grassland"/>' in line:
-        is_backcountry = True
-    if '<tag k="gladed" v="yes"/>' in line and not is_glade:
-        difficulty_modifier += 1
-        is_glade = True
-    if '<tag k="gladed" v="no"/>' in line:
-        glade_override = True
-    if '<tag k="leaf_type"' in line and not is_glade:
-        difficulty_modifier += 1
-        is_glade = True
-    if '<tag k="leaf_type"' in line or '<tag k="area" v="yes"/>' in line:
-        is_area = True
-    if '<tag k="natural" v="wood"/>' in line:
-        is_area = True
-    if 'glade' in line and not is_glade:
-        difficulty_modifier += 1
-        is_glade = True
-    if 'Glade' in line and not is_glade:
-        difficulty_modifier += 1
-        is_glade = True
-    if '<tag k="aerialway"' in line and not 'v="zip_line"' in line and not 'v="station"' in line:
-        is_lift = True
-    if 'Tree Skiing' in line and not is_glade:
-        difficulty_modifier += 1
-        is_glade = True
-    return((node_id, way_name, difficulty_modifier, is_trail, is_lift, is_glade, is_area, is_backcountry, glade_override))
+def read_way(way_id, in_way_ids, tags):
+    properties, way_name = classify_way(tags)
+    is_trail = bool(properties & TRAIL)
+    is_lift = bool(properties & LIFT)
+    is_area = bool(properties & AREA)
+    is_backcountry = bool(properties & BACKCOUNTRY)
+    if not ((is_trail and not is_backcountry) or is_lift):
+        return None
+    # gladed=no overrides everything else that makes it a glade
+    difficulty_modifier = 1 if properties & GLADE and not properties & NOT_GLADED else 0
+    return (way_id, way_name, in_way_ids, difficulty_modifier,
+            is_trail, is_lift, is_area, is_backcountry)
 
+# Reads an osm file with expat. The osm file is fed to the parser in
+# chunks and nothing but the node table and the current way is kept, so memory
+# is bounded by the number of nodes rather than the size of the file.
+#
 # Parameters:
-# lines: a list of lines from the osm file
-#   type-list(str)
-# blacklist: name of blacklist files
+# filename: path to the osm file
 #   type-str
+# blacklist: OSM ids from the blacklist file
+#   type-frozenset(int)
 # whitelist_mode: toggle between using a whitelist or a blacklist
 #   type-bool
 #
-# Returns: tuple of nodes and trail and lift info
-#   type-tuple(df, df, df, list, int, list)
-
-def process_osm(lines, blacklist, whitelist_mode=False):
-    DEBUG_TRAILS = False
-
-    way_df = pd.DataFrame()
-    lift_df = pd.DataFrame()
-    id = []  # for node_df
-    lat = []  # for node_df
-    lon = []  # for node_df
-    coordinates = []  # for node_df
-    in_way_ids = []  # all OSM ids for a way, used for way_df
-    useful_info_list = []  # list((way_name, difficulty_modifier, is_area))
-    trail_and_id_list = []  # list((trail_name, OSM id))
-    blank_name_count = 0
-    total_trail_count = 0
-
-    in_way = False
-    way_name = ''
+# Returns: node index and the trails and lifts
+#   type-tuple(tuple(array, array, array), tuple(array, array, df))
+
+def process_osm_file(filename, blacklist, whitelist_mode=False):
+    id = []  # for node_index
+    lat = []  # for node_index
+    lon = []  # for node_index
+    ways = []
+    way = []  # [way_id, node ids, tags] of the way being read
+
+    # expat only reports element starts here: a way's <nd> and <tag> children
+    # are collected until the next top level element (or the end of the file)
+    # closes it, which saves a python callback for every element end
+    def finish_way():
+        record = read_way(*way)
+        if record is not None:
+            ways.append(record)
+        way.clear()
+
+    def start_element(name, attrs):
+        if name == 'nd':
+            if way:
+                way[1].append(int(attrs['ref']))
+        elif name == 'tag':
+            if way:
+                way[2].append((attrs.get('k', ''), attrs.get('v', '')))
+        else:
+            if way:
+                finish_way()
+            if name == 'node':
+                id.append(int(attrs['id']))
+                lat.append(float(attrs['lat']))
+                lon.append(float(attrs['lon']))
+            elif name == 'way' and not is_excluded(attrs['id'], blacklist, whitelist_mode):
+                way.extend((attrs['id'], [], []))
+
+    parser = expat.ParserCreate()
+    parser.StartElementHandler = start_element
+    with open(filename, 'rb') as file:
+        # some exports have whitespace in front of the xml declaration
+        start = file.read(64)
+        file.seek(len(start) - len(start.lstrip()))
+        parser.ParseFile(file)
+    if way:
+        finish_way()
 
-    for row in lines:
-        row = str(row)
-        # handling nodes
-        if '<node' in row:
-            split_row = row.split('"')
-            for i, word in enumerate(split_row):
-                if ' id=' in word:
-                    id.append(split_row[i+1])
-                if 'lat=' in word:
-                    lat.append(float(split_row[i+1]))
-                if 'lon=' in word:
-                    lon.append(float(split_row[i+1]))
-            coordinates.append((lat[-1], lon[-1]))
-        # start of a way
-        if '<way' in row:
-            in_way = True
-            is_trail = False
-            is_glade = False
-            is_backcountry = False
-            is_area = False
-            is_lift = False
-            glade_override = False
-            difficulty_modifier = 0
-            way_id = row.split('"')[1]
-            if (str(way_id) not in blacklist) and whitelist_mode:
-                in_way = False
-            if (str(way_id) in blacklist) and not whitelist_mode:
-                in_way = False
-        # handling when inside a way
-        if in_way:
-            if '</way>' in row:
-                if glade_override and is_glade:
-                    difficulty_modifier -= 1
-                if is_trail and not is_backcountry:
-                    total_trail_count += 1
-                    trail_and_id_list.append((way_name, way_id))
-                    if DEBUG_TRAILS:
-                        way_name = way_id
-                    if way_name == '':
-                        way_name = ' _' + str(blank_name_count)
-                        blank_name_count += 1
-                    if way_name in way_df.columns:
-                        way_name = way_name + '_' + str(blank_name_count)
-                        blank_name_count += 1
-                    temp_df = pd.DataFrame()
-                    temp_df[way_name] = in_way_ids
-                    way_df = pd.concat([way_df, temp_df], axis=1)
-                    useful_info_list.append(
-                        (way_name, difficulty_modifier, is_area, way_id))
-                if is_lift:
-                    trail_and_id_list.append((way_name, way_id))
-                    if DEBUG_TRAILS:
-                        way_name = way_id
-                    if way_name == '':
-                        way_name = ' _' + str(blank_name_count)
-                        blank_name_count += 1
-                    if way_name in lift_df.columns:
-                        way_name = way_name + '_' + str(blank_name_count)
-                        blank_name_count += 1
-                    temp_df = pd.DataFrame()
-                    temp_df[way_name] = in_way_ids
-                    lift_df = pd.concat([lift_df, temp_df], axis=1)
-                in_way_ids = []
-                in_way = False
-                way_name = ''
-            else:
-                tags = process_way_tags(row, difficulty_modifier, is_trail, is_lift, is_glade, is_area,is_backcountry, glade_override)
-                if tags[0] != '':
-                    in_way_ids.append(tags[0])
-                if tags[1] != '':
-                    way_name = tags[1]
-                _, _, difficulty_modifier, is_trail, is_lift, is_glade, is_area, is_backcountry, glade_override = tags
-    node_df = pd.DataFrame()
-    node_df['id'] = id
-    node_df['lat'] = lat
-    node_df['lon'] = lon
-    node_df['coordinates'] = coordinates
-
-    return (node_df, way_df, lift_df, useful_info_list, total_trail_count, trail_and_id_list)
\ No newline at end of file
+    return (build_node_index(id, lat, lon), assemble_ways(ways))
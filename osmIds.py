@@ -0,0 +1,80 @@
+from glob import glob
+from os.path import exists
+
+import pandas as pd
+
+# OSM ids of the trails and lifts each mountain had on its last run, as written
+# to cached/osm_ids by saveData.save_trail_ids. They are what -i blacklists (or
+# whitelists) and are checked for every way of an osm file, so they are kept as
+# sets of ints: a bulk run reads every file once up front and hands the sets to
+# its workers instead of each resort reading its neighbour's csv again.
+# mountain -> frozenset(int)
+registry = {}
+
+# Parameters:
+# mountain: name of ski area
+#   type-str
+#
+# Returns: the OSM ids in cached/osm_ids/<mountain>.csv
+#   type-frozenset(int)
+
+
+def read(mountain):
+    df = pd.read_csv('cached/osm_ids/{}.csv'.format(mountain), usecols=['id'])
+    return frozenset(df['id'].astype('int64').tolist())
+
+# Reads every file in cached/osm_ids into the registry.
+#
+# Returns: the registry
+#   type-dict(str, frozenset(int))
+
+
+def load_all():
+    for filename in sorted(glob('cached/osm_ids/*.csv')):
+        mountain = filename.replace('\\', '/').split('/')[-1][:-4]
+        registry[mountain] = read(mountain)
+    return registry
+
+# Replaces the registry, for worker processes given the one their parent loaded.
+#
+# Parameters:
+# ids: mountain -> OSM ids
+#   type-dict(str, frozenset(int))
+#
+# Return: none
+
+
+def set_registry(ids):
+    registry.clear()
+    registry.update(ids)
+
+# Parameters:
+# mountain: name of ski area
+#   type-str
+#
+# Returns: the mountain's OSM ids, read from its file the first time it's asked
+# for outside of a bulk run. None if the mountain has no ids file.
+#   type-frozenset(int)
+
+
+def get(mountain):
+    if mountain not in registry:
+        if not exists('cached/osm_ids/{}.csv'.format(mountain)):
+            return None
+        registry[mountain] = read(mountain)
+    return registry[mountain]
+
+# Records the ids a run just wrote for the mountain, so later lookups in this
+# process see them without reading the file.
+#
+# Parameters:
+# mountain: name of ski area
+#   type-str
+# way_ids: OSM ids of the mountain's trails and lifts
+#   type-list(str)
+#
+# Return: none
+
+
+def update(mountain, way_ids):
+    registry[mountain] = frozenset(int(x) for x in way_ids)
@@ -0,0 +1,100 @@
+import helper
+import trailMetrics
+
+# The numbers behind every map: per-trail ratings and the resort's difficulty,
+# ease and vertical. Nothing here (or anything it imports) uses matplotlib, so
+# compute-only runs never load it. mapRenderer draws the results.
+
+# Calculates slopes and difficulties for the trails from
+# loadData.generate_trails_and_lifts that need it and fills in their manifest
+# records. Trails that already have a rating in their record are passed
+# through, their points were cached with slopes.
+#
+# Parameters:
+# trail_list: trails from loadData.generate_trails_and_lifts
+#   type-list of tuples
+#
+# Returns: trail tuples with the perimeter of areas first and the line that is
+# rated fifth, and the manifest record (hash, rating, length, vertical, top,
+# bottom and color) of each trail
+#   type-tuple(list of tuples, list of dicts)
+
+
+def rate_trails(trail_list):
+    finished_trail_list = []
+    for entry in trail_list:
+        if 'rating' in entry[6]:
+            # unchanged since the last run, its points already have slopes
+            finished_trail_list.append(entry[:6])
+            continue
+        if not entry[3]:
+            trail = entry[0]
+        else:
+            trail = entry[4]
+            perimeter = entry[0]
+            lat, lon = trailMetrics.split_coordinates(perimeter['coordinates'])
+            metrics = trailMetrics.calculate_trail_metrics(
+                lat, lon, perimeter['elevation'])
+            perimeter['distance'] = metrics[0]
+            perimeter['elevation_change'] = metrics[1]
+            perimeter['slope'] = metrics[2]
+
+        trail['elevation'] = helper.smooth_elevations(
+            trail['elevation'].to_list(), 0)
+        lat, lon = trailMetrics.split_coordinates(trail['coordinates'])
+        metrics = trailMetrics.calculate_trail_metrics(
+            lat, lon, trail['elevation'])
+        trail['distance'] = metrics[0]
+        trail['elevation_change'] = metrics[1]
+        trail['slope'] = metrics[2]
+        trail['difficulty'] = metrics[3]
+        if not entry[3]:
+            finished_trail_list.append(
+                (trail, entry[1], entry[2], entry[3], entry[4], entry[5]))
+        else:
+            finished_trail_list.append(
+                (perimeter, entry[1], entry[2], entry[3], trail, entry[5]))
+
+    # rate the new and changed trails and fill in their manifest records
+    changed = [i for i, entry in enumerate(trail_list) if 'rating' not in entry[6]]
+    difficulty, offsets = trailMetrics.to_ragged(
+        [finished_trail_list[i][4 if finished_trail_list[i][3] else 0]['difficulty'] for i in changed])
+    ratings = trailMetrics.rate_trails(difficulty, offsets)
+    for i, rating in zip(changed, ratings.tolist()):
+        entry = finished_trail_list[i]
+        record = trail_list[i][6]
+        record['rating'] = rating
+        record['length'] = helper.get_trail_length(
+            entry[4 if entry[3] else 0].coordinates)
+        record['vertical'] = float(helper.calculate_trail_vert(entry[0].elevation))
+        record['top'] = float(entry[0].elevation.max())
+        record['bottom'] = float(entry[0].elevation.min())
+        record['color'] = helper.set_color(rating, entry[2])
+    return (finished_trail_list, [entry[6] for entry in trail_list])
+
+# Parameters:
+# records: manifest record of each trail, see rate_trails
+#   type-list of dicts
+#
+# Return: the relative difficulty of hard terrain and the relative ease
+# for beginner terrain
+#   type-tuple(float,float)
+
+
+def rate_mountain(records):
+    rating_list = [round((x['rating'] * 100), 0)
+                   for x in records if x['length'] > 100]
+    rating_list.sort(reverse=True)
+    long_list = 30
+    if len(rating_list) < 30:
+        long_list = len(rating_list)
+    hard_list = [rating_list[0:long_list], rating_list[0:5]]
+    mountain_difficulty_rating = (
+        (sum(hard_list[0])/long_list) * .2) + ((sum(hard_list[1])/5) * .8)
+    mountain_difficulty_rating = round(mountain_difficulty_rating, 1)
+    rating_list.sort()
+    easy_list = [rating_list[0:long_list], rating_list[0:5]]
+    mountain_ease_rating = (
+        (sum(easy_list[0])/long_list) * .2) + ((sum(easy_list[1])/5) * .8)
+    mountain_ease_rating = round(mountain_ease_rating, 1)
+    return((mountain_difficulty_rating, mountain_ease_rating))
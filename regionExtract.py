@@ -0,0 +1,401 @@
+import os
+import sys
+from glob import glob
+from math import floor
+from os.path import exists
+from xml.parsers import expat
+from xml.sax.saxutils import escape
+
+import numpy as np
+import pandas as pd
+from tqdm import tqdm
+
+import osmHelper
+import osmIds
+
+# Splits one regional extract (.osm, or .osm.pbf with pyosmium installed) into
+# an osm file per resort in a single pass, instead of exporting every resort by
+# hand. Each resort has a bounding box, or a boundary polygon, in
+# resort_bounds.csv. Only nodes near a boundary and ways with piste or
+# aerialway tags are kept while reading, then every way goes to the resort that
+# holds most of its nodes. Since a way ends up in one file only, neighbours
+# extracted together don't need a blacklist.
+
+# nodes this far outside a boundary are kept so trails that leave it are not cut
+# (degrees, about 1km)
+MARGIN = 0.01
+
+# size of the grid cells used to decide which nodes to keep while reading
+# (degrees)
+CELL = 0.05
+
+# Parameters:
+# filename: csv with mountain, south, west, north and east columns and an
+# optional polygon column of "lat lon, lat lon, ..." points, which replaces the
+# box when it is filled in
+#   type-str
+#
+# Returns: name, box and polygon (latitudes and longitudes, None if the resort
+# only has a box) of every resort
+#   type-list(tuple(str, float, float, float, float, tuple(array, array)))
+
+
+def load_bounds(filename='resort_bounds.csv'):
+    df = pd.read_csv(filename)
+    bounds = []
+    for _, row in df.iterrows():
+        polygon = None
+        if isinstance(row.get('polygon'), str) and row['polygon'].strip():
+            points = np.array([[float(x) for x in point.split()]
+                              for point in row['polygon'].split(',')])
+            polygon = (points[:, 0], points[:, 1])
+            box = (points[:, 0].min(), points[:, 1].min(),
+                   points[:, 0].max(), points[:, 1].max())
+        else:
+            box = (row['south'], row['west'], row['north'], row['east'])
+        bounds.append((row['mountain'],) + tuple(float(x) for x in box) + (polygon,))
+    return bounds
+
+# Parameters:
+# bound: one resort from load_bounds
+#   type-tuple
+# lat: latitudes
+#   type-array(float)
+# lon: longitudes
+#   type-array(float)
+#
+# Returns: whether each point is inside the resort's boundary
+#   type-array(bool)
+
+
+def inside(bound, lat, lon):
+    _, south, west, north, east, polygon = bound
+    result = (lat >= south) & (lat <= north) & (lon >= west) & (lon <= east)
+    if polygon is None or not result.any():
+        return result
+    # even-odd rule, for the points inside the box
+    candidates = np.flatnonzero(result)
+    lat = lat[candidates]
+    lon = lon[candidates]
+    polygon_lat, polygon_lon = polygon
+    crossings = np.zeros(len(candidates), dtype=bool)
+    for i in range(len(polygon_lat)):
+        lat_1, lon_1 = polygon_lat[i - 1], polygon_lon[i - 1]
+        lat_2, lon_2 = polygon_lat[i], polygon_lon[i]
+        if lat_1 == lat_2:
+            continue
+        spans = (lat_1 > lat) != (lat_2 > lat)
+        crossing_lon = lon_1 + (lat - lat_1) * (lon_2 - lon_1) / (lat_2 - lat_1)
+        crossings ^= spans & (lon < crossing_lon)
+    result[candidates] = crossings
+    return result
+
+# Parameters:
+# bounds: resorts from load_bounds
+#   type-list(tuple)
+#
+# Returns: grid cells within MARGIN of any resort's box
+#   type-set(tuple(int, int))
+
+
+def kept_cells(bounds):
+    cells = set()
+    for _, south, west, north, east, _ in bounds:
+        for y in range(floor((south - MARGIN) / CELL), floor((north + MARGIN) / CELL) + 1):
+            for x in range(floor((west - MARGIN) / CELL), floor((east + MARGIN) / CELL) + 1):
+                cells.add((y, x))
+    return cells
+
+# Parameters:
+# tags: (key, value) tags of a way
+#   type-list(tuple(str, str))
+#
+# Returns: whether the way can be a trail or lift
+#   type-bool
+
+
+def is_ski_way(tags):
+    return any(key.startswith('piste:') or key == 'aerialway' for key, _ in tags)
+
+# Parameters:
+# filename: path to the regional .osm file
+#   type-str
+# cells: grid cells to keep nodes from, see kept_cells
+#   type-set(tuple(int, int))
+#
+# Returns: id, latitude and longitude of every kept node and the id, node ids
+# and tags of every piste or aerialway way
+#   type-tuple(list(int), list(float), list(float), list(tuple(str, list(int), list(tuple(str, str)))))
+
+
+def read_osm(filename, cells):
+    id = []
+    lat = []
+    lon = []
+    ways = []
+    way = []  # [way_id, node ids, tags] of the way being read
+
+    # like osmHelper.process_osm_file, a way's children are collected until
+    # the next top level element
+    def finish_way():
+        if is_ski_way(way[2]):
+            ways.append(tuple(way))
+        way.clear()
+
+    def start_element(name, attrs):
+        if name == 'nd':
+            if way:
+                way[1].append(int(attrs['ref']))
+        elif name == 'tag':
+            if way:
+                way[2].append((attrs.get('k', ''), attrs.get('v', '')))
+        else:
+            if way:
+                finish_way()
+            if name == 'node':
+                node_lat = float(attrs['lat'])
+                node_lon = float(attrs['lon'])
+                if (floor(node_lat / CELL), floor(node_lon / CELL)) in cells:
+                    id.append(int(attrs['id']))
+                    lat.append(node_lat)
+                    lon.append(node_lon)
+            elif name == 'way':
+                way.extend((attrs['id'], [], []))
+
+    parser = expat.ParserCreate()
+    parser.StartElementHandler = start_element
+    with open(filename, 'rb') as file:
+        start = file.read(64)
+        file.seek(len(start) - len(start.lstrip()))
+        parser.ParseFile(file)
+    if way:
+        finish_way()
+    return (id, lat, lon, ways)
+
+# read_osm for .osm.pbf files, which needs pyosmium
+#
+# Parameters:
+# filename: path to the regional .osm.pbf file
+#   type-str
+# cells: grid cells to keep nodes from, see kept_cells
+#   type-set(tuple(int, int))
+#
+# Returns: same as read_osm
+#   type-tuple(list(int), list(float), list(float), list(tuple(str, list(int), list(tuple(str, str)))))
+
+
+def read_pbf(filename, cells):
+    try:
+        import osmium
+    except ImportError:
+        raise ImportError(
+            'Reading {} needs pyosmium (pip install osmium)'.format(filename))
+    id = []
+    lat = []
+    lon = []
+    ways = []
+
+    def node(node):
+        location = node.location
+        if (floor(location.lat / CELL), floor(location.lon / CELL)) in cells:
+            id.append(node.id)
+            lat.append(location.lat)
+            lon.append(location.lon)
+
+    def way(way):
+        tags = [(tag.k, tag.v) for tag in way.tags]
+        if is_ski_way(tags):
+            ways.append((str(way.id), [x.ref for x in way.nodes], tags))
+
+    handler = osmium.make_simple_handler(node=node, way=way)
+    handler.apply_file(filename)
+    return (id, lat, lon, ways)
+
+# Parameters:
+# filename: path of the osm file to write
+#   type-str
+# node_index: nodes of the file, see osmHelper.build_node_index
+#   type-tuple(array(int64), array(float64), array(float64))
+# ways: id, node ids and tags of each way of the file
+#   type-list(tuple(str, list(int), list(tuple(str, str))))
+#
+# Return: none
+
+
+def write_osm(filename, node_index, ways):
+    quote = {'"': '&quot;'}
+    with open(filename + '.tmp', 'w', encoding='utf-8') as file:
+        file.write('<?xml version="1.0" encoding="UTF-8"?>\n')
+        file.write('<osm version="0.6" generator="Ski-Trail-Ratings">\n')
+        for id, lat, lon in zip(*(x.tolist() for x in node_index)):
+            file.write(' <node id="{}" lat="{}" lon="{}"/>\n'.format(id, lat, lon))
+        for way_id, node_ids, tags in ways:
+            file.write(' <way id="{}">\n'.format(way_id))
+            for node_id in node_ids:
+                file.write('  <nd ref="{}"/>\n'.format(node_id))
+            for key, value in tags:
+                file.write('  <tag k="{}" v="{}"/>\n'.format(
+                    escape(key, quote), escape(value, quote)))
+            file.write(' </way>\n')
+        file.write('</osm>\n')
+    os.replace(filename + '.tmp', filename)
+
+# Parameters:
+# filename: path to the regional extract, .osm or .osm.pbf
+#   type-str
+# bounds_file: csv with the resorts' boundaries, see load_bounds
+#   type-str
+# output: folder to write <mountain>.osm of every resort with trails or lifts to
+#   type-str
+#
+# Returns: number of ways written per resort
+#   type-dict(str, int)
+
+
+def extract(filename, bounds_file='resort_bounds.csv', output='osm'):
+    bounds = load_bounds(bounds_file)
+    cells = kept_cells(bounds)
+    if filename.endswith('.pbf'):
+        id, lat, lon, ways = read_pbf(filename, cells)
+    else:
+        id, lat, lon, ways = read_osm(filename, cells)
+    node_id, node_lat, node_lon = osmHelper.build_node_index(id, lat, lon)
+
+    # the resort each kept node is in, the first one listed if several are
+    owner = np.full(len(node_id), -1, dtype=np.int64)
+    for i, bound in enumerate(bounds):
+        owner[(owner == -1) & inside(bound, node_lat, node_lon)] = i
+
+    resort_ways = [[] for _ in bounds]
+    for way in tqdm(ways, desc="Sorting Ways…", ascii=False, ncols=75):
+        node_ids = np.asarray(way[1], dtype=np.int64)
+        position = np.searchsorted(node_id, node_ids)
+        position[position == len(node_id)] = 0
+        position = position[node_id[position] == node_ids] if len(
+            node_id) else position[:0]
+        counts = np.bincount(owner[position] + 1, minlength=len(bounds) + 1)[1:]
+        if len(position) > 0 and counts.max() > 0:
+            resort_ways[counts.argmax()].append(way)
+
+    os.makedirs(output, exist_ok=True)
+    written = {}
+    for bound, selected in zip(bounds, resort_ways):
+        if len(selected) == 0:
+            print('{}: no trails or lifts found'.format(bound[0]))
+            continue
+        used = np.isin(node_id, np.concatenate(
+            [np.asarray(x[1], dtype=np.int64) for x in selected]))
+        write_osm('{}/{}.osm'.format(output, bound[0]),
+                  (node_id[used], node_lat[used], node_lon[used]), selected)
+        written[bound[0]] = len(selected)
+    return written
+
+# Parameters:
+# lat: latitudes
+#   type-array(float)
+# lon: longitudes
+#   type-array(float)
+#
+# Returns: latitudes and longitudes of the convex hull of the points, counter
+# clockwise
+#   type-tuple(array(float), array(float))
+
+
+def convex_hull(lat, lon):
+    points = np.unique(np.column_stack([lon, lat]), axis=0)
+    if len(points) < 3:
+        return (points[:, 1], points[:, 0])
+
+    # Andrew's monotone chain, the lower half then the upper half
+    def half(points):
+        chain = []
+        for point in points:
+            while len(chain) >= 2 and (chain[-1][0] - chain[-2][0]) * (point[1] - chain[-2][1]) - \
+                    (chain[-1][1] - chain[-2][1]) * (point[0] - chain[-2][0]) <= 0:
+                chain.pop()
+            chain.append(point)
+        return chain[:-1]
+
+    hull = np.array(half(points) + half(points[::-1]))
+    return (hull[:, 1], hull[:, 0])
+
+# Writes the box around the trails and lifts of every osm file, a starting point
+# for resort_bounds.csv. A resort's blacklist in the mountain list is applied
+# first, so its box doesn't take in the neighbour's trails its file also holds.
+# Neighbours whose boxes still overlap get the convex hull of their trails as a
+# polygon instead, and the pairs whose polygons overlap too are listed, since
+# the resort listed first gets the trails they share.
+#
+# Parameters:
+# filename: csv to write the boundaries to
+#   type-str
+# folder: directory with the osm files
+#   type-str
+# mountain_list: csv with the blacklist of each mountain
+#   type-str
+#
+# Returns: the pairs of resorts whose boundaries overlap
+#   type-list(tuple(str, str))
+
+
+def write_bounds(filename='resort_bounds.csv', folder='osm', mountain_list='mountain_list.csv'):
+    blacklists = {}
+    if exists(mountain_list):
+        df = pd.read_csv(mountain_list)
+        blacklists = dict(zip(df['mountain'], df['blacklist'].fillna('')))
+    bounds = []
+    for osm_file in tqdm(sorted(glob('{}/*.osm'.format(folder))), desc="Finding Bounds…", ascii=False, ncols=75):
+        mountain = osm_file.replace('\\', '/').split('/')[-1][:-4]
+        blacklist = blacklists.get(mountain, '')
+        ids = osmIds.get(blacklist) if blacklist != '' else None
+        if ids is None:
+            ids = frozenset()
+        (id, lat, lon), (way_nodes, _, _) = osmHelper.process_osm_file(
+            osm_file, ids, blacklist == mountain)
+        used = np.isin(id, way_nodes)
+        if not used.any():
+            continue
+        hull_lat, hull_lon = convex_hull(lat[used], lon[used])
+        # grown by about a meter about its middle, so the corners and edges,
+        # which are trail points themselves, count as inside
+        middle = (hull_lat.mean(), hull_lon.mean())
+        scale = 1 + 1e-5 / max(np.hypot(hull_lat - middle[0], hull_lon - middle[1]).min(), 1e-5)
+        bounds.append([mountain, lat[used].min(), lon[used].min(), lat[used].max(), lon[used].max(),
+                       (middle[0] + (hull_lat - middle[0]) * scale, middle[1] + (hull_lon - middle[1]) * scale)])
+
+    def overlap(first, second):
+        return first[1] <= second[3] and second[1] <= first[3] and first[2] <= second[4] and second[2] <= first[4]
+
+    pairs = [(first, second) for i, first in enumerate(bounds)
+             for second in bounds[i + 1:] if overlap(first, second)]
+    with_polygon = set(x[0] for pair in pairs for x in pair)
+    overlaps = []
+    for first, second in pairs:
+        # a corner of either hull inside the other
+        if inside(tuple(first), *second[5]).any() or inside(tuple(second), *first[5]).any():
+            overlaps.append((first[0], second[0]))
+    rows = []
+    for mountain, south, west, north, east, (lat, lon) in bounds:
+        polygon = ''
+        if mountain in with_polygon:
+            polygon = ', '.join('{} {}'.format(*x) for x in zip(lat.tolist(), lon.tolist()))
+        rows.append([mountain, south, west, north, east, polygon])
+    df = pd.DataFrame(
+        rows, columns=['mountain', 'south', 'west', 'north', 'east', 'polygon'])
+    df.to_csv(filename, index=False)
+    for first, second in overlaps:
+        print('{} and {} overlap, {} gets the trails in both'.format(
+            first, second, first))
+    return overlaps
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2:
+        print('regionExtract.py <regional.osm or .osm.pbf> <bounds_csv> <output_folder>')
+        print('regionExtract.py bounds <bounds_csv> <osm_folder>')
+        sys.exit(2)
+    if sys.argv[1] == 'bounds':
+        write_bounds(*sys.argv[2:4])
+    else:
+        for mountain, count in extract(*sys.argv[1:4]).items():
+            print('{}: {} ways'.format(mountain, count))
@@ -0,0 +1,174 @@
+import hashlib
+import json
+import os
+import sys
+from glob import glob
+from os.path import exists
+
+import numpy as np
+import pandas as pd
+from tqdm import tqdm
+
+import osmHelper
+
+# Parsing a resort's osm file is most of the time a warm run takes, so the
+# parsed trails and lifts are kept per resort in cached/packages/<mountain>/ as
+# one .npy file per array (memory mapped when loaded) plus meta.json, which
+# records what the package was built from: the osm file's mtime, size and hash
+# and the blacklist or whitelist that was applied. Only nodes used by a trail or
+# lift are kept. A package is rebuilt when the ids or the osm file's content
+# change, a new mtime alone only costs hashing the file once. Bump VERSION when
+# the parser's output changes so every package is rebuilt.
+VERSION = 1
+
+ARRAYS = ('node_id', 'node_lat', 'node_lon', 'way_nodes', 'way_offsets',
+          'name', 'way_id', 'difficulty_modifier', 'is_area', 'is_lift')
+
+# Parameters:
+# filename: path to a file
+#   type-str
+#
+# Returns: sha1 of the file's content
+#   type-str
+
+
+def file_hash(filename):
+    content = hashlib.sha1()
+    with open(filename, 'rb') as file:
+        for chunk in iter(lambda: file.read(1 << 20), b''):
+            content.update(chunk)
+    return content.hexdigest()
+
+# Parameters:
+# blacklist_ids: OSM ids from the blacklist file
+#   type-frozenset(int)
+# whitelist_mode: toggle between using a whitelist or a blacklist
+#   type-bool
+#
+# Returns: hash of the ids and how they are applied
+#   type-str
+
+
+def ids_hash(blacklist_ids, whitelist_mode):
+    content = hashlib.sha1()
+    content.update(repr(bool(whitelist_mode)).encode())
+    content.update('\n'.join(sorted(str(x) for x in blacklist_ids)).encode())
+    return content.hexdigest()
+
+# Parameters:
+# directory: package directory
+#   type-str
+# meta: contents of meta.json
+#   type-dict
+#
+# Return: none
+
+
+def save_meta(directory, meta):
+    with open(directory + '/meta.json.tmp', 'w') as file:
+        json.dump(meta, file)
+    os.replace(directory + '/meta.json.tmp', directory + '/meta.json')
+
+# Parameters:
+# directory: package directory
+#   type-str
+# node_index: output of osmHelper.build_node_index
+#   type-tuple(array(int64), array(float64), array(float64))
+# ways: output of osmHelper.assemble_ways
+#   type-tuple(array(int64), array(int64), df)
+# meta: what the package was built from
+#   type-dict
+#
+# Return: none
+
+
+def save(directory, node_index, ways, meta):
+    os.makedirs(directory, exist_ok=True)
+    # the package is incomplete until meta.json is written again
+    if exists(directory + '/meta.json'):
+        os.remove(directory + '/meta.json')
+    node_id, node_lat, node_lon = node_index
+    way_nodes, way_offsets, way_info = ways
+    used = np.isin(node_id, way_nodes)
+    arrays = {'node_id': node_id[used], 'node_lat': node_lat[used], 'node_lon': node_lon[used],
+              'way_nodes': way_nodes, 'way_offsets': way_offsets,
+              'name': np.array(way_info['name'].tolist(), dtype=str),
+              'way_id': way_info['way_id'].to_numpy(dtype=np.int64),
+              'difficulty_modifier': way_info['difficulty_modifier'].to_numpy(dtype=np.int64),
+              'is_area': way_info['is_area'].to_numpy(dtype=bool),
+              'is_lift': way_info['is_lift'].to_numpy(dtype=bool)}
+    for name in ARRAYS:
+        with open('{}/{}.npy.tmp'.format(directory, name), 'wb') as file:
+            np.save(file, arrays[name])
+        os.replace('{}/{}.npy.tmp'.format(directory, name),
+                   '{}/{}.npy'.format(directory, name))
+    save_meta(directory, meta)
+
+# Parameters:
+# directory: package directory
+#   type-str
+#
+# Returns: node index and the trails and lifts, like osmHelper.process_osm_file
+#   type-tuple(tuple(array, array, array), tuple(array, array, df))
+
+
+def read(directory):
+    arrays = {name: np.load('{}/{}.npy'.format(directory, name), mmap_mode='r')
+              for name in ARRAYS}
+    way_info = pd.DataFrame()
+    way_info['name'] = arrays['name'].tolist()
+    way_info['way_id'] = [str(x) for x in arrays['way_id'].tolist()]
+    way_info['difficulty_modifier'] = np.asarray(arrays['difficulty_modifier'])
+    way_info['is_area'] = np.asarray(arrays['is_area'])
+    way_info['is_lift'] = np.asarray(arrays['is_lift'])
+    return ((arrays['node_id'], arrays['node_lat'], arrays['node_lon']), (arrays['way_nodes'], arrays['way_offsets'], way_info))
+
+# Parameters:
+# mountain: name of ski area
+#   type-str
+# blacklist_ids: OSM ids from the blacklist file
+#   type-frozenset(int)
+# whitelist_mode: toggle between using a whitelist or a blacklist
+#   type-bool
+#
+# Returns: node index and the trails and lifts of osm/<mountain>.osm, from its
+# package when that is current and otherwise parsed and saved as the package
+#   type-tuple(tuple(array, array, array), tuple(array, array, df))
+
+
+def load(mountain, blacklist_ids, whitelist_mode=False):
+    source = 'osm/{}.osm'.format(mountain)
+    directory = 'cached/packages/{}'.format(mountain)
+    stat = os.stat(source)
+    ids = ids_hash(blacklist_ids, whitelist_mode)
+    meta = None
+    if exists(directory + '/meta.json'):
+        with open(directory + '/meta.json', 'r') as file:
+            meta = json.load(file)
+        if meta.get('version') != VERSION or meta.get('ids') != ids:
+            meta = None
+    if meta is not None and meta['mtime'] == stat.st_mtime_ns and meta['size'] == stat.st_size:
+        return read(directory)
+    digest = file_hash(source)
+    if meta is not None and meta['hash'] == digest:
+        # touched but not changed
+        meta['mtime'] = stat.st_mtime_ns
+        meta['size'] = stat.st_size
+        save_meta(directory, meta)
+        return read(directory)
+    node_index, ways = osmHelper.process_osm_file(
+        source, blacklist_ids, whitelist_mode)
+    save(directory, node_index, ways, {'version': VERSION, 'mtime': stat.st_mtime_ns,
+                                       'size': stat.st_size, 'hash': digest, 'ids': ids})
+    return (node_index, ways)
+
+
+# builds or refreshes the packages of the given mountains, or of every osm file
+if __name__ == "__main__":
+    import loadData
+    mountain_df = pd.read_csv('mountain_list.csv')
+    mountains = sys.argv[1:] or [x.split('/')[-1][:-4]
+                                 for x in sorted(glob('osm/*.osm'))]
+    for mountain in tqdm(mountains, desc="Building Packages…", ascii=False, ncols=75):
+        _, blacklist, _ = loadData.mountain_settings(mountain_df, mountain)
+        load(mountain, *loadData.read_blacklist(mountain, blacklist))
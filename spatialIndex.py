@@ -0,0 +1,258 @@
+import numpy as np
+
+import trailMetrics
+
+# meters per degree of latitude
+METERS_PER_DEGREE = trailMetrics.EARTH_RADIUS * np.pi / 180
+
+# keeps cell numbers positive when two of them are packed into one int64
+CELL_OFFSET = 2 ** 30
+
+# Uniform grid over the segments of many trails. Every segment is filed under
+# each grid cell its bounding box touches, and the cells are kept as a sorted
+# array of keys with the segments of each cell stored end to end (like
+# osmHelper's ways), so finding a cell is a binary search. Cells are at least
+# cell_size meters across everywhere in the data, so a query only has to look
+# at the few cells around it, however many trails are indexed. Distances are
+# measured on a flat projection centered on each query point, which is exact
+# to well under a meter over the distances a query covers.
+
+
+class TrailIndex:
+
+    # Parameters:
+    # lat: latitudes of every trail, see trailMetrics.to_ragged
+    #   type-array(float)
+    # lon: longitudes of every trail, in the same order
+    #   type-array(float)
+    # offsets: start of each trail in lat and lon, plus the total length
+    #   type-array(int64)
+    # cell_size: smallest width of a grid cell (meters)
+    #   type-float
+
+    def __init__(self, lat, lon, offsets, cell_size=50.0):
+        lat = np.asarray(lat, dtype=np.float64)
+        lon = np.asarray(lon, dtype=np.float64)
+        offsets = np.asarray(offsets, dtype=np.int64)
+        self.cell_size = cell_size
+        self.trail_count = len(offsets) - 1
+
+        # segment i runs from point start[i] to start[i] + 1 of one trail
+        trail = np.repeat(np.arange(self.trail_count),
+                          np.diff(offsets)).astype(np.int64)
+        start = np.flatnonzero(trail[:-1] == trail[1:]) if len(
+            trail) > 1 else np.zeros(0, dtype=np.int64)
+        self.lat = lat
+        self.lon = lon
+        self.offsets = offsets
+        self.segment_start = start
+        self.segment_trail = trail[start]
+
+        # longitude cells are sized for the latitude where degrees are shortest
+        max_lat = np.abs(lat).max() if len(lat) else 0
+        self.cell_lat = cell_size / METERS_PER_DEGREE
+        self.cell_lon = cell_size / \
+            (METERS_PER_DEGREE * max(np.cos(np.radians(max_lat)), 1e-6))
+
+        x0, y0 = self.cell(lat[start], lon[start])
+        x1, y1 = self.cell(lat[start + 1], lon[start + 1])
+        min_x = np.minimum(x0, x1)
+        min_y = np.minimum(y0, y1)
+        width = np.abs(x1 - x0) + 1
+        height = np.abs(y1 - y0) + 1
+        count = width * height
+        segment = np.repeat(np.arange(len(start)), count)
+        position = np.arange(count.sum()) - \
+            np.repeat(np.cumsum(count) - count, count)
+        x = min_x[segment] + position % width[segment]
+        y = min_y[segment] + position // width[segment]
+        keys = self.key(x, y)
+        order = np.argsort(keys, kind='stable')
+        self.cell_keys, first = np.unique(keys[order], return_index=True)
+        self.cell_offsets = np.append(first, len(keys)).astype(np.int64)
+        self.cell_segments = segment[order]
+
+    # Parameters:
+    # lat: latitudes
+    #   type-array(float)
+    # lon: longitudes
+    #   type-array(float)
+    #
+    # Returns: grid column and row of each point
+    #   type-tuple(array(int64), array(int64))
+
+    def cell(self, lat, lon):
+        return (np.floor(np.asarray(lon) / self.cell_lon).astype(np.int64),
+                np.floor(np.asarray(lat) / self.cell_lat).astype(np.int64))
+
+    # Returns: the cells' keys in cell_keys
+    #   type-array(int64)
+
+    def key(self, x, y):
+        return (y + CELL_OFFSET) * (2 ** 32) + (x + CELL_OFFSET)
+
+    # Parameters:
+    # x, y: grid column and row of each query
+    #   type-array(int64)
+    # reach: number of cells to look at on every side of the query's cell
+    #   type-int
+    #
+    # Returns: query number and segment of every segment filed near a query
+    # (a segment can come up more than once)
+    #   type-tuple(array(int64), array(int64))
+
+    def candidates(self, x, y, reach):
+        queries = []
+        segments = []
+        if len(self.cell_keys) == 0:
+            return (np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64))
+        for dx in range(-reach, reach + 1):
+            for dy in range(-reach, reach + 1):
+                keys = self.key(x + dx, y + dy)
+                position = np.minimum(np.searchsorted(
+                    self.cell_keys, keys), len(self.cell_keys) - 1)
+                found = np.flatnonzero(self.cell_keys[position] == keys)
+                first = self.cell_offsets[position[found]]
+                count = self.cell_offsets[position[found] + 1] - first
+                queries.append(np.repeat(found, count))
+                segments.append(self.cell_segments[np.repeat(first, count) + np.arange(
+                    count.sum()) - np.repeat(np.cumsum(count) - count, count)])
+        return (np.concatenate(queries), np.concatenate(segments))
+
+    # Parameters:
+    # lat, lon: query point of each pair
+    #   type-array(float)
+    # segment: segment of each pair
+    #   type-array(int64)
+    #
+    # Returns: distance from each point to its segment (meters) and how far
+    # along the segment the closest spot is (0-1)
+    #   type-tuple(array(float), array(float))
+
+    def segment_distance(self, lat, lon, segment):
+        start = self.segment_start[segment]
+        scale = METERS_PER_DEGREE * np.cos(np.radians(lat))
+        ax = (self.lon[start] - lon) * scale
+        ay = (self.lat[start] - lat) * METERS_PER_DEGREE
+        dx = (self.lon[start + 1] - lon) * scale - ax
+        dy = (self.lat[start + 1] - lat) * METERS_PER_DEGREE - ay
+        length = dx * dx + dy * dy
+        with np.errstate(divide='ignore', invalid='ignore'):
+            fraction = np.clip(-(ax * dx + ay * dy) / length, 0, 1)
+        fraction[length == 0] = 0
+        return (np.hypot(ax + fraction * dx, ay + fraction * dy), fraction)
+
+    # Parameters:
+    # lat: latitudes of the query points
+    #   type-array(float)
+    # lon: longitudes of the query points
+    #   type-array(float)
+    # max_distance: ignore trails farther than this (meters), None for no limit
+    #   type-float
+    #
+    # Returns: nearest trail, distance to it (meters), nearest segment (as
+    # the trail point it starts at) and how far along that segment, for each
+    # query point. Trail and segment are -1 if nothing is in range.
+    #   type-tuple(array(int64), array(float), array(int64), array(float))
+
+    def nearest(self, lat, lon, max_distance=None):
+        lat = np.atleast_1d(np.asarray(lat, dtype=np.float64))
+        lon = np.atleast_1d(np.asarray(lon, dtype=np.float64))
+        best_segment = np.full(len(lat), -1, dtype=np.int64)
+        best_distance = np.full(len(lat), np.inf)
+        best_fraction = np.zeros(len(lat))
+        x, y = self.cell(lat, lon)
+        todo = np.arange(len(lat))
+        reach = 1 if max_distance is None else int(
+            np.ceil(max_distance / self.cell_size))
+        while len(todo) > 0 and len(self.cell_keys) > 0:
+            if max_distance is None and (2 * reach + 1) ** 2 >= len(self.cell_keys):
+                # far from everything, looking cell by cell costs more than
+                # checking every segment
+                for i in todo:
+                    distance, fraction = self.segment_distance(np.full(len(self.segment_start), lat[i]), np.full(
+                        len(self.segment_start), lon[i]), np.arange(len(self.segment_start)))
+                    best_segment[i] = distance.argmin()
+                    best_distance[i] = distance[best_segment[i]]
+                    best_fraction[i] = fraction[best_segment[i]]
+                break
+            query, segment = self.candidates(x[todo], y[todo], reach)
+            distance, fraction = self.segment_distance(
+                lat[todo][query], lon[todo][query], segment)
+            order = np.lexsort((segment, distance, query))
+            query, first = np.unique(query[order], return_index=True)
+            pick = order[first]
+            best_segment[todo[query]] = segment[pick]
+            best_distance[todo[query]] = distance[pick]
+            best_fraction[todo[query]] = fraction[pick]
+            if max_distance is not None:
+                break
+            # a result is only certain when nothing outside the searched cells
+            # could be closer, otherwise search wider
+            sure = best_distance[todo] <= reach * self.cell_size
+            todo = todo[~sure]
+            reach *= 2
+        if max_distance is not None:
+            best_segment[best_distance > max_distance] = -1
+        found = best_segment >= 0
+        trail = np.full(len(lat), -1, dtype=np.int64)
+        point = np.full(len(lat), -1, dtype=np.int64)
+        trail[found] = self.segment_trail[best_segment[found]]
+        point[found] = self.segment_start[best_segment[found]] - \
+            self.offsets[trail[found]]
+        best_distance[~found] = np.inf
+        return (trail, best_distance, point, best_fraction)
+
+    # Parameters:
+    # lat: latitude of the query point
+    #   type-float
+    # lon: longitude of the query point
+    #   type-float
+    # radius: search radius (meters)
+    #   type-float
+    #
+    # Returns: trails with a segment within radius of the point
+    #   type-array(int64)
+
+    def within(self, lat, lon, radius):
+        x, y = self.cell([lat], [lon])
+        _, segment = self.candidates(
+            x, y, int(np.ceil(radius / self.cell_size)))
+        distance, _ = self.segment_distance(
+            np.full(len(segment), float(lat)), np.full(len(segment), float(lon)), segment)
+        return np.unique(self.segment_trail[segment[distance <= radius]])
+
+    # Parameters:
+    # south, west, north, east: edges of the box (degrees)
+    #   type-float
+    #
+    # Returns: trails with a segment crossing the box
+    #   type-array(int64)
+
+    def bbox(self, south, west, north, east):
+        x0, y0 = self.cell([south], [west])
+        x1, y1 = self.cell([north], [east])
+        x, y = np.meshgrid(np.arange(x0[0], x1[0] + 1),
+                           np.arange(y0[0], y1[0] + 1))
+        keys = self.key(x.ravel(), y.ravel())
+        position = np.minimum(np.searchsorted(
+            self.cell_keys, keys), max(len(self.cell_keys) - 1, 0))
+        found = position[self.cell_keys[position] == keys] if len(
+            self.cell_keys) else position[:0]
+        segment = np.unique(np.concatenate(
+            [self.cell_segments[self.cell_offsets[i]:self.cell_offsets[i + 1]] for i in found] + [np.zeros(0, dtype=np.int64)]))
+        # clip each segment to the box (Liang-Barsky)
+        start = self.segment_start[segment]
+        lat0 = self.lat[start]
+        lon0 = self.lon[start]
+        d_lat = self.lat[start + 1] - lat0
+        d_lon = self.lon[start + 1] - lon0
+        t_min = np.zeros(len(segment))
+        t_max = np.ones(len(segment))
+        for p, q in ((-d_lon, lon0 - west), (d_lon, east - lon0), (-d_lat, lat0 - south), (d_lat, north - lat0)):
+            with np.errstate(divide='ignore', invalid='ignore'):
+                t = q / p
+            t_min = np.where(p < 0, np.maximum(t_min, t), t_min)
+            t_max = np.where(p > 0, np.minimum(t_max, t), t_max)
+            t_max = np.where((p == 0) & (q < 0), -1, t_max)
+        return np.unique(self.segment_trail[segment[t_min <= t_max]])
@@ -0,0 +1,219 @@
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+# Times the stages of a resort run and counts what they did, so a slow run can
+# be traced to parsing, densifying, elevation lookups (and the time spent
+# waiting on the API's rate limit), rating, drawing or saving. A run is opened
+# with start, stages nest (a stage inside "render" is recorded as
+# "render/labels"), and finish writes the record to cached/stats/<mountain>.json.
+# Outside of a run stage and count do nothing. Bulk runs collect the records of
+# every resort into one report with write_report.
+
+STATS_FOLDER = 'cached/stats'
+
+# the run being timed in this process, see start
+current = None
+# record of the last run finished in this process
+last = None
+# names of the stages currently open
+stack = []
+# counts may come from the elevation API's threads
+lock = threading.Lock()
+# 'cprofile' or 'pyinstrument' to profile every run as well, see set_profiler
+profiler_name = None
+profiler = None
+
+# Parameters:
+# name: 'cprofile', 'pyinstrument' or None for no profiling
+#   type-str
+#
+# Return: none
+
+
+def set_profiler(name):
+    global profiler_name
+    if name not in (None, 'cprofile', 'pyinstrument'):
+        raise ValueError(
+            'Unknown profiler {}, use cprofile or pyinstrument'.format(name))
+    if name == 'pyinstrument':
+        try:
+            import pyinstrument
+        except ImportError:
+            raise ImportError(
+                'Profiling with pyinstrument needs it installed (pip install pyinstrument)')
+    profiler_name = name
+
+# Opens the record of a resort run, and starts the profiler if one is set.
+#
+# Parameters:
+# mountain: name of ski area
+#   type-str
+#
+# Return: none
+
+
+def start(mountain):
+    global current, profiler
+    current = {'mountain': mountain, 'started': time.time(), 'ok': False,
+               'total': 0.0, 'stages': {}, 'counts': {}}
+    stack.clear()
+    current['clock'] = time.perf_counter()
+    if profiler_name == 'cprofile':
+        import cProfile
+        profiler = cProfile.Profile()
+        profiler.enable()
+    elif profiler_name == 'pyinstrument':
+        import pyinstrument
+        profiler = pyinstrument.Profiler()
+        profiler.start()
+
+# Closes the record of the run, writes it and the profile if there is one to
+# cached/stats.
+#
+# Parameters:
+# ok: whether the run finished
+#   type-bool
+#
+# Returns: the run's record, None if no run was open
+#   type-dict
+
+
+def finish(ok=True):
+    global current, last, profiler
+    if current is None:
+        return None
+    record = current
+    current = None
+    record['total'] = round(time.perf_counter() - record.pop('clock'), 4)
+    record['ok'] = ok
+    os.makedirs(STATS_FOLDER, exist_ok=True)
+    path = '{}/{}'.format(STATS_FOLDER, record['mountain'])
+    if profiler is not None:
+        if profiler_name == 'cprofile':
+            profiler.disable()
+            profiler.dump_stats(path + '.prof')
+            record['profile'] = path + '.prof'
+        else:
+            profiler.stop()
+            with open(path + '.html', 'w') as file:
+                file.write(profiler.output_html())
+            record['profile'] = path + '.html'
+        profiler = None
+    save_json(path + '.json', record)
+    last = record
+    return record
+
+# Times the code inside it as a stage of the current run. Time spent in a stage
+# again is added to it.
+#
+# Parameters:
+# name: name of the stage
+#   type-str
+
+
+@contextmanager
+def stage(name):
+    if current is None:
+        yield
+        return
+    stack.append(name)
+    key = '/'.join(stack)
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - started
+        stack.pop()
+        if current is not None:
+            stages = current['stages']
+            stages[key] = round(stages.get(key, 0.0) + elapsed, 4)
+
+# Adds to a counter of the current run.
+#
+# Parameters:
+# name: name of the counter
+#   type-str
+# amount: amount to add
+#   type-int/float
+#
+# Return: none
+
+
+def count(name, amount=1):
+    if current is None:
+        return
+    with lock:
+        counts = current['counts']
+        counts[name] = counts.get(name, 0) + amount
+
+# Parameters:
+# filename: path of the json file
+#   type-str
+# content: what to write
+#   type-dict
+#
+# Return: none
+
+
+def save_json(filename, content):
+    with open(filename + '.tmp', 'w') as file:
+        json.dump(content, file, indent=1, default=float)
+    os.replace(filename + '.tmp', filename)
+
+# Sums the records of a bulk run into one report, written next to the per
+# resort records, and prints the stages that took longest. The totals of the
+# previous report are kept in the new one, so a stage that got slower stands
+# out.
+#
+# Parameters:
+# records: records from finish
+#   type-list(dict)
+# filename: path of the report
+#   type-str
+#
+# Returns: the report
+#   type-dict
+
+
+def write_report(records, filename=STATS_FOLDER + '/bulk_report.json'):
+    stages = {}
+    counts = {}
+    for record in records:
+        for name, elapsed in record['stages'].items():
+            total = stages.setdefault(name, {'total': 0.0, 'max': 0.0, 'slowest': ''})
+            total['total'] = round(total['total'] + elapsed, 4)
+            if elapsed > total['max']:
+                total['max'] = elapsed
+                total['slowest'] = record['mountain']
+        for name, amount in record['counts'].items():
+            counts[name] = counts.get(name, 0) + amount
+    previous = {}
+    if os.path.exists(filename):
+        with open(filename, 'r') as file:
+            previous = json.load(file).get('stages', {})
+    for name, total in stages.items():
+        if name in previous:
+            total['previous'] = previous[name]['total']
+    report = {'mountains': len(records),
+              'failed': [x['mountain'] for x in records if not x['ok']],
+              'total': round(sum(x['total'] for x in records), 4),
+              'stages': stages, 'counts': counts,
+              'slowest': [[x['mountain'], x['total']] for x in sorted(records, key=lambda x: -x['total'])[:10]],
+              'records': records}
+    os.makedirs(os.path.dirname(filename) or '.', exist_ok=True)
+    save_json(filename, report)
+
+    print('\n{} mountains in {:.1f}s of work'.format(
+        report['mountains'], report['total']))
+    top = sorted(stages.items(), key=lambda x: -x[1]['total'])[:10]
+    for name, total in top:
+        change = ''
+        if total.get('previous'):
+            change = ' ({:+.0%})'.format(total['total'] / total['previous'] - 1)
+        print('{:<32}{:>9.2f}s{}  slowest: {}'.format(
+            name, total['total'], change, total['slowest']))
+    print('Report saved to {}'.format(filename))
+    return report
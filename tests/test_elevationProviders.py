@@ -0,0 +1,188 @@
+import http.server
+import json
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from urllib.parse import parse_qs, urlparse
+
+import numpy as np
+import pytest
+
+import elevationProviders
+
+# 3 x 4 samples over 0.2 degrees of latitude and 0.3 of longitude, row 0 on
+# the north edge. The elevation rises 10 m per row south and 1 m per column
+# east, so bilinear interpolation reproduces the plane exactly.
+BOUNDS = (-111.3, 40.5, -111.0, 40.7)
+NODATA = -9999.0
+
+
+def plane(lat, lon):
+    west, south, east, north = BOUNDS
+    return 1000 + 10 * (north - lat) / 0.1 + (lon - west) / 0.1
+
+
+@pytest.fixture
+def dem(tmp_path):
+    grid = np.array([[1000 + 10 * row + col for col in range(4)]
+                    for row in range(3)], dtype=np.float64)
+    grid[2, 3] = NODATA
+    elevationProviders.save_tile(str(tmp_path), 'tile', grid, BOUNDS, NODATA)
+    return elevationProviders.RasterProvider(str(tmp_path))
+
+
+def test_bilinear_values(dem):
+    lat = np.array([40.7, 40.65, 40.6, 40.63])
+    lon = np.array([-111.3, -111.25, -111.1, -111.22])
+    assert np.allclose(dem.get_elevation(lat, lon), plane(lat, lon))
+
+
+def test_north_and_east_edges(dem):
+    lat = np.array([40.7, 40.6])
+    lon = np.array([-111.0, -111.0])
+    assert np.allclose(dem.get_elevation(lat, lon), plane(lat, lon))
+
+
+def test_sample_grid_nodata_and_outside(dem):
+    grid, bounds, nodata = dem.tiles[0]
+    lat = np.array([40.55, 40.52, 40.8, 40.6])
+    lon = np.array([-111.05, -111.25, -111.2, -110.9])
+    elevation = elevationProviders.sample_grid(grid, bounds, lat, lon, nodata)
+    # next to the nodata corner, then a cell away from it, then outside
+    assert np.isnan(elevation[0])
+    assert elevation[1] == pytest.approx(plane(40.52, -111.25))
+    assert np.isnan(elevation[2:]).all()
+
+
+def test_missing_data_raises(dem):
+    with pytest.raises(elevationProviders.ElevationError):
+        dem.get_elevation(np.array([40.65, 40.8]), np.array([-111.2, -111.2]))
+    with pytest.raises(elevationProviders.ElevationError):
+        dem.get_elevation(np.array([40.55]), np.array([-111.05]))
+
+
+@pytest.mark.parametrize('shape', [(1, 4), (3, 1)])
+def test_degenerate_tile_rejected(tmp_path, shape):
+    elevationProviders.save_tile(str(tmp_path), 'tile', np.zeros(shape), BOUNDS)
+    with pytest.raises(ValueError):
+        elevationProviders.RasterProvider(str(tmp_path))
+
+
+def test_empty_bounds_rejected(tmp_path):
+    elevationProviders.save_tile(
+        str(tmp_path), 'tile', np.zeros((3, 3)), (-111.0, 40.5, -111.0, 40.7))
+    with pytest.raises(ValueError):
+        elevationProviders.RasterProvider(str(tmp_path))
+
+
+# A stand-in for the elevation API that answers with the scripted responses in
+# order, then with the last one, and counts the requests it got.
+class StandIn(http.server.BaseHTTPRequestHandler):
+    responses = []
+    requests = 0
+
+    def do_GET(self):
+        StandIn.requests += 1
+        status, headers, body = StandIn.responses[min(
+            StandIn.requests, len(StandIn.responses)) - 1]
+        if body is None:
+            points = parse_qs(urlparse(self.path).query)[
+                'locations'][0].split('|')
+            body = json.dumps({'results': [{'elevation': 100.0 + i} for i in range(len(points))]})
+        self.send_response(status)
+        for key, value in headers.items():
+            self.send_header(key, value)
+        self.end_headers()
+        self.wfile.write(body.encode())
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def api():
+    StandIn.responses = []
+    StandIn.requests = 0
+    server = http.server.ThreadingHTTPServer(('127.0.0.1', 0), StandIn)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield 'http://127.0.0.1:{}/v1/test'.format(server.server_port)
+    server.shutdown()
+    server.server_close()
+
+
+def provider(url, **options):
+    settings = {'batch_size': 2, 'rate': 1000, 'workers': 1,
+                'retries': 3, 'backoff': 0.01}
+    settings.update(options)
+    return elevationProviders.ApiProvider(url, **settings)
+
+
+def test_api_batches(api):
+    StandIn.responses = [(200, {}, None)]
+    elevation = provider(api).get_elevation(
+        np.array([40.1, 40.2, 40.3]), np.array([-111.1, -111.2, -111.3]))
+    assert elevation.tolist() == [100.0, 101.0, 100.0]
+    assert StandIn.requests == 2
+
+
+def test_api_no_data(api):
+    StandIn.responses = [(200, {}, json.dumps(
+        {'results': [{'elevation': None}, {'elevation': 5}]}))]
+    elevation = provider(api).get_elevation(
+        np.array([40.1, 40.2]), np.array([-111.1, -111.2]))
+    assert np.isnan(elevation[0]) and elevation[1] == 5
+
+
+@pytest.mark.parametrize('status', [429, 503])
+def test_api_retry_after(api, status):
+    StandIn.responses = [(status, {'Retry-After': '1'}, 'busy'), (200, {}, None)]
+    client = provider(api)
+    started = time.monotonic()
+    elevation = client.get_elevation(np.array([40.1]), np.array([-111.1]))
+    assert elevation.tolist() == [100.0]
+    assert StandIn.requests == 2 and client.requests == 2
+    # Retry-After wins over the 0.01s backoff
+    assert time.monotonic() - started >= 1
+
+
+def test_api_gives_up(api):
+    StandIn.responses = [(503, {}, 'down')]
+    client = provider(api)
+    with pytest.raises(elevationProviders.ElevationError, match='503'):
+        client.get_elevation(np.array([40.1]), np.array([-111.1]))
+    assert StandIn.requests == 4 and client.requests == 4
+
+
+def test_api_client_error_not_retried(api):
+    StandIn.responses = [(400, {}, 'bad request')]
+    with pytest.raises(elevationProviders.ElevationError, match='400'):
+        provider(api).get_elevation(np.array([40.1]), np.array([-111.1]))
+    assert StandIn.requests == 1
+
+
+@pytest.mark.parametrize('body', ['<html>gateway</html>', '{"error": "busy"}',
+                                  '{"results": [{"elevation": 1}, {"elevation": 2}]}'])
+def test_api_unreadable_response(api, body):
+    StandIn.responses = [(200, {}, body)]
+    with pytest.raises(elevationProviders.ElevationError, match='unreadable|results for'):
+        provider(api).get_elevation(np.array([40.1]), np.array([-111.1]))
+    assert StandIn.requests == 4
+
+
+def fetch_batches(client, count):
+    for _ in range(count):
+        client.fetch('40.1,-111.1')
+
+
+def test_shared_rate_limit(api):
+    StandIn.responses = [(200, {}, None)]
+    with elevationProviders.shared_rate_limit(provider(api, rate=20)) as shared:
+        started = time.monotonic()
+        with ProcessPoolExecutor(2) as pool:
+            list(pool.map(fetch_batches, [shared, shared], [10, 10]))
+        elapsed = time.monotonic() - started
+    # 20 requests at 20 per second between both processes, each process with
+    # a bucket of its own would be done in half the time
+    assert StandIn.requests == 20
+    assert elapsed >= 0.9
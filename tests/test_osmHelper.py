@@ -0,0 +1,90 @@
+import pytest
+
+import benchmark
+import osmHelper
+from osmHelper import AREA, BACKCOUNTRY, GLADE, LIFT, NOT_GLADED, TRAIL
+
+NODES = [1, 2, 3]
+
+
+@pytest.mark.parametrize('tags,properties', [
+    ([('piste:type', 'downhill'), ('piste:difficulty', 'easy')], TRAIL),
+    ([('piste:type', 'downhill;nordic')], TRAIL | BACKCOUNTRY),
+    ([('piste:type', 'nordic; downhill')], TRAIL | BACKCOUNTRY),
+    ([('piste:type', 'downhill'), ('landuse', 'grass')], TRAIL | BACKCOUNTRY),
+    ([('aerialway', 'chair_lift')], LIFT),
+    ([('aerialway', 'zip_line')], 0),
+    ([('aerialway', 'station')], 0),
+    ([('aerialway', 'station;chair_lift')], LIFT),
+    ([('piste:type', 'downhill'), ('gladed', 'yes')], TRAIL | GLADE),
+    ([('piste:type', 'downhill'), ('gladed', 'yes'), ('gladed', 'no')],
+     TRAIL | GLADE | NOT_GLADED),
+    ([('piste:type', 'downhill'), ('piste:grooming', 'glade')], TRAIL | GLADE),
+    ([('piste:type', 'downhill'), ('leaf_type', 'needleleaved')],
+     TRAIL | GLADE | AREA),
+    ([('piste:type', 'downhill'), ('natural', 'wood'), ('area', 'yes')],
+     TRAIL | AREA),
+    ([('highway', 'path'), ('name', 'Glade Trail')], GLADE),
+])
+def test_classify_way(tags, properties):
+    assert osmHelper.classify_way(tags)[0] == properties
+
+
+@pytest.mark.parametrize('name,glade', [
+    ('Glade', True), ('Upper Glades', True), ('Gladed Run', True),
+    ('East Tree Skiing', True), ('tree skiing area', True),
+    ('Everglade', False), ('Gladeview', False), ('Treetop', False),
+])
+def test_glade_names(name, glade):
+    for key in osmHelper.NAME_KEYS:
+        tags = [('piste:type', 'downhill'), (key, name)]
+        assert bool(osmHelper.classify_way(tags)[0] & GLADE) == glade
+
+
+def test_name():
+    tags = [('piste:name', 'Other'), ('name', 'Main Street'),
+            ('piste:type', 'downhill')]
+    assert osmHelper.classify_way(tags)[1] == 'Main Street'
+    assert osmHelper.classify_way([('piste:type', 'downhill')])[1] == ''
+
+
+def test_read_way_gladed_no_overrides():
+    for tags in ([('gladed', 'yes'), ('gladed', 'no')],
+                 [('gladed', 'no'), ('leaf_type', 'mixed')],
+                 [('gladed', 'no'), ('name', 'The Glades')]):
+        record = osmHelper.read_way('9', NODES, [('piste:type', 'downhill')] + tags)
+        assert record[3] == 0
+    record = osmHelper.read_way('9', NODES, [('piste:type', 'downhill'), ('gladed', 'yes'), ('name', 'Glades')])
+    assert record[3] == 1
+
+
+def test_read_way_skips():
+    assert osmHelper.read_way('9', NODES, [('highway', 'path')]) is None
+    assert osmHelper.read_way('9', NODES, [('aerialway', 'zip_line')]) is None
+    assert osmHelper.read_way(
+        '9', NODES, [('piste:type', 'downhill;skitour')]) is None
+    # a lift is kept even when the way is also backcountry
+    record = osmHelper.read_way(
+        '9', NODES, [('aerialway', 'platter'), ('piste:type', 'nordic')])
+    assert record == ('9', '', NODES, 0, False, True, False, True)
+
+
+# combinations where the rule table and the substring checks it replaced
+# agree, see benchmark.read_way_loop
+@pytest.mark.parametrize('tags', [
+    [('piste:type', 'downhill'), ('piste:difficulty', 'advanced'), ('name', 'Big Dipper')],
+    [('piste:type', 'downhill;nordic')],
+    [('piste:type', 'downhill'), ('natural', 'grassland')],
+    [('piste:difficulty', 'expert'), ('gladed', 'yes'), ('leaf_type', 'mixed')],
+    [('piste:type', 'downhill'), ('gladed', 'yes'), ('gladed', 'no')],
+    [('piste:type', 'downhill'), ('name', 'Tree Skiing'), ('gladed', 'no')],
+    [('piste:type', 'downhill'), ('piste:grooming', 'glade')],
+    [('piste:type', 'downhill'), ('area', 'yes'), ('natural', 'wood')],
+    [('aerialway', 'gondola'), ('name', 'Glade Express')],
+    [('aerialway', 'zip_line'), ('piste:type', 'downhill')],
+    [('aerialway', 'station')],
+    [('aerialway', 'chair_lift'), ('piste:type', 'downhill')],
+    [('highway', 'track'), ('name', 'A & B "Run"')],
+])
+def test_read_way_matches_old_checks(tags):
+    assert osmHelper.read_way('9', NODES, tags) == benchmark.read_way_loop('9', NODES, tags)
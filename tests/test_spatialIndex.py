@@ -0,0 +1,122 @@
+import numpy as np
+import pytest
+
+import spatialIndex
+
+METERS = spatialIndex.METERS_PER_DEGREE
+
+
+# 60 random walks of 5 to 40 points with 20 to 120 meter steps, around a
+# resort sized area at 45 degrees north
+@pytest.fixture(scope='module')
+def trails():
+    rng = np.random.default_rng(7)
+    lat = []
+    lon = []
+    offsets = [0]
+    for _ in range(60):
+        count = rng.integers(5, 40)
+        step = rng.uniform(20, 120, count)
+        heading = np.cumsum(rng.normal(0, 0.5, count)) + rng.uniform(0, 6.3)
+        start = (45 + rng.uniform(0, 0.03), -110 + rng.uniform(0, 0.04))
+        lat.append(start[0] + np.cumsum(step * np.cos(heading)) / METERS)
+        lon.append(start[1] + np.cumsum(step * np.sin(heading)) /
+                   (METERS * np.cos(np.radians(45))))
+        offsets.append(offsets[-1] + count)
+    lat = np.concatenate(lat)
+    lon = np.concatenate(lon)
+    return (lat, lon, np.array(offsets), spatialIndex.TrailIndex(lat, lon, offsets))
+
+
+# distance from a point to every segment of every trail, on a flat projection
+# at the point, and the trail of each segment
+def brute_force(trails, lat, lon):
+    trail_lat, trail_lon, offsets, _ = trails
+    distances = []
+    owners = []
+    for trail in range(len(offsets) - 1):
+        y = (trail_lat[offsets[trail]:offsets[trail + 1]] - lat) * METERS
+        x = (trail_lon[offsets[trail]:offsets[trail + 1]] - lon) * \
+            METERS * np.cos(np.radians(lat))
+        for i in range(len(x) - 1):
+            dx = x[i + 1] - x[i]
+            dy = y[i + 1] - y[i]
+            length = dx * dx + dy * dy
+            t = 0 if length == 0 else min(max(-(x[i] * dx + y[i] * dy) / length, 0), 1)
+            distances.append(np.hypot(x[i] + t * dx, y[i] + t * dy))
+            owners.append(trail)
+    return (np.array(distances), np.array(owners))
+
+
+def queries(trails, count=200):
+    trail_lat, trail_lon, _, _ = trails
+    rng = np.random.default_rng(11)
+    near = rng.integers(0, len(trail_lat), count)
+    # some right on the trails, some up to a few hundred meters away
+    lat = trail_lat[near] + rng.normal(0, 1, count) * rng.choice([0, 2e-4, 2e-3], count)
+    lon = trail_lon[near] + rng.normal(0, 1, count) * rng.choice([0, 2e-4, 2e-3], count)
+    return (lat, lon)
+
+
+def test_nearest_matches_brute_force(trails):
+    index = trails[3]
+    lat, lon = queries(trails)
+    trail, distance, point, fraction = index.nearest(lat, lon)
+    for i in range(len(lat)):
+        distances, owners = brute_force(trails, lat[i], lon[i])
+        assert distance[i] == pytest.approx(distances.min(), abs=1e-6)
+        assert distances[owners == trail[i]].min() == pytest.approx(distance[i], abs=1e-6)
+    # point and fraction locate the nearest spot on the trail
+    offsets = trails[2]
+    start = offsets[trail] + point
+    spot_lat = trails[0][start] + fraction * (trails[0][start + 1] - trails[0][start])
+    spot_lon = trails[1][start] + fraction * (trails[1][start + 1] - trails[1][start])
+    gap = np.hypot((spot_lat - lat) * METERS,
+                   (spot_lon - lon) * METERS * np.cos(np.radians(lat)))
+    assert np.allclose(gap, distance, atol=1e-6)
+
+
+def test_nearest_max_distance(trails):
+    index = trails[3]
+    lat, lon = queries(trails)
+    full = index.nearest(lat, lon)
+    limited = index.nearest(lat, lon, 75)
+    close = full[1] <= 75
+    assert np.array_equal(limited[0][close], full[0][close])
+    assert np.allclose(limited[1][close], full[1][close])
+    assert (limited[0][~close] == -1).all()
+    assert np.isinf(limited[1][~close]).all()
+
+
+def test_nearest_far_away(trails):
+    index = trails[3]
+    trail, distance, _, _ = index.nearest([0.0], [0.0])
+    distances, owners = brute_force(trails, 0.0, 0.0)
+    assert distance[0] == pytest.approx(distances.min(), rel=1e-9)
+    assert trail[0] == owners[distances.argmin()]
+
+
+@pytest.mark.parametrize('radius', [10, 60, 250])
+def test_within_matches_brute_force(trails, radius):
+    index = trails[3]
+    lat, lon = queries(trails, 60)
+    for i in range(len(lat)):
+        distances, owners = brute_force(trails, lat[i], lon[i])
+        expected = np.unique(owners[distances <= radius])
+        assert np.array_equal(index.within(lat[i], lon[i], radius), expected)
+
+
+def test_bbox_matches_brute_force(trails):
+    trail_lat, trail_lon, offsets, index = trails
+    south, west, north, east = 45.01, -109.985, 45.02, -109.97
+    expected = set()
+    for trail in range(len(offsets) - 1):
+        lat = trail_lat[offsets[trail]:offsets[trail + 1]]
+        lon = trail_lon[offsets[trail]:offsets[trail + 1]]
+        # dense samples along each segment stand in for exact clipping
+        t = np.linspace(0, 1, 200)[:, None]
+        sample_lat = lat[:-1] + t * np.diff(lat)
+        sample_lon = lon[:-1] + t * np.diff(lon)
+        if ((sample_lat >= south) & (sample_lat <= north) & (sample_lon >= west) & (sample_lon <= east)).any():
+            expected.add(trail)
+    assert set(index.bbox(south, west, north, east).tolist()) == expected
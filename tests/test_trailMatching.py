@@ -0,0 +1,100 @@
+import numpy as np
+import pytest
+
+import spatialIndex
+import trailMatching
+
+METERS = spatialIndex.METERS_PER_DEGREE
+TOP = (40.6, -111.6)
+EAST = METERS * np.cos(np.radians(TOP[0]))
+
+
+# latitude and longitude of spots given in meters south and east of the top
+def place(south, east):
+    return (TOP[0] - np.asarray(south, dtype=np.float64) / METERS,
+            TOP[1] + np.asarray(east, dtype=np.float64) / EAST)
+
+
+# A runs 1200 m straight south from the top, dropping 0.3 m per meter. B runs
+# 20 m east of it from 300 m to 600 m down, and C leaves it eastwards 610 m
+# down, so a skier on A near 600 m is close to all three.
+@pytest.fixture(scope='module')
+def resort():
+    lines = [(np.arange(0, 1201, 10), np.zeros(121)),
+             (np.arange(300, 601, 10), np.full(31, 20.0)),
+             (np.full(21, 610.0), np.arange(0, 201, 10))]
+    lat, lon = place(np.concatenate([x[0] for x in lines]),
+                     np.concatenate([x[1] for x in lines]))
+    south = np.concatenate([x[0] for x in lines])
+    east = np.concatenate([x[1] for x in lines])
+    elevation = 2600 - 0.3 * south - 0.1 * east
+    offsets = np.cumsum([0] + [len(x[0]) for x in lines])
+    trails = {1: ('A', 0.2, 'blue'), 2: ('B', 0.1, 'green'),
+              3: ('C', 0.3, 'black')}
+    return trailMatching.build_resort(lat, lon, elevation, offsets, [1, 2, 3], trails)
+
+
+def descent(noise=0.0, seed=0):
+    rng = np.random.default_rng(seed)
+    south = np.arange(0, 1201, 10, dtype=np.float64)
+    east = rng.normal(0, noise, len(south)) if noise else np.zeros(len(south))
+    return (south + (rng.normal(0, noise, len(south)) if noise else 0), east)
+
+
+# 100 m west of the bottom, straight up to 100 m west of the top and back over
+def lift():
+    south = np.concatenate([[1200], np.arange(1200, -1, -20), [0]])
+    east = np.concatenate([[-50], np.full(61, -100.0), [-50]])
+    return (south.astype(np.float64), east)
+
+
+def match(resort, south, east):
+    lat, lon = place(south, east)
+    return trailMatching.match_track(resort, lat, lon)
+
+
+@pytest.mark.parametrize('laps,noise', [(3, 0.0), (5, 3.0)])
+def test_laps_stay_apart(resort, laps, noise):
+    parts = []
+    for lap in range(laps):
+        parts.append(descent(noise, lap))
+        parts.append(lift())
+    south = np.concatenate([x[0] for x in parts])
+    east = np.concatenate([x[1] for x in parts])
+    runs = match(resort, south, east)
+    assert runs['id'].tolist() == [1] * laps
+    assert np.allclose(runs['length'], 1200, atol=15)
+    assert np.allclose(runs['vertical'], 360, atol=5)
+    # each starts at the top of its lap
+    assert runs['start'].tolist() == [
+        lap * (len(parts[0][0]) + len(parts[1][0])) for lap in range(laps)]
+
+
+def test_junction_noise_is_one_run(resort):
+    south, east = descent(2.0)
+    # onto B for three points, then onto C for one, then back on A
+    east[57:60] = 15
+    south[60], east[60] = 610, 25
+    runs = match(resort, south, east)
+    assert runs['id'].tolist() == [1]
+    assert runs['start'].tolist() == [0]
+    assert runs['end'].tolist() == [len(south) - 1]
+    assert runs['length'][0] == pytest.approx(1200, abs=15)
+
+
+def test_dropout_is_one_run(resort):
+    south, east = descent(2.0, 1)
+    # a single fix out of the corridor halfway down
+    east[70] = 40
+    runs = match(resort, south, east)
+    assert runs['id'].tolist() == [1]
+    assert runs['vertical'][0] == pytest.approx(360, abs=5)
+
+
+def test_other_trail_is_its_own_run(resort):
+    # down A to the junction, then all of C
+    south = np.concatenate([np.arange(0, 601, 10), np.full(21, 610.0)])
+    east = np.concatenate([np.zeros(61), np.arange(0, 201, 10)])
+    runs = match(resort, south, east)
+    assert runs['id'].tolist() == [1, 3]
+    assert runs['start'][1] > runs['end'][0]
@@ -0,0 +1,106 @@
+import hashlib
+import json
+import os
+from os.path import exists
+
+import numpy as np
+
+# Each resort's manifest, cached/manifests/<mountain>.json, holds a record per
+# rated way: the hash of what the rating was computed from plus the results
+# (rating, length, vertical, top and bottom elevation, color). A way whose hash
+# still matches on the next run reuses its record and cached points instead of
+# being densified, looked up and rated again. The manifest also records the
+# elevation source (helper.elevation_source) its elevations came from, a run
+# with another source rates every way again. Bump VERSION when the rating
+# itself changes so every stored result is thrown away.
+VERSION = 1
+
+# Parameters:
+# df: the way's points as read from the osm file, with lat and lon columns
+#   type-df
+# name: name of the way
+#   type-str
+# difficulty_modifier: int value for additional difficulty parameters
+#   type-int
+# is_area: area flag
+#   type-bool
+#
+# Returns: hash of the way's node coordinates and the tag values it is rated with
+#   type-str
+
+
+def way_hash(df, name, difficulty_modifier, is_area):
+    content = hashlib.sha1()
+    content.update(np.ascontiguousarray(df['lat'], dtype=np.float64).tobytes())
+    content.update(np.ascontiguousarray(df['lon'], dtype=np.float64).tobytes())
+    content.update(repr((name, int(difficulty_modifier), bool(is_area))).encode())
+    return content.hexdigest()
+
+# Parameters:
+# mountain: name of ski area
+#   type-str
+#
+# Returns: the manifest, None if the mountain has none or it was written by an
+# older VERSION
+#   type-dict
+
+
+def read(mountain):
+    filename = 'cached/manifests/{}.json'.format(mountain)
+    if not exists(filename):
+        return None
+    with open(filename, 'r') as file:
+        manifest = json.load(file)
+    if manifest.get('version') != VERSION:
+        return None
+    return manifest
+
+# Parameters:
+# mountain: name of ski area
+#   type-str
+# source: elevation source the records have to come from, None for any
+#   type-str
+#
+# Returns: record of each way by OSM id, empty if the mountain has no manifest,
+# it was written by an older VERSION or from another elevation source
+#   type-dict(str, dict)
+
+
+def load(mountain, source=None):
+    manifest = read(mountain)
+    if manifest is None:
+        return {}
+    if source is not None and manifest.get('source') != source:
+        return {}
+    return manifest['ways']
+
+# Parameters:
+# mountain: name of ski area
+#   type-str
+#
+# Returns: elevation source of the mountain's manifest, None if unknown
+#   type-str
+
+
+def source(mountain):
+    manifest = read(mountain)
+    return None if manifest is None else manifest.get('source')
+
+# Parameters:
+# mountain: name of ski area
+#   type-str
+# records: record of each way by OSM id
+#   type-dict(str, dict)
+# source: elevation source the records' elevations came from
+#   type-str
+#
+# Return: none
+
+
+def save(mountain, records, source=None):
+    os.makedirs('cached/manifests', exist_ok=True)
+    filename = 'cached/manifests/{}.json'.format(mountain)
+    with open(filename + '.tmp', 'w') as file:
+        json.dump({'version': VERSION, 'source': source,
+                  'ways': records}, file)
+    os.replace(filename + '.tmp', filename)
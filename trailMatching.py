@@ -0,0 +1,211 @@
+from os.path import exists
+
+import numpy as np
+import pandas as pd
+
+import helper
+import spatialIndex
+import trailManifest
+import trailMetrics
+import trailPoints
+
+# Snaps recorded tracks onto the trails of a resort that has been processed
+# before, so a day of skiing can be reported as the rated runs it covered
+# without looking up any elevations. Every point is matched to the nearest trail
+# within a corridor, then short wobbles onto other trails between two stretches
+# of the same trail (junctions, GPS noise) are folded into that trail, and what
+# is left is kept if it is long enough and goes downhill along the trail. A
+# wobble is measured along the track, and leaving every trail always ends a run,
+# so laps of the same trail stay apart.
+
+# Parameters:
+# mountain: name of ski area
+#   type-str
+#
+# Returns: index over the rated line of every cached way of the mountain, the
+# OSM id of each line, the cached elevation and distance from the start of its
+# line of every indexed point, and the name, rating and color of every way by
+# OSM id. None if the mountain has no cached points.
+#   type-tuple(spatialIndex.TrailIndex, array(int64), array(float), array(float), dict(int, tuple))
+
+
+def load_resort(mountain):
+    points = trailPoints.load(mountain)
+    if points is None:
+        return None
+    # only the line each way is rated from, the center line of an area rather
+    # than its perimeter
+    trail_id = np.asarray(points['trail_id'])
+    for_display = np.asarray(points['for_display'])
+    has_line = np.isin(trail_id, np.unique(trail_id[~for_display]))
+    points = points[~(for_display & has_line)]
+    trail_id = np.asarray(points['trail_id'])
+    offsets = np.concatenate([[0], np.flatnonzero(
+        trail_id[1:] != trail_id[:-1]) + 1, [len(points)]]).astype(np.int64)
+    ways = trail_id[offsets[:-1]]
+
+    names = {}
+    if exists('cached/osm_ids/{}.csv'.format(mountain)):
+        id_df = pd.read_csv('cached/osm_ids/{}.csv'.format(mountain))
+        names = dict(zip(id_df['id'].tolist(), id_df['name'].fillna('').tolist()))
+
+    # stored ratings when the manifest has them, otherwise rated again from the
+    # cached slopes
+    records = trailManifest.load(mountain)
+    missing = [i for i, way in enumerate(ways.tolist())
+               if 'rating' not in records.get(str(way), {})]
+    difficulty, difficulty_offsets = trailMetrics.to_ragged([trailMetrics.point_difficulties(
+        points['slope'][offsets[i]:offsets[i + 1]]) for i in missing])
+    ratings = dict(zip(missing, trailMetrics.rate_trails(
+        difficulty, difficulty_offsets).tolist()))
+    trails = {}
+    for i, way in enumerate(ways.tolist()):
+        record = records.get(str(way), {})
+        if 'rating' in record:
+            trails[way] = (names.get(way, ''), record['rating'], record['color'])
+        else:
+            trails[way] = (names.get(way, ''), ratings[i],
+                           helper.set_color(ratings[i]))
+    return build_resort(points['lat'], points['lon'], points['elevation'], offsets, ways, trails)
+
+# Parameters:
+# lat: latitudes of the points of every line, line after line
+#   type-array(float)
+# lon: longitudes of the points of every line
+#   type-array(float)
+# elevation: elevations of the points of every line (meters)
+#   type-array(float)
+# offsets: index of the first point of each line, and one past the last point
+#   type-array(int64)
+# ways: OSM id of each line
+#   type-array(int64)
+# trails: name, rating and color of every way by OSM id
+#   type-dict(int, tuple)
+#
+# Returns: the resort as match_track takes it, see load_resort
+#   type-tuple(spatialIndex.TrailIndex, array(int64), array(float), array(float), dict(int, tuple))
+
+
+def build_resort(lat, lon, elevation, offsets, ways, trails):
+    offsets = np.asarray(offsets, dtype=np.int64)
+    index = spatialIndex.TrailIndex(lat, lon, offsets)
+    ways = np.asarray(ways, dtype=np.int64)
+    along = trailMetrics.point_distances(lat, lon)
+    along[offsets[:-1]] = 0
+    along = np.cumsum(along)
+    along -= np.repeat(along[offsets[:-1]], np.diff(offsets))
+    return (index, ways, np.asarray(elevation, dtype=np.float64), along, trails)
+
+# Parameters:
+# resort: resort from load_resort
+#   type-tuple
+# lat: latitudes of the track
+#   type-array(float)
+# lon: longitudes of the track
+#   type-array(float)
+# corridor: farthest a point can be from a trail and still be on it (meters)
+#   type-float
+# min_length: shortest stretch of a trail that counts as a run, and longest
+# detour along the track folded into a trail (meters)
+#   type-float
+#
+# Returns: the runs in the order they were skied with the way's OSM id, name,
+# rating and color, the first and last track point of the run, the distance
+# covered along the trail (meters) and the vertical dropped along it (meters)
+#   type-df(int, str, float, str, int, int, float, float)
+
+
+def match_track(resort, lat, lon, corridor=30, min_length=100):
+    index, ways, elevation, along, trails = resort
+    lat = np.asarray(lat, dtype=np.float64)
+    lon = np.asarray(lon, dtype=np.float64)
+    columns = ['id', 'name', 'rating', 'color',
+               'start', 'end', 'length', 'vertical']
+    if len(lat) == 0:
+        return pd.DataFrame(columns=columns)
+    line, _, point, fraction = index.nearest(lat, lon, corridor)
+    on_trail = line >= 0
+    way = np.full(len(lat), -1, dtype=np.int64)
+    way[on_trail] = ways[line[on_trail]]
+    # elevation and distance along its line of the spot each point was snapped
+    # to, lengths are measured along the trail so GPS noise and crossing other
+    # trails add none
+    spot = index.offsets[line[on_trail]] + point[on_trail]
+    snapped = np.full((2, len(lat)), np.nan)
+    for i, values in enumerate((elevation, along)):
+        snapped[i, on_trail] = values[spot] * \
+            (1 - fraction[on_trail]) + values[spot + 1] * fraction[on_trail]
+
+    start = np.concatenate([[0], np.flatnonzero(way[1:] != way[:-1]) + 1])
+    end = np.append(start[1:], len(way))
+    # distance covered along the track up to each point, what a detour is
+    # measured by
+    track = trailMetrics.point_distances(lat, lon)
+    track[0] = 0
+    track = np.cumsum(track)
+
+    runs = []
+    for run_way, run_start, run_end in zip(way[start].tolist(), start.tolist(), end.tolist()):
+        if run_way >= 0:
+            # back over short stretches of other trails to the same trail, a
+            # junction or GPS noise rather than a run. Never past a point off
+            # every trail, the way back up to ski the trail again.
+            for back in range(len(runs) - 1, -1, -1):
+                if runs[back][0] < 0 or track[run_start] - track[runs[back][2] - 1] >= min_length:
+                    break
+                if runs[back][0] == run_way:
+                    del runs[back + 1:]
+                    break
+        if len(runs) > 0 and runs[-1][0] == run_way:
+            runs[-1][2] = run_end
+        else:
+            runs.append([run_way, run_start, run_end])
+
+    rows = []
+    for run_way, run_start, run_end in runs:
+        run_length = span(line, snapped[1], run_start, run_end)
+        if run_way < 0 or run_length < min_length:
+            continue
+        vertical = snapped[0, run_start] - snapped[0, run_end - 1]
+        # riding a lift along a trail goes up it
+        if not vertical > 0:
+            continue
+        if len(rows) > 0 and rows[-1][0] == run_way and track[run_start] - track[rows[-1][5]] < min_length and \
+                snapped[0, run_start] < (snapped[0, rows[-1][4]] + snapped[0, rows[-1][5]]) / 2:
+            # two runs down the same trail a few steps apart, the second
+            # carrying on from the lower half of the first rather than starting
+            # another lap after a ride up
+            rows[-1][5] = run_end - 1
+            rows[-1][6] = span(line, snapped[1], rows[-1][4], run_end)
+            rows[-1][7] = snapped[0, rows[-1][4]] - snapped[0, run_end - 1]
+            continue
+        name, rating, color = trails[run_way]
+        rows.append([run_way, name, rating, color, run_start,
+                    run_end - 1, run_length, vertical])
+    return pd.DataFrame(rows, columns=columns)
+
+# Parameters:
+# line: indexed line each track point was snapped to, -1 for none
+#   type-array(int64)
+# along: distance along that line of each snapped point (meters)
+#   type-array(float)
+# start: first track point of the stretch
+#   type-int
+# end: one past the last track point of the stretch
+#   type-int
+#
+# Returns: length of the longest stretch of a single line covered (meters)
+#   type-float
+
+
+def span(line, along, start, end):
+    line = line[start:end]
+    along = along[start:end]
+    on_trail = line >= 0
+    if not on_trail.any():
+        return 0.0
+    line = line[on_trail]
+    along = along[on_trail]
+    order = np.argsort(line, kind='stable')
+    first = np.flatnonzero(np.concatenate([[True], np.diff(line[order]) != 0]))
+    return float((np.maximum.reduceat(along[order], first) - np.minimum.reduceat(along[order], first)).max())
@@ -0,0 +1,254 @@
+import numpy as np
+
+# mean earth radius in meters, the same value the haversine package uses
+EARTH_RADIUS = 6371.0088 * 1000.0
+
+# Parameters:
+# lat1, lon1: start points in degrees
+#   type-array(float)
+# lat2, lon2: end points in degrees
+#   type-array(float)
+#
+# Returns: great circle distance between each pair of points (meters)
+#   type-array(float)
+
+
+def haversine(lat1, lon1, lat2, lon2):
+    lat1 = np.radians(lat1)
+    lon1 = np.radians(lon1)
+    lat2 = np.radians(lat2)
+    lon2 = np.radians(lon2)
+    d = (np.sin((lat2 - lat1) * 0.5) ** 2
+         + np.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) * 0.5) ** 2)
+    return EARTH_RADIUS * (2 * np.arcsin(np.sqrt(d)))
+
+# Halves every segment longer than max_gap until no gap is left, the same
+# geometry as the old one-midpoint-at-a-time loop. Each round bisects all long
+# segments at once and only re-measures the new halves, so a trail costs a few
+# array passes (one per halving level) instead of a full rescan per insert.
+# Midpoints are computed as (a + b) / 2 exactly like before: densified points
+# often land on ties at the 8th decimal, and interpolating them any other way
+# would round them onto different cached coordinates.
+#
+# Parameters:
+# lat: latitudes of the trail
+#   type-array(float)
+# lon: longitudes of the trail
+#   type-array(float)
+# max_gap: longest allowed distance between points (meters)
+#   type-float
+# elevation: elevations to interpolate along with the points (optional)
+#   type-array(float)
+#
+# Returns: densified latitudes, longitudes and elevations (None if not given)
+#   type-tuple(array(float), array(float), array(float))
+
+
+def densify(lat, lon, max_gap, elevation=None):
+    lat = np.asarray(lat, dtype=np.float64)
+    lon = np.asarray(lon, dtype=np.float64)
+    if elevation is not None:
+        elevation = np.asarray(elevation, dtype=np.float64)
+    if len(lat) < 2:
+        return (lat, lon, elevation)
+
+    split = haversine(lat[1:], lon[1:], lat[:-1], lon[:-1]) > max_gap
+    while split.any():
+        index = np.flatnonzero(split)
+        lat = np.insert(lat, index + 1, (lat[index + 1] + lat[index]) / 2)
+        lon = np.insert(lon, index + 1, (lon[index + 1] + lon[index]) / 2)
+        if elevation is not None:
+            elevation = np.insert(elevation, index + 1,
+                                  (elevation[index + 1] + elevation[index]) / 2)
+        # segment index[i] is now the pair starting at index[i] + i
+        first_half = index + np.arange(len(index))
+        halves = np.concatenate([first_half, first_half + 1])
+        split = np.zeros(len(lat) - 1, dtype=bool)
+        split[halves] = haversine(
+            lat[halves + 1], lon[halves + 1], lat[halves], lon[halves]) > max_gap
+    return (lat, lon, elevation)
+
+# Parameters:
+# lat: latitudes of the trail
+#   type-array(float)
+# lon: longitudes of the trail
+#   type-array(float)
+#
+# Returns: distance from the previous point (meters), NaN for the first point
+#   type-array(float)
+
+
+def point_distances(lat, lon):
+    lat = np.asarray(lat, dtype=np.float64)
+    lon = np.asarray(lon, dtype=np.float64)
+    distance = np.full(len(lat), np.nan)
+    distance[1:] = haversine(lat[1:], lon[1:], lat[:-1], lon[:-1])
+    return distance
+
+# Parameters:
+# elevation: elevations of the trail
+#   type-array(float)
+#
+# Returns: change from the previous elevation, NaN for the first point
+#   type-array(float)
+
+
+def elevation_changes(elevation):
+    elevation = np.asarray(elevation, dtype=np.float64)
+    elevation_change = np.full(len(elevation), np.nan)
+    elevation_change[1:] = elevation[1:] - elevation[:-1]
+    return elevation_change
+
+# Parameters:
+# elevation_change: change in elevation between points
+#   type-array(float)
+# distance: distance between points, same unit as elevation_change
+#   type-array(float)
+#
+# Returns: slope in degrees, 0 for the first point and for repeated points
+#   type-array(float)
+
+
+def slopes(elevation_change, distance):
+    elevation_change = np.asarray(elevation_change, dtype=np.float64)
+    distance = np.asarray(distance, dtype=np.float64)
+    slope = np.zeros(len(distance))
+    moving = distance != 0
+    with np.errstate(divide='ignore', invalid='ignore'):
+        slope[moving] = np.degrees(
+            np.arctan(elevation_change[moving] / distance[moving]))
+    slope[:1] = 0
+    return slope
+
+# Parameters:
+# slope: slopes in degrees
+#   type-array(float)
+#
+# Returns: difficulty of each point (0-.9 scale), 0 for the first point
+#   type-array(float)
+
+
+def point_difficulties(slope):
+    difficulty = (np.abs(np.asarray(slope, dtype=np.float64)) / 90) * .9
+    difficulty[:1] = 0
+    return difficulty
+
+# Parameters:
+# lat: latitudes of the trail
+#   type-array(float)
+# lon: longitudes of the trail
+#   type-array(float)
+# elevation: elevations of the trail (meters)
+#   type-array(float)
+#
+# Returns: distance, elevation change, slope and difficulty of every point
+#   type-tuple(array(float), array(float), array(float), array(float))
+
+
+def calculate_trail_metrics(lat, lon, elevation):
+    distance = point_distances(lat, lon)
+    elevation_change = elevation_changes(elevation)
+    slope = slopes(elevation_change, distance)
+    return (distance, elevation_change, slope, point_difficulties(slope))
+
+# Parameters:
+# coordinates: list/series of latitude and longitude tuples
+#   type-list/series of tuples
+#
+# Returns: latitudes and longitudes as arrays
+#   type-tuple(array(float), array(float))
+
+
+def split_coordinates(coordinates):
+    points = np.array(list(coordinates), dtype=np.float64).reshape(-1, 2)
+    return (points[:, 0], points[:, 1])
+
+# Parameters:
+# arrays: one array per trail
+#   type-list(array(float))
+#
+# Returns: the arrays joined end to end and the offsets of each one into it
+# (trail i is values[offsets[i]:offsets[i+1]])
+#   type-tuple(array(float), array(int64))
+
+
+def to_ragged(arrays):
+    lengths = [len(x) for x in arrays]
+    offsets = np.zeros(len(arrays) + 1, dtype=np.int64)
+    offsets[1:] = np.cumsum(lengths)
+    if len(arrays) == 0:
+        return (np.zeros(0), offsets)
+    return (np.concatenate([np.asarray(x, dtype=np.float64) for x in arrays]), offsets)
+
+# Parameters:
+# difficulty: difficulty of each point on the trail
+#   type-array(float)
+#
+# Returns: highest 3 point average difficulty (0-.9 scale). Points before the
+# start of the trail count as 0, and a trail with no positive average rates 0.
+#   type-float
+
+
+def rate_trail(difficulty):
+    difficulty = np.asarray(difficulty, dtype=np.float64)
+    padded = np.concatenate([np.zeros(2), difficulty])
+    nearby_avg = (padded[2:] + padded[1:-1] + padded[:-2]) / 3
+    nearby_avg = nearby_avg[nearby_avg > 0]
+    if len(nearby_avg) == 0:
+        return 0
+    return float(nearby_avg.max())
+
+# Batched rate_trail for many trails stored end to end.
+#
+# Parameters:
+# difficulty: difficulties of every trail, see to_ragged
+#   type-array(float)
+# offsets: start of each trail in difficulty, plus the total length
+#   type-array(int64)
+#
+# Returns: rating of each trail
+#   type-array(float)
+
+
+def rate_trails(difficulty, offsets):
+    difficulty = np.asarray(difficulty, dtype=np.float64)
+    offsets = np.asarray(offsets, dtype=np.int64)
+    ratings = np.zeros(len(offsets) - 1)
+    if len(difficulty) == 0:
+        return ratings
+    # the previous two points, with zeros at the start of every trail
+    position = np.arange(len(difficulty)) - \
+        np.repeat(offsets[:-1], np.diff(offsets))
+    previous = np.zeros(len(difficulty))
+    previous[1:] = difficulty[:-1]
+    previous[position < 1] = 0
+    previous_2 = np.zeros(len(difficulty))
+    previous_2[2:] = difficulty[:-2]
+    previous_2[position < 2] = 0
+    nearby_avg = (difficulty + previous + previous_2) / 3
+    nearby_avg[~(nearby_avg > 0)] = 0
+    has_points = offsets[1:] > offsets[:-1]
+    ratings[has_points] = np.maximum.reduceat(
+        nearby_avg, offsets[:-1][has_points])
+    return ratings
+
+# Each pass replaces every point but the first and last with the average of
+# itself and its neighbours. A pass only reads values from before the pass, so
+# it is a plain 3 point moving average and can be done in one array operation.
+#
+# Parameters:
+# elevations: elevations of the trail
+#   type-array(float)
+# passes: number of times to smooth
+#   type-int
+#
+# Returns: smoothed elevations
+#   type-array(float)
+
+
+def smooth_elevations(elevations, passes=20):
+    elevations = np.array(elevations, dtype=np.float64)
+    for _ in range(passes):
+        elevations[1:-1] = (elevations[2:] +
+                            elevations[1:-1] + elevations[:-2]) / 3
+    return elevations
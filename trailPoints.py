@@ -0,0 +1,114 @@
+import sys
+from glob import glob
+from os import remove
+from os.path import exists
+
+import numpy as np
+import pandas as pd
+from tqdm import tqdm
+
+import elevationCache
+
+# Every point of every rated trail is cached per resort in
+# cached/trail_points/<mountain>.npy as a structured array with these columns.
+# for_display is False for the center line of an area, key is the point's
+# elevationCache key.
+POINT_DTYPE = np.dtype([('trail_id', np.int64), ('for_display', np.bool_), ('lat', np.float64),
+                        ('lon', np.float64), ('elevation', np.float64), ('slope', np.float32), ('key', np.int64)])
+
+# Parameters:
+# trail_id: OSM id of the way
+#   type-int
+# for_display: whether the points are drawn on the map
+#   type-bool
+# df: trail points with lat, lon, elevation and slope columns
+#   type-df
+#
+# Returns: the trail's points in the cache format
+#   type-array(POINT_DTYPE)
+
+
+def to_points(trail_id, for_display, df):
+    points = np.zeros(len(df), dtype=POINT_DTYPE)
+    points['trail_id'] = int(trail_id)
+    points['for_display'] = for_display
+    points['lat'] = df['lat']
+    points['lon'] = df['lon']
+    points['elevation'] = df['elevation']
+    points['slope'] = df['slope']
+    points['key'] = elevationCache.coordinate_keys(points['lat'], points['lon'])
+    return points
+
+# Parameters:
+# mountain: name of ski area
+#   type-str
+# points: points of every trail, see to_points
+#   type-array(POINT_DTYPE)
+#
+# Return: none
+
+
+def save(mountain, points):
+    np.save('cached/trail_points/{}.npy'.format(mountain), points)
+
+# Parameters:
+# mountain: name of ski area
+#   type-str
+#
+# Returns: cached points of the mountain, memory mapped when it has been saved
+# in the binary format, None if it has no cached points
+#   type-array(POINT_DTYPE)
+
+
+def load(mountain):
+    if exists('cached/trail_points/{}.npy'.format(mountain)):
+        return np.load('cached/trail_points/{}.npy'.format(mountain), mmap_mode='r')
+    if exists('cached/trail_points/{}.csv'.format(mountain)):
+        return load_csv('cached/trail_points/{}.csv'.format(mountain))
+    return None
+
+# Parameters:
+# filename: path to a trail_points csv from before the binary format
+#   type-str
+#
+# Returns: the csv's points in the cache format
+#   type-array(POINT_DTYPE)
+
+
+def load_csv(filename):
+    df = pd.read_csv(filename, usecols=['trail_id', 'for_display', 'lat', 'lon', 'elevation', 'slope'], dtype={
+                     'trail_id': np.int64, 'for_display': bool, 'lat': np.float64, 'lon': np.float64, 'elevation': np.float64, 'slope': np.float32})
+    points = np.zeros(len(df), dtype=POINT_DTYPE)
+    for column in df.columns:
+        points[column] = df[column]
+    points['key'] = elevationCache.coordinate_keys(points['lat'], points['lon'])
+    return points
+
+# Returns: names of every mountain with cached points
+#   type-list(str)
+
+
+def cached_mountains():
+    filenames = glob('cached/trail_points/*.npy') + \
+        glob('cached/trail_points/*.csv')
+    return sorted(set(x.split('/')[-1][:-4] for x in filenames))
+
+# Converts every trail_points csv to the binary format and removes the csv. A
+# csv that already has a newer binary file next to it is just removed.
+#
+# Return: none
+
+
+def migrate():
+    for filename in tqdm(sorted(glob('cached/trail_points/*.csv')), desc="Migrating Trail Points…", ascii=False, ncols=75):
+        mountain = filename.split('/')[-1][:-4]
+        if not exists('cached/trail_points/{}.npy'.format(mountain)):
+            save(mountain, load_csv(filename))
+        remove(filename)
+
+
+if __name__ == "__main__":
+    if sys.argv[1:] != ['migrate']:
+        print('trailPoints.py migrate')
+        sys.exit(2)
+    migrate()